@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 
+# Fetch the last <number_of_hours> hours of metrics into output/*.csv, one hour per request.
+# To backfill the metrics store (in parallel, rate limited and resumable) use scripts/backfill.py instead.
+
 # Import necessary libraries
+import os
 import sys
 import csv
 import time
@@ -23,6 +27,8 @@ sdclient = SdMonitorClient(sdc_url=URL, custom_headers=ibm_headers)
 kube_namespace = "acmeair-g4"
 kube_cluster_name = "ece750cluster"
 
+# Seconds fetched per request
+CHUNK_S = 3600
 
 
 # Function to fetch and save metrics
@@ -34,22 +40,25 @@ def fetch_and_save_metrics(metrics, coulumn_names, service_names, hours):
         # Prepare the filter
         #
 
-        filter = "kubernetes.cluster.name='%s' and kubernetes.namespace.name='%s' and kubernetes.workload.name='%s' and kubernetes.pod.name='%s'" % (kube_cluster_name, kube_namespace, service_name, service_name_pod_name)
-
-        all_data = []
-
-        ok, res = sdclient.get_data(metrics=metrics,  # List of metrics to query
-                                        start_ts= -300,
-                                        end_ts= 0,
-                                        sampling_s=10,  # 1 data point per 10 seconds
-                                        filter=filter,  # The filter specifying the target host
-                                        datasource_type='container')  # The source for our metrics is the container
-
-
-        if not ok:
+        filter = "kubernetes.cluster.name='%s' and kubernetes.namespace.name='%s' and kubernetes.workload.name='%s'" % (kube_cluster_name, kube_namespace, service_name)
+
+        # Fetch the time span one chunk at a time, oldest first
+        end_ts = int(time.time())
+        start_ts = end_ts - int(hours * 3600)
+        res = []
+        for chunk_start in range(start_ts, end_ts, CHUNK_S):
+            ok, chunk = sdclient.get_data(metrics=metrics,  # List of metrics to query
+                                          start_ts=chunk_start,
+                                          end_ts=min(chunk_start + CHUNK_S, end_ts),
+                                          sampling_s=10,  # 1 data point per 10 seconds
+                                          filter=filter,  # The filter specifying the target workload
+                                          datasource_type='container')  # The source for our metrics is the container
+
+            if not ok:
                 print("Error")
-                print(res)
+                print(chunk)
                 sys.exit(1)
+            res.append(chunk)
 
         # Specify the name of the CSV file
         csv_file = service_name + "_output.csv"
@@ -1,32 +1,69 @@
 #!/usr/bin/env python
 
 import os
+import copy
 import datetime
-import pandas as pd
 import json
-import subprocess
+import math
+import time
+
+import telemetry
+import config_cache
+import forecast
+import stabilization
+import dependencies
+import replica_scaling
+import planner
+from buffered_log import BufferedLog
+from state_journal import StateJournal, write_state_file
+from executor import DeploymentExecutor
+from metrics_store import MetricsStore
+from window_engine import WindowEngine
+from configuration_table import describe_configuration, order_by_cost, select_configuration, validate_configurations
+from utility_model import compile_utility_model, evaluate, evaluate_services, stack_utility_models, value_vector
 
 # Constants
 SCRIPTS_FOLDER = "../scripts"
 LOGS_FOLDER = "../logs"
-UPDATE_DEPLOYMENT_SCRIPT = "../scripts/executer.sh"
+CONFIGURATIONS_FOLDER = "../configurations"
+CONFIGURATION_STATES_FILE = "../configurations/configration_states.json"
+
+NAMESPACE = "acmeair-g4"
+SERVICES = ["acmeair-authservice", "acmeair-customerservice", "acmeair-bookingservice", "acmeair-flightservice"]
+
+# Number of samples (10 seconds each) averaged in every cycle
+WINDOW_SIZE = 30
+
+# Utility config of a service without analyzer_utility.json
+NO_UTILITY_CONFIG = {}
 
 # Path to the log file
 log_file = "../logs/analyzer.log"
 
-# Get the current date and time
-current_time = datetime.datetime.now()
+# Log lines of the current cycle, written once at its end
+cycle_log = BufferedLog(log_file)
+
+
+def write_log(message):
+    # Get the current date and time
+    current_time = datetime.datetime.now()
+
+    # Format the timestamp
+    timestamp = current_time.strftime("%Y-%m-%d %H:%M:%S")
+
+    # Open the log file in append mode and write the timestamp
+    with open(log_file, "a") as file:
+        file.write(f"{message} at {timestamp}\n")
 
-# Format the timestamp
-timestamp = current_time.strftime("%Y-%m-%d %H:%M:%S")
 
-# Open the log file in append mode and write the timestamp
-with open(log_file, "a") as file:
-    file.write(f"Script execution started at {timestamp}\n")
+# Load all configurations from the JSON file.
+# The validated configurations are cached until the file changes and must not be modified.
+def load_configuration_states():
+    return config_cache.load_json(CONFIGURATION_STATES_FILE, validate_configurations)
 
 
 # Fetch values for parameters for different configurations from the JSON file
-def get_configuration_values(config_key):
+def get_configuration_values(config_key, configurations=None):
     # Define default values in case the configuration key is not found
     default_values = {
         "cpu_request": "",
@@ -35,10 +72,9 @@ def get_configuration_values(config_key):
         "memory_limit": "",
         "num_pods": 1
     }
-    configuration_states_file = "../configurations/configration_states.json"
-    # Load configuration data from the JSON file
-    with open(configuration_states_file, "r") as file:
-        configurations = json.load(file)
+    # Load configuration data from the JSON file unless it was already loaded by the caller
+    if configurations is None:
+        configurations = load_configuration_states()
 
     # Get the configuration values for the specified key, or use default values
     config_data = configurations.get(config_key, default_values)
@@ -52,66 +88,81 @@ def get_configuration_values(config_key):
     return cpu_request, cpu_limit, memory_request, memory_limit, num_pods
 
 
-# Update the deployment
-def update_deployment_resources(deployment, namespace, cpu_request, cpu_limit, memory_request, memory_limit, num_pods):
-    # Call the shell script with arguments
-    subprocess.call([UPDATE_DEPLOYMENT_SCRIPT, cpu_request, cpu_limit, memory_request, memory_limit, deployment, namespace, str(num_pods)])
+# Load the utility configuration, the stabilization settings, the database dependency and the current config state of a service.
+# The utility model is compiled for the configurations in configration_states.json, ordered by cost.
+# With a state folder (one per target of the sharded controller) the config state is kept there instead.
+def load_service_config(service, configurations, state_folder=None):
+    config_state_path = os.path.join(state_folder or CONFIGURATIONS_FOLDER, service, "config_state.json")
+    if state_folder:
+        os.makedirs(os.path.dirname(config_state_path), exist_ok=True)
+
+    utility_config = load_utility_config(service)
+
+    # Load the JSON file
+    try:
+        with open(config_state_path, 'r') as json_file:
+            config_state = json.load(json_file)
+    except FileNotFoundError:
+        print(f"File '{config_state_path}' not found.")
+        config_state = {}
+    except json.JSONDecodeError:
+        # Left by a crash during a write of the former code; the journal restores the last committed state
+        print(f"File '{config_state_path}' is damaged, starting from the state in the journal.")
+        config_state = {}
+
+    return {
+        "utility_config": utility_config,
+        "utility_model": compile_utility_model(utility_config, order_by_cost(configurations)),
+        "config_state": config_state,
+        "config_state_path": config_state_path,
+        "stabilization": stabilization.load_settings(service, CONFIGURATIONS_FOLDER),
+        "dependency": dependencies.load_dependencies().get(service),
+        "replica_scaling": replica_scaling.load_replica_config()
+    }
+
+
+# Load the utility configuration of a service; cached until the file changes.
+# A missing file gives an empty utility config at startup, but raises FileNotFoundError when required (on a reload).
+def load_utility_config(service, required=False):
+    utility_config_path = os.path.join(CONFIGURATIONS_FOLDER, service, "analyzer_utility.json")
+    try:
+        return config_cache.load_json(utility_config_path)
+    except FileNotFoundError:
+        if required:
+            raise
+        print(f"File '{utility_config_path}' not found.")
+        return NO_UTILITY_CONFIG
+
+
+# Reload the configuration files of a service (hot reload of edited thresholds, weights and settings).
+# Unchanged files are not parsed again and the utility model is only recompiled when the utility config or
+# the configurations changed. Returns the updated entries of the service config, which the caller applies
+# once all services reloaded; a file that is missing, does not parse or does not validate raises and nothing is applied.
+def reload_service_config(service, service_config, configurations, configurations_changed=False):
+    utility_config = load_utility_config(service, required=True)
+    updates = {
+        "stabilization": stabilization.load_settings(service, CONFIGURATIONS_FOLDER),
+        "dependency": dependencies.load_dependencies().get(service),
+        "replica_scaling": replica_scaling.load_replica_config()
+    }
+    if configurations_changed or utility_config is not service_config["utility_config"]:
+        updates["utility_config"] = utility_config
+        updates["utility_model"] = compile_utility_model(utility_config, order_by_cost(configurations))
+    return updates
+
 
 # Using self-optimization
+# Compatibility wrapper: compiles the utility config and returns the utility of every configuration as a dictionary
 def calculate_utility(metric_values, utility_config):
+    model = compile_utility_model(utility_config)
+    utilities = evaluate(model, value_vector(model.metric_names, metric_values))
 
-    # Initialize utility variables for each criterion
-    c1u = 0
-    c2u = 0 
-    c3u = 0 
-    c4u = 0 
-    c5u = 0 
-
-    # Loop through each metric in the utility configuration
-    for config in utility_config:
-        metric_name = config["name"]
-        weight = config["weight"]
-        scaled_thresholds = config["scaled thresholds"]
-        preferences = config["preferences"]
-        metric_value = metric_values[metric_name]
-
-        # Check where the metric value falls and update utility variables accordingly
-        if metric_value > scaled_thresholds[2]:
-            c1u = c1u + weight * preferences["very high"]["C1"]
-            c2u = c2u + weight * preferences["very high"]["C2"]
-            c3u = c3u + weight * preferences["very high"]["C3"]
-            c4u = c4u + weight * preferences["very high"]["C4"]
-            c5u = c5u + weight * preferences["very high"]["C5"]
-        elif metric_value <= scaled_thresholds[2] and metric_value > scaled_thresholds[1]:
-            c1u = c1u + weight * preferences["high"]["C1"]
-            c2u = c2u + weight * preferences["high"]["C2"]
-            c3u = c3u + weight * preferences["high"]["C3"]
-            c4u = c4u + weight * preferences["high"]["C4"]
-            c5u = c5u + weight * preferences["high"]["C5"]
-        elif metric_value <= scaled_thresholds[1] and metric_value > scaled_thresholds[0]:
-            c1u = c1u + weight * preferences["medium"]["C1"]
-            c2u = c2u + weight * preferences["medium"]["C2"]
-            c3u = c3u + weight * preferences["medium"]["C3"]
-            c4u = c4u + weight * preferences["medium"]["C4"]
-            c5u = c5u + weight * preferences["medium"]["C5"]
-        else:
-            c1u = c1u + weight * preferences["low"]["C1"]
-            c2u = c2u + weight * preferences["low"]["C2"]
-            c3u = c3u + weight * preferences["low"]["C3"]
-            c4u = c4u + weight * preferences["low"]["C4"]
-            c5u = c5u + weight * preferences["low"]["C5"]
-
-    # Create a dictionary to store the calculated utilities for each criterion
-    utility_dict = {
-        "C1" : c1u,
-        "C2" : c2u,
-        "C3" : c3u,
-        "C4" : c4u,
-        "C5" : c5u
-    }
+    return dict(zip(model.config_keys, utilities.tolist()))
 
-    return utility_dict
 
+# Stack the compiled utility models of all services so they are evaluated in one call
+def build_utility_stack(service_configs):
+    return stack_utility_models({service: service_config["utility_model"] for service, service_config in service_configs.items()})
 
 
 def calculate_averages(dataframe, columns_to_average):
@@ -120,7 +171,9 @@ def calculate_averages(dataframe, columns_to_average):
         averages[column] = dataframe[column].mean()
     return averages
 
-def handle_state_change(config_state, latest_config, config_state_path):
+# The former rule: move to latest_config unless the configuration changed in the previous cycle.
+# Returns (to_update, new config state) without writing anything; kept for comparison in replay.py.
+def decide_state_change(config_state, latest_config):
     current_config = config_state["current_config"]
     previous_config = config_state["previous_config"]
     data = {}
@@ -134,134 +187,388 @@ def handle_state_change(config_state, latest_config, config_state_path):
         data["current_config"] = current_config
         data["previous_config"] = previous_config
 
-        # Write the updated JSON back to the file
-        with open(config_state_path, 'w') as json_file:
-            json.dump(data, json_file, indent=4)
+        return False, data
 
-        return False
 
-    
     # Return True only when we want to update the deployment
     # We want to update the deployment when the latest config is different from current config AND the current config and previous config are same.
     # This approach allows us to wait for a cycle when the configs have just been updated.
     # Previous config is now current config and the current config is now latest config.
-   
+
     data["current_config"] = latest_config
     data["previous_config"] = current_config
 
-    # Write the updated JSON back to the file
-    with open(config_state_path, 'w') as json_file:
-        json.dump(data, json_file, indent=4)
-
-    return True
+    return True, data
+
+
+# Number of pods the service runs now: the learned replica count, or the pods of its configuration
+def current_replicas(config_state, configurations):
+    current_config = configurations.get(config_state.get("current_config"), {})
+    return config_state.get("replicas", current_config.get("num_pods", 1))
+
+
+# Let the stabilization controller decide whether to move to latest_config, and update the in-memory state.
+# With a desired replica count, a change of the number of pods alone also updates the deployment.
+# The state is persisted by the caller (see persist_state).
+def handle_state_change(config_state, latest_config, utility_dict, configurations, settings, now=None, replicas=None):
+    now = time.time() if now is None else now
+    to_update, data, action = stabilization.decide(config_state, latest_config, utility_dict, order_by_cost(configurations), settings, now)
+
+    if replicas is not None:
+        replicas_changed, data = replica_scaling.decide_replicas(data, replicas, current_replicas(config_state, configurations), settings)
+        if replicas_changed:
+            to_update = True
+            action = f"{action}, {data['replicas']} replicas"
+
+    # Keep the in-memory state in sync for callers that reuse it across cycles
+    config_state.update(data)
 
+    return to_update, action
 
-        
 
-def main():
-    configurations = {
-        'C1': '1 Pod with limits: CPU 400m, Memory 300Mi, and requests: CPU 200m, Memory 200Mi.',
-        'C2': '1 Pod with limits: CPU 600m, Memory 500Mi, and requests: CPU 400m, Memory 300Mi.',
-        'C3': '1 Pod with limits: CPU 900m, Memory 700Mi, and requests: CPU 600m, Memory 500Mi.',
-        'C4': '1 Pod with limits: CPU 1000m, Memory 900Mi, and requests: CPU 800m, Memory 800Mi.',
-        'C5': '2 Pods with limits: CPU 1000m (each), Memory 900Mi (each), and requests: CPU 900m (each), Memory 800Mi (each).'
-    }
+# Stage the state of a service in the journal, to be written with the other services when the journal is committed.
+# Without a journal the config_state.json is replaced atomically right away.
+def persist_state(service, service_config, journal=None, best=None, action=None, updated=False):
+    if journal is None:
+        write_state_file(service_config["config_state_path"], service_config["config_state"])
+    else:
+        journal.stage(service, service_config["config_state"], service_config["config_state_path"], best, action, updated)
+
+
+# A deployment update that failed leaves the service on the configuration it ran before: restore the state from
+# before the decision (previous_state) and stage it again, so that the next cycle decides and updates again
+def revert_state(service, service_config, previous_state, journal=None, reason="deployment update failed"):
+    config_state = service_config["config_state"]
+    config_state.clear()
+    config_state.update(previous_state)
+    persist_state(service, service_config, journal, action=f"reverted: {reason}")
 
-    services = ["acmeair-authservice", "acmeair-customerservice", "acmeair-bookingservice", "acmeair-flightservice"]
 
-    for service in services:
+# Reconcile the state of a service with the result of its deployment update. A timed out update may still land,
+# so its new state is kept and marked pending: the next cycle applies the configuration again (a patch is idempotent).
+def reconcile_update(service, service_config, previous_state, result, journal=None):
+    if result.ok:
+        return
+    if result.timed_out:
+        service_config["config_state"]["pending_update"] = True
+        persist_state(service, service_config, journal, action="pending: deployment update timed out")
+    else:
+        revert_state(service, service_config, previous_state, journal)
+
+
+# Analyze a single service and update its deployment if needed.
+# saturated holds the metrics of the service's database above their saturation threshold (see dependencies.py),
+# replicas the number of pods needed for the current throughput when replica scaling is enabled,
+# planned the configuration assigned by the namespace planner (see planner.py) when it is enabled.
+# The log lines are buffered in cycle_log and the new state is staged in the journal; the caller flushes and commits them.
+def analyze_service(service, utility_dict, service_config, configurations, executor, saturated=None, replicas=None, journal=None, planned=None):
+    config_state = service_config["config_state"]
+
+    with telemetry.phase("plan", service=service):
+        # Picking the cheapest configuration with highest utility value, unless the planner assigned one
+        lowest_key = planned if planned is not None else select_configuration(utility_dict, configurations)
+
+        # Do not scale up a service whose database is the bottleneck
+        current_config = config_state.get("current_config", lowest_key)
+        capped_key = dependencies.cap_scale_up(lowest_key, current_config, order_by_cost(configurations), saturated)
+        if capped_key != lowest_key:
+            message = f"{dependencies.describe_saturation(service, service_config['dependency'], saturated)}, keeping {capped_key} instead of {lowest_key}"
+            print(message)
+            cycle_log.write(message)
+            lowest_key = capped_key
+
+        # More pods would not help either
+        if saturated and replicas is not None:
+            replicas = min(replicas, current_replicas(config_state, configurations))
+
+        to_update, action = handle_state_change(config_state, lowest_key, utility_dict, configurations, service_config["stabilization"], replicas=replicas)
+
+        # An update that timed out in an earlier cycle may not have landed: apply the current configuration again
+        if config_state.pop("pending_update", False) and not to_update:
+            to_update = True
+            action = f"{action}, re-applying a pending update"
+        persist_state(service, service_config, journal, lowest_key, action, to_update)
+
+    if to_update:
+        # The tier the stabilization controller settled on: a change of the replica count alone keeps the current tier
+        applied_key = config_state["current_config"]
+
+        # fetch the deployment update parameters
+        cpu_request, cpu_limit, memory_request, memory_limit, num_pods = get_configuration_values(applied_key, configurations)
+        deployment = service
+
+        # With replica scaling the configuration only sets the resources of a pod
+        if service_config["replica_scaling"]["enabled"] and "replicas" in config_state:
+            num_pods = config_state["replicas"]
+
+        # update the deployment parameters; the update runs in the background and is awaited at the end of the cycle
+        executor.submit(deployment, cpu_request, cpu_limit, memory_request, memory_limit, num_pods)
+
+        print("\n\nAnalysis for Service: ", service)
+        print("Utility dictionary is:")
+        print(utility_dict)
+        print("Choosing configuration: ", applied_key)
+        print("Set: ", describe_configuration(dict(configurations[applied_key], num_pods=num_pods)))
+
+        cycle_log.write_lines(["-------------------------------------------------------", f"Analysis for Service: {service}", "Utility dictionary is:"]
+                              + [f"{key}: {value}" for key, value in utility_dict.items()]
+                              + [f"Choosing configuration: {applied_key}", f"Set: {describe_configuration(dict(configurations[applied_key], num_pods=num_pods))}"])
+
+    else:
+        print("\n\nAnalysis for Service: ", service)
+        print(f"No update needed in this cycle (best: {lowest_key}, {action}).")
+
+        cycle_log.write_lines(["-------------------------------------------------------", f"Analysis for Service: {service}",
+                               f"No update needed in this cycle (best: {lowest_key}, {action})."])
+
+    return lowest_key, to_update
+
+
+# Replace the window values of the forecast metrics by their predicted values for the next interval.
+# A long history is read from a rollup tier of the store, and the forecast then steps in that tier's buckets.
+def forecast_metric_values(service, metric_values, store, forecast_config):
+    with telemetry.phase("forecast", service=service):
+        history, step_s = store.read_history(service, forecast_config["history_s"])
+        predicted = forecast.forecast_metric_values(metric_values, history, store.columns(service), dict(forecast_config, sampling_s=step_s))
+
+    for metric in forecast_config["metrics"]:
+        if metric in predicted:
+            print(f"Forecast for {service} {metric}: {metric_values[metric]:.3f} -> {predicted[metric]:.3f}")
+    return predicted
+
+
+# Number of pods needed for the request rate of a service, or None without replica scaling or a learned capacity
+def desired_replicas(service, service_metric_values, service_config, configurations, store, windows):
+    replica_config = service_config["replica_scaling"]
+    if not replica_config["enabled"]:
+        return None
+
+    with telemetry.phase("capacity", service=service):
+        capacity = replica_scaling.learn_capacity(store, service, replica_config)
+    if capacity is None:
+        print(f"Capacity of {service} could not be learned, keeping the pods of its configuration")
+        return None
+
+    # The (possibly forecast) request count of the utility metrics, or the window mean
+    requests_per_pod = service_metric_values.get(replica_scaling.REQUEST_METRIC, windows.statistics(service, replica_scaling.REQUEST_METRIC)["mean"])
+    if math.isnan(requests_per_pod):
+        return None
+
+    replicas = replica_scaling.desired_replicas(requests_per_pod, current_replicas(service_config["config_state"], configurations), capacity, replica_scaling.bounds(replica_config, service))
+    print(f"{service}: {requests_per_pod:.1f} requests per pod, capacity {capacity:.1f}, {replicas} replicas needed")
+    return replicas
+
+
+# Configuration a service would run in this cycle if latest_config were chosen for it: the stabilization controller
+# may hold the move and keep the current configuration
+def stabilized_config(config_state, latest_config, utility_dict, ranking, settings, now):
+    current_config = config_state.get("current_config", latest_config)
+    if latest_config == current_config or current_config not in ranking:
+        return latest_config
+    to_update, _, _ = stabilization.decide(config_state, latest_config, utility_dict, ranking, settings, now)
+    return latest_config if to_update else current_config
+
+
+# Assign configurations to the analyzed services under the namespace budget of the planner config.
+# The workloads the analyzer does not manage and the services that are not analyzed in this cycle keep their resources
+# (the latter those of their current configuration), and a service whose
+# database is saturated is only offered configurations up to its current one. A move the stabilization controller
+# would hold counts with the resources of the configuration the service keeps.
+# Returns ({service: planner.Option} or None when nothing fits, reserved (CPU, memory), budget (CPU, memory)).
+def plan_services(service_configs, configurations, windows, metric_values, utilities, saturated, replicas, planner_config, now=None):
+    now = time.time() if now is None else now
+    ranking = order_by_cost(configurations)
+    budget = planner.budget_totals(planner_config)
+    reserved = planner.unmanaged_totals(planner_config)
+    options_by_service = {}
+
+    for service, service_config in service_configs.items():
+        config_state = service_config["config_state"]
+        current_config = config_state.get("current_config")
+        if current_config not in configurations:
+            current_config = ranking[0]
+        current_pods = current_replicas(config_state, configurations)
+
+        if service not in utilities:
+            reserved = planner.add_totals(reserved, planner.requested(configurations[current_config], current_pods))
+            continue
+
+        def current_value(metric):
+            value = metric_values[service].get(metric)
+            return value if value is not None else windows.statistics(service, metric)["mean"]
+
+        allowed = ranking[:ranking.index(current_config) + 1] if saturated.get(service) else None
+        applied = {config_key: stabilized_config(config_state, config_key, utilities[service], ranking, service_config["stabilization"], now) for config_key in ranking}
+        options_by_service[service] = planner.service_options(utilities[service], configurations, current_config, current_pods,
+                                                              current_value(planner.CPU_METRIC), current_value(planner.HTTP_ERROR_METRIC),
+                                                              planner.service_slo(planner_config, service), planner_config, allowed, replicas.get(service), applied)
+
+    return planner.plan(options_by_service, *budget, reserved), reserved, budget
+
+
+# One analysis pass over all services, reusing already loaded service configs and configurations.
+# The sliding windows are updated with the samples stored since the previous cycle only,
+# then the utilities of all services are computed with a single call on the stacked utility models.
+# With forecasting enabled, the utilities use the load predicted for the next interval instead of the last window.
+# The windows of the databases the services depend on are updated as well, to detect saturated databases.
+# With the planner enabled, the configurations of all services are chosen together under the namespace budget.
+# The new states of all services are committed to the journal in one transaction once every service is planned,
+# and the log lines of the cycle are written at its end, even when it fails.
+# A service degrades on its own: it keeps its configuration in this cycle when no new samples were stored for it
+# (e.g. its fetch failed), when its analysis fails, or once the deadline (a time.monotonic() value) has passed.
+# The deployment updates are awaited at most execute_timeout_s seconds, and their outcomes are counted in health.
+# Returns the degraded services with the reason.
+def run_analyzer(service_configs, configurations, store, windows, utility_stack, executor, forecast_config=None, journal=None, planner_config=None,
+                 deadline=None, execute_timeout_s=None, health=None):
+    try:
+        return analyze_services(service_configs, configurations, store, windows, utility_stack, executor, forecast_config, journal, planner_config,
+                                deadline, execute_timeout_s, health)
+    finally:
+        cycle_log.flush()
+
+
+def degrade(degraded, service, reason):
+    degraded[service] = reason
+    message = f"Keeping the configuration of {service} in this cycle: {reason}"
+    print(message)
+    cycle_log.write(message)
+
+
+def deadline_passed(deadline):
+    return deadline is not None and time.monotonic() > deadline
+
+
+def analyze_services(service_configs, configurations, store, windows, utility_stack, executor, forecast_config, journal, planner_config,
+                     deadline=None, execute_timeout_s=None, health=None):
+    degraded = {}
+
+    for database in dependencies.databases(service_config["dependency"] for service_config in service_configs.values()):
+        try:
+            with telemetry.phase("window_update", service=database):
+                windows.update_from_store(store, database)
+        except Exception as e:
+            print(f"Error updating the window of {database}: {e}")
+            cycle_log.write(f"ERROR updating the window of {database}: {e}")
+
+    metric_values = {}
+    for service in service_configs:
+        if deadline_passed(deadline):
+            degrade(degraded, service, "analysis deadline passed")
+            continue
+        try:
+            with telemetry.phase("window_update", service=service):
+                new_samples = windows.update_from_store(store, service)
+
+            # Without data every metric would fall into the lowest band and the service would be scaled down
+            if not windows.has_data(service):
+                print("\n\nAnalysis for Service: ", service)
+                print("No metrics stored yet, skipping.")
+                continue
+
+            # The window still holds the samples of the previous cycle
+            if new_samples == 0:
+                degrade(degraded, service, "no new samples stored")
+                continue
+
+            metric_values[service] = windows.metric_values(service, service_configs[service]["utility_config"])
+
+            if forecast_config and forecast_config["enabled"]:
+                metric_values[service] = forecast_metric_values(service, metric_values[service], store, forecast_config)
+        except Exception as e:
+            metric_values.pop(service, None)
+            degrade(degraded, service, f"analysis failed: {e}")
+
+    with telemetry.phase("utility"):
+        utilities = evaluate_services(utility_stack, metric_values)
+
+    saturated = {}
+    replicas = {}
+    for service in list(metric_values):
+        try:
+            saturated[service] = dependencies.database_saturation(service_configs[service]["dependency"], windows)
+            replicas[service] = desired_replicas(service, metric_values[service], service_configs[service], configurations, store, windows)
+        except Exception as e:
+            del metric_values[service]
+            del utilities[service]
+            degrade(degraded, service, f"analysis failed: {e}")
+
+    planned = {}
+    if planner_config and planner_config["enabled"]:
+        with telemetry.phase("budget_plan"):
+            assignment, reserved, budget = plan_services(service_configs, configurations, windows, metric_values, utilities, saturated, replicas, planner_config)
+        if assignment is None:
+            message = "The namespace budget cannot hold the cheapest configurations of all services, choosing per service"
+        else:
+            planned = {service: option.config_key for service, option in assignment.items()}
+            message = f"Plan: {planner.describe_plan(assignment, reserved, *budget)}"
+        print(message)
+        cycle_log.write(message)
+
+    # State of every updated service before the decision, restored when its deployment update does not succeed
+    previous_states = {}
+    for service in metric_values:
+        if deadline_passed(deadline):
+            degrade(degraded, service, "analysis deadline passed")
+            continue
+        try:
+            previous_state = copy.deepcopy(service_configs[service]["config_state"])
+            _, to_update = analyze_service(service, utilities[service], service_configs[service], configurations, executor, saturated[service], replicas[service], journal,
+                                           planned.get(service))
+            if to_update:
+                previous_states[service] = previous_state
+        except Exception as e:
+            degrade(degraded, service, f"analysis failed: {e}")
+
+    # Wait for the deployment updates, which run concurrently; the states are committed once their results are known
+    with telemetry.phase("execute"):
+        results = executor.wait(execute_timeout_s)
+    for result in results:
+        telemetry.record("execute_deployment", result.duration_s, service=result.deployment)
+        print(result)
+        cycle_log.write_lines([str(result)] + ([result.output] if not result.ok else []))
+        if not result.ok:
+            print(result.output)
+            degraded[result.deployment] = "deployment update timed out" if result.timed_out else "deployment update failed"
+            if result.deployment in previous_states:
+                reconcile_update(result.deployment, service_configs[result.deployment], previous_states[result.deployment], result, journal)
+        if health is not None:
+            health.record_phase("execute", "ok" if result.ok else "timed_out" if result.timed_out else "failed", result.duration_s, execute_timeout_s)
+
+    if journal is not None:
+        with telemetry.phase("persist"):
+            journal.commit()
+
+    # Persist the windows so that the next cycle (or process) continues from here
+    windows.save()
+
+    return degraded
 
-        dataset = "../output/" + service + "_output.csv"
-        utility_config_path = "../configurations/" + service + "/analyzer_utility.json"
-        config_state_path = "../configurations/" + service + "/config_state.json"
 
-        # Read the CSV
-        df = pd.read_csv(dataset)
-        # Keep only the last 30 entries in df
-        df = df.tail(30)
+def main():
+    write_log("Script execution started")
+    telemetry.begin_cycle(component="analyzer")
 
-        # Load the JSON file
-        try:
-            with open(utility_config_path, 'r') as json_file:
-                utility_config = json.load(json_file)
-        except FileNotFoundError:
-            print(f"File '{utility_config_path}' not found.")
-            utility_config = {}
+    configurations = load_configuration_states()
+    service_configs = {service: load_service_config(service, configurations) for service in SERVICES}
 
-        # Load the JSON file
-        try:
-            with open(config_state_path, 'r') as json_file:
-                config_state = json.load(json_file)
-        except FileNotFoundError:
-            print(f"File '{config_state_path}' not found.")
-            config_state = {}
-
-        # Extract all the metric names to analyze
-        metrics = [item["name"] for item in utility_config]
-    
-        averages = calculate_averages(df, metrics)
-
-        utility_dict = calculate_utility(averages, utility_config)
-
-        # Picking the lowest possible configuration with highest utility value
-        # Find the highest value
-        max_value = max(utility_dict.values())
-
-        # Filter keys with the highest value
-        highest_value_keys = [key for key, value in utility_dict.items() if value == max_value]
-
-        # Sort the filtered keys and get the lowest one
-        lowest_key = min(highest_value_keys)
-        
-        to_update = handle_state_change(config_state, lowest_key, config_state_path)
-
-        if to_update:
-            # fetch the deployment update parameters
-            cpu_request, cpu_limit, memory_request, memory_limit, num_pods = get_configuration_values(lowest_key)
-            deployment = service
-            namespace = "acmeair-g4"
-
-            # update the deployment parameters
-            update_deployment_resources(deployment, namespace, cpu_request, cpu_limit, memory_request, memory_limit, num_pods)
-
-            print("\n\nAnalysis for Service: ", service)
-            print("Utility dictionary is:")
-            print(utility_dict)
-            print("Choosing configuration: ", lowest_key)
-            print("Set: ", configurations[lowest_key])
-
-            # Open the log file in append mode and write the timestamp
-            with open(log_file, "a") as file:
-                file.write("-------------------------------------------------------\n")
-                file.write("Analysis for Service: {}\n".format(service))
-                file.write("Utility dictionary is:\n")
-                for key, value in utility_dict.items():
-                    file.write(f"{key}: {value}\n")
-
-                file.write(f"Choosing configuration: {lowest_key}\n")
-                file.write(f"Set: {configurations[lowest_key]}\n")
+    journal = StateJournal()
+    for service in journal.recover(service_configs):
+        print(f"Restored the config state of {service} from the journal")
 
-        else:
-            print("\n\nAnalysis for Service: ", service)
-            print("No update needed in this cycle.")
+    windows = WindowEngine(WINDOW_SIZE)
+    windows.load()
 
-            # Open the log file in append mode and write the timestamp
-            with open(log_file, "a") as file:
-                file.write("-------------------------------------------------------\n")
-                file.write("Analysis for Service: {}\n".format(service))
-                file.write("No update needed in this cycle.\n")
+    executor = DeploymentExecutor(NAMESPACE)
 
-            
+    run_analyzer(service_configs, configurations, MetricsStore(), windows, build_utility_stack(service_configs), executor, forecast.load_forecast_config(), journal,
+                 planner.load_planner_config())
 
-    # Open the log file in append mode and write the timestamp
-    with open(log_file, "a") as file:
-        # Get the current date and time
-        current_time = datetime.datetime.now()
+    executor.shutdown()
+    journal.close()
 
-        # Format the timestamp
-        timestamp = current_time.strftime("%Y-%m-%d %H:%M:%S")
+    telemetry.end_cycle()
 
-        file.write(f"Script execution ended at {timestamp}\n")
+    write_log("Script execution ended")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+# Backfill of the metrics store with historical samples.
+#
+# The time range is split into chunks (one hour by default), and every (workload, chunk) is fetched with one
+# request, or one request per chunk for all app workloads with --batched. Up to --concurrency requests run at
+# once, and no more than --rate requests are started per second. The chunks are merged into the metrics store
+# as they arrive, deduplicated by timestamp, so an overlap with samples the monitor already stored is harmless.
+# A segment is locked while it is rewritten, so samples the live monitor appends to it meanwhile are kept.
+#
+# Progress is checkpointed in state/backfill.json after every chunk: the resolved time range and the chunks
+# already merged. An interrupted run continues where it stopped with --resume. The rollups of the backfilled
+# services are rebuilt once at the end rather than after every chunk.
+#
+# Usage: python3 backfill.py --days 14 [--chunk 3600] [--concurrency 4] [--rate 2] [--batched] [--target <name>]
+#        python3 backfill.py --resume
+
+import argparse
+import datetime
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import monitor
+import targets as target_config
+from metrics_store import MetricsStore
+from window_engine import STATE_FOLDER
+
+# Constants
+CHECKPOINT_FILE = os.path.join(STATE_FOLDER, "backfill.json")
+DEFAULT_CHUNK_S = 3600
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RATE = 2.0
+SAMPLING_S = 10
+
+# Path to the log file
+log_file = "../logs/backfill.log"
+
+
+def write_log(message):
+    # Get the current date and time
+    current_time = datetime.datetime.now()
+
+    # Format the timestamp
+    timestamp = current_time.strftime("%Y-%m-%d %H:%M:%S")
+
+    # Open the log file in append mode and write the timestamp
+    with open(log_file, "a") as file:
+        file.write(f"{message} at {timestamp}\n")
+
+
+# Starts at most `rate` requests per second, shared by all fetching threads
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+# Chunk start times covering [start, end), aligned to the chunk size so that resumed runs produce the same chunks
+def chunk_starts(start, end, chunk_s):
+    first = math.floor(start / chunk_s) * chunk_s
+    return list(range(int(first), int(end), int(chunk_s)))
+
+
+def new_checkpoint(start, end, chunk_s, target_name, batched):
+    return {"target": target_name, "start": start, "end": end, "chunk_s": chunk_s, "batched": batched,
+            "done": {}, "rollups_since": {}}
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as json_file:
+        return json.load(json_file)
+
+
+def save_checkpoint(path, checkpoint):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as json_file:
+        json.dump(checkpoint, json_file, indent=4)
+    os.replace(temp_path, path)
+
+
+# Requests of the backfill: (workloads, metrics, column names, grouped, chunk start), skipping chunks merged before.
+# A request is repeated as long as any of its workloads has not merged the chunk.
+def plan_requests(checkpoint, metric_specs, target):
+    app_services = target.monitored_services
+    groups = []
+    if checkpoint["batched"]:
+        groups += [(batch, metric_specs["app"], True) for batch in monitor.make_batches(app_services)]
+    else:
+        groups += [([service], metric_specs["app"], False) for service in app_services]
+    groups += [([service], metric_specs["db"], False) for service in target.databases]
+
+    done = {service: set(chunks) for service, chunks in checkpoint["done"].items()}
+    requests = []
+    for chunk_start in chunk_starts(checkpoint["start"], checkpoint["end"], checkpoint["chunk_s"]):
+        for services, spec, grouped in groups:
+            if all(chunk_start in done.get(service, ()) for service in services):
+                continue
+            requests.append((services, spec["metrics"], spec["column_display_name"], grouped, chunk_start))
+    return requests
+
+
+# Fetch one chunk, waiting for the rate limiter before every attempt; returns {workload: rows}
+def fetch_chunk(sdclient, limiter, services, metrics, column_names, chunk_start, chunk_end, scope, grouped):
+    def fetch():
+        limiter.wait()
+        if grouped:
+            return monitor.fetch_metrics_batch(sdclient, metrics, column_names, services, chunk_start, scope, chunk_end)
+        res = monitor.fetch_metrics(sdclient, metrics, services[0], chunk_start, scope, chunk_end)
+        return {services[0]: monitor.response_to_rows(res, column_names, services[0])}
+
+    label = f"{', '.join(services)} at {chunk_start}"
+    return monitor.call_with_retries(label, monitor.FETCH_TIMEOUT_S, monitor.FETCH_RETRIES, fetch)
+
+
+def run_backfill(sdclient, store, checkpoint, checkpoint_path, metric_specs, target, concurrency, rate):
+    requests = plan_requests(checkpoint, metric_specs, target)
+    chunk_s = checkpoint["chunk_s"]
+    print(f"{len(requests)} requests to fetch, {concurrency} at a time, at most {rate} per second")
+
+    limiter = RateLimiter(rate)
+    merged_samples = 0
+    failed = 0
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {}
+        for services, metrics, column_names, grouped, chunk_start in requests:
+            chunk_end = min(chunk_start + chunk_s, checkpoint["end"])
+            future = pool.submit(fetch_chunk, sdclient, limiter, services, metrics, column_names, chunk_start, chunk_end, target.scope, grouped)
+            futures[future] = (services, column_names, chunk_start)
+
+        # Merged from this thread only, so the store and the checkpoint have a single writer
+        for completed, future in enumerate(as_completed(futures), 1):
+            services, column_names, chunk_start = futures[future]
+            try:
+                rows_by_service = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Error: {e}")
+                write_log(f"ERROR: {e}")
+                continue
+
+            for service in services:
+                rows = rows_by_service.get(service)
+                if rows is not None and len(rows):
+                    merged_samples += store.merge(service, column_names, rows, rollups=False)
+                    oldest = float(rows[:, -1].min())
+                    checkpoint["rollups_since"][service] = min(checkpoint["rollups_since"].get(service, oldest), oldest)
+                checkpoint["done"].setdefault(service, []).append(chunk_start)
+            save_checkpoint(checkpoint_path, checkpoint)
+
+            if completed % 50 == 0 or completed == len(futures):
+                elapsed = time.monotonic() - started
+                print(f"{completed}/{len(futures)} requests done, {merged_samples} samples merged in {elapsed:.1f}s")
+
+    # The rollups of the merged range are rebuilt once per service
+    for service, since in list(checkpoint["rollups_since"].items()):
+        written = store.refresh_rollups(service, since)
+        print(f"{service}: rollups rebuilt ({', '.join(f'{count} rows in {tier}' for tier, count in written.items())})")
+        del checkpoint["rollups_since"][service]
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    return merged_samples, failed
+
+
+def find_target(name):
+    if name is None:
+        return target_config.default_target()
+    for target in target_config.load_targets():
+        if target.name == name:
+            return target
+    raise SystemExit(f"Unknown target '{name}'")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backfill the metrics store with historical samples.")
+    parser.add_argument("--days", type=float, help="Days to backfill, counting back from now.")
+    parser.add_argument("--hours", type=float, help="Hours to backfill, counting back from now.")
+    parser.add_argument("--end", type=float, help="End of the range in epoch seconds (default: now).")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK_S, help="Seconds fetched per request (default: 3600).")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Requests running at once (default: 4).")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Requests started per second at most (default: 2).")
+    parser.add_argument("--batched", action="store_true", help="Fetch all app workloads of a chunk with one request.")
+    parser.add_argument("--target", help="Target of configurations/targets.json (default: the namespace configured in monitor.py).")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="Checkpoint file (default: ../state/backfill.json).")
+    parser.add_argument("--resume", action="store_true", help="Continue the range of the checkpoint file instead of starting a new backfill.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.makedirs(os.path.dirname(args.checkpoint), exist_ok=True)
+
+    if args.resume:
+        checkpoint = load_checkpoint(args.checkpoint)
+        if checkpoint is None:
+            raise SystemExit(f"No checkpoint found at '{args.checkpoint}'")
+        print(f"Resuming the backfill of {checkpoint['start']:.0f} to {checkpoint['end']:.0f}")
+    else:
+        span_s = (args.days or 0) * 86400 + (args.hours or 0) * 3600
+        if span_s <= 0:
+            raise SystemExit("Give the range to backfill with --days and/or --hours, or --resume")
+        end = args.end or math.floor(time.time() / SAMPLING_S) * SAMPLING_S
+        checkpoint = new_checkpoint(end - span_s, end, args.chunk, args.target, args.batched)
+        save_checkpoint(args.checkpoint, checkpoint)
+
+    target = find_target(checkpoint["target"])
+    store = MetricsStore(target.store_folder)
+    sdclient = monitor.create_client()
+
+    write_log(f"Backfill of {checkpoint['start']:.0f} to {checkpoint['end']:.0f} started")
+    merged_samples, failed = run_backfill(sdclient, store, checkpoint, args.checkpoint, monitor.load_metric_specs(), target, args.concurrency, args.rate)
+    write_log(f"Backfill ended: {merged_samples} samples merged, {failed} failed requests")
+
+    print(f"{merged_samples} samples merged, {failed} failed requests")
+    if failed:
+        print("Run again with --resume to fetch the failed chunks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+# Backtest of the load forecasters on the recorded history.
+#
+# Every cycle (30 samples) of the recorded traces, each method forecasts the mean of the forecast metrics over
+# [lead time, lead time + horizon) from the samples before the cycle end, and the forecast is compared with
+# what was actually recorded. "window" is the reactive baseline: the mean of the last window, which is what
+# the analyzer uses without forecasting. Settings default to configurations/forecast.json.
+#
+# Usage: python3 backtest_forecast.py [--methods holt,holt_winters] [--lead-time 300] [--history 7200] [--source csv|store]
+
+import argparse
+import json
+
+import numpy as np
+
+import analyzer
+import forecast
+from replay import load_traces
+
+# Constants
+BASELINE = "window"
+
+
+# Forecasts and actual interval means at every cycle end that has enough history and a complete future interval
+def backtest_series(series, method, config, cycle_samples=analyzer.WINDOW_SIZE):
+    config = dict(config, method=method)
+    history = forecast.history_samples(config)
+    lead_steps = int(config["lead_time_s"] // config["sampling_s"])
+    horizon_steps = max(1, int(config["horizon_s"] // config["sampling_s"]))
+
+    predictions = []
+    actuals = []
+    for end in range(cycle_samples, len(series) - lead_steps - horizon_steps + 1, cycle_samples):
+        if method == BASELINE:
+            predicted = float(np.nanmean(series[end - cycle_samples:end]))
+        else:
+            predicted = forecast.predict_interval(series[max(0, end - history):end], config)
+        predictions.append(predicted)
+        actuals.append(float(np.nanmean(series[end + lead_steps:end + lead_steps + horizon_steps])))
+
+    return np.array(predictions), np.array(actuals)
+
+
+# Mean absolute error, and the symmetric mean absolute percentage error which stays defined when the load is 0
+def accuracy(predictions, actuals):
+    valid = ~(np.isnan(predictions) | np.isnan(actuals))
+    predictions = predictions[valid]
+    actuals = actuals[valid]
+    if len(actuals) == 0:
+        return {"points": 0, "mae": float("nan"), "smape": float("nan")}
+
+    denominator = np.abs(predictions) + np.abs(actuals)
+    ratios = np.divide(2 * np.abs(predictions - actuals), denominator, out=np.zeros_like(denominator), where=denominator > 0)
+    return {
+        "points": int(len(actuals)),
+        "mae": float(np.mean(np.abs(predictions - actuals))),
+        "smape": float(100 * np.mean(ratios))
+    }
+
+
+def run_backtest(traces, methods, config):
+    results = {}
+    for service, trace in traces.items():
+        results[service] = {}
+        for metric in config["metrics"]:
+            if metric not in trace.columns:
+                continue
+            series = trace[metric].to_numpy(dtype=float)
+            results[service][metric] = {method: accuracy(*backtest_series(series, method, config)) for method in methods}
+    return results
+
+
+def print_results(results, methods):
+    for service, metrics in results.items():
+        print(f"\nService: {service}")
+        for metric, by_method in metrics.items():
+            print(f"  {metric}")
+            baseline_mae = by_method.get(BASELINE, {}).get("mae")
+            for method in methods:
+                result = by_method[method]
+                line = f"    {method:<15} MAE {result['mae']:10.3f}  sMAPE {result['smape']:6.1f}%  ({result['points']} points)"
+                if baseline_mae and method != BASELINE:
+                    line += f"  MAE vs window: {100 * (result['mae'] / baseline_mae - 1):+.0f}%"
+                print(line)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backtest the load forecasters against the recorded history.")
+    parser.add_argument("--methods", default=",".join(forecast.METHODS + [BASELINE]), help="Comma separated methods (default: all).")
+    parser.add_argument("--lead-time", type=float, help="Lead time in seconds (default: from forecast.json).")
+    parser.add_argument("--horizon", type=float, help="Forecast interval in seconds (default: from forecast.json).")
+    parser.add_argument("--history", type=float, help="History used per forecast in seconds (default: from forecast.json).")
+    parser.add_argument("--season", type=float, help="Season length in seconds (default: from forecast.json).")
+    parser.add_argument("--source", choices=["csv", "store"], default="csv", help="Read the history from output/*.csv or from the metrics store (default: csv).")
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    config = dict(forecast.load_forecast_config())
+    for key, value in [("lead_time_s", args.lead_time), ("horizon_s", args.horizon), ("history_s", args.history), ("season_length_s", args.season)]:
+        if value is not None:
+            config[key] = value
+
+    methods = args.methods.split(",")
+    for method in methods:
+        if method not in forecast.METHODS + [BASELINE]:
+            raise SystemExit(f"Unknown method '{method}', choose from {', '.join(forecast.METHODS + [BASELINE])}")
+
+    print(f"Lead time {config['lead_time_s']:.0f}s, horizon {config['horizon_s']:.0f}s, history {config['history_s']:.0f}s, season {config['season_length_s']:.0f}s")
+    results = run_backtest(load_traces(analyzer.SERVICES, args.source), methods, config)
+    print_results(results, methods)
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+# Offline benchmark of the sequential, concurrent and batched monitor fetch modes against the stub metrics client,
+# and of decoding a large response into store rows.
+# Usage: python3 benchmark_monitor.py [--workloads 50] [--latency 0.2] [--jitter 0.1] [--concurrency 16] [--decode-samples 100000]
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import ingest
+import monitor
+from metrics_store import MetricsStore
+from stub_monitor_client import StubMonitorClient
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark sequential, concurrent and batched metric fetching offline.")
+    parser.add_argument("--workloads", type=int, default=50, help="Number of workloads to fetch (default: 50).")
+    parser.add_argument("--latency", type=float, default=0.2, help="Simulated latency of one request in seconds (default: 0.2).")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Maximum random extra latency in seconds (default: 0.1).")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrency cap of the concurrent mode (default: 16).")
+    parser.add_argument("--decode-samples", type=int, default=100000, help="Samples in the response of the decode benchmark (default: 100000).")
+    return parser.parse_args()
+
+
+# Time decoding one response with per-row lists (the former way) and with ingest.decode
+def benchmark_decode(coulumn_names, samples):
+    sdclient = StubMonitorClient(latency_s=0, seed=0)
+    _, res = sdclient.get_data(metrics=[{"id": "metric", "aggregations": {}}] * (len(coulumn_names) - 1), start_ts=-samples * 10, sampling_s=10)
+
+    start = time.perf_counter()
+    per_row = np.array([entry['d'] + [entry['t']] for entry in res['data']], dtype=float)
+    per_row_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = ingest.decode(res, coulumn_names)
+    decode_s = time.perf_counter() - start
+
+    assert np.array_equal(per_row, decoded)
+    return len(res['data']), per_row_s, decode_s
+
+
+def main():
+    args = parse_args()
+
+    metric_specs = monitor.load_metric_specs()
+    data_dict = metric_specs["app"]
+    service_names = [f"workload-{i}" for i in range(args.workloads)]
+
+    with tempfile.TemporaryDirectory() as store_folder:
+        # Keep the benchmark output away from the real metrics store
+        store = MetricsStore(store_folder)
+
+        sdclient = StubMonitorClient(latency_s=args.latency, jitter_s=args.jitter, seed=0)
+        start = time.perf_counter()
+        monitor.fetch_and_save_metrics(sdclient, store, data_dict["metrics"], data_dict["column_display_name"], service_names)
+        sequential_s = time.perf_counter() - start
+
+        sdclient = StubMonitorClient(latency_s=args.latency, jitter_s=args.jitter, seed=0)
+        jobs = [(data_dict["metrics"], data_dict["column_display_name"], service_name) for service_name in service_names]
+        start = time.perf_counter()
+        monitor.fetch_and_save_metrics_concurrently(sdclient, store, jobs, max_workers=args.concurrency)
+        concurrent_s = time.perf_counter() - start
+
+        sdclient = StubMonitorClient(latency_s=args.latency, jitter_s=args.jitter, seed=0)
+        batches = [(data_dict["metrics"], data_dict["column_display_name"], batch) for batch in monitor.make_batches(service_names)]
+        start = time.perf_counter()
+        monitor.fetch_and_save_metrics_batched(sdclient, store, batches, max_workers=args.concurrency)
+        batched_s = time.perf_counter() - start
+        batched_calls = sdclient.calls
+
+    print(f"\nWorkloads: {args.workloads}, latency: {args.latency}s (+ up to {args.jitter}s), concurrency: {args.concurrency}")
+    print(f"Sequential: {sequential_s:.2f}s")
+    print(f"Concurrent: {concurrent_s:.2f}s")
+    print(f"Speedup: {sequential_s / concurrent_s:.1f}x")
+    print(f"Batched: {batched_s:.2f}s with {batched_calls} request(s)")
+
+    samples, per_row_s, decode_s = benchmark_decode(data_dict["column_display_name"], args.decode_samples)
+    print(f"\nDecoding {samples} samples: per-row lists {per_row_s * 1000:.1f}ms, columnar decode {decode_s * 1000:.1f}ms ({per_row_s / decode_s:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+# Log file written once per cycle.
+#
+# The analyzer used to open its log file for every message. A BufferedLog collects the records of a cycle in
+# memory, each with its time, and appends them with a single write in flush().
+# Messages keep the "message at timestamp" format of write_log; blocks of lines (such as the utility
+# dictionary of a service) are written as they are.
+
+import datetime
+import threading
+
+
+class BufferedLog:
+    def __init__(self, path):
+        self.path = path
+        self.records = []
+        self.lock = threading.Lock()
+
+    # A message, written as "message at timestamp"
+    def write(self, message):
+        with self.lock:
+            self.records.append({"time": datetime.datetime.now(), "message": message, "lines": None})
+
+    # Lines written without a timestamp
+    def write_lines(self, lines):
+        with self.lock:
+            self.records.append({"time": datetime.datetime.now(), "message": None, "lines": list(lines)})
+
+    @staticmethod
+    def format(record):
+        if record["lines"] is not None:
+            return "".join(f"{line}\n" for line in record["lines"])
+        return f"{record['message']} at {record['time'].strftime('%Y-%m-%d %H:%M:%S')}\n"
+
+    # Append the buffered records to the log file; returns the number of records written
+    def flush(self):
+        with self.lock:
+            records, self.records = self.records, []
+        if records:
+            with open(self.path, "a") as file:
+                file.write("".join(self.format(record) for record in records))
+        return len(records)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+# Cache of parsed configuration files.
+#
+# load_json() parses a JSON file once, optionally builds a compact structure from it, and returns the cached
+# value until the file changes. A file is checked with a single stat(): while its mtime and size are unchanged
+# it is not read at all. When they change, the content is hashed and only parsed again if the hash differs,
+# so touching a file without editing it does not trigger a reload. The same object is returned as long as the
+# file is unchanged, so callers detect a reload with `is not`.
+
+import hashlib
+import json
+import os
+import threading
+
+
+class ConfigCache:
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.parses = 0
+
+    def load(self, path, build=None):
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry["signature"] == signature:
+                return entry["value"]
+
+            with open(path, "rb") as file:
+                content = file.read()
+            digest = hashlib.sha1(content).hexdigest()
+            if entry is not None and entry["digest"] == digest:
+                entry["signature"] = signature
+                return entry["value"]
+
+            # A file that does not parse or build raises, and the previous value stays cached for the caller to keep using
+            data = json.loads(content)
+            value = build(data) if build else data
+            self.parses += 1
+            self.entries[path] = {"signature": signature, "digest": digest, "value": value}
+            return value
+
+    # Value of the last successful load, or None
+    def cached(self, path):
+        entry = self.entries.get(path)
+        return entry["value"] if entry else None
+
+
+# Cache shared by the scripts of one process
+default_cache = ConfigCache()
+
+
+def load_json(path, build=None):
+    return default_cache.load(path, build)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+# Helpers for the configurations defined in configurations/configration_states.json.
+#
+# Any number of configurations can be defined. They are ordered by cost: the total CPU request
+# (request x pods) first, then the total memory request. The configurations may also set an explicit
+# numeric "cost", which then takes precedence over the resource totals; either all of them or none do.
+
+import re
+
+CONFIGURATION_FIELDS = ["cpu_request", "cpu_limit", "memory_request", "memory_limit", "num_pods"]
+
+# Tolerance used when comparing utilities, so that float rounding does not hide a tie
+UTILITY_TOLERANCE = 1e-9
+
+MEMORY_UNITS = {
+    "": 1 / (1024 * 1024),
+    "Ki": 1 / 1024,
+    "Mi": 1,
+    "Gi": 1024,
+    "Ti": 1024 * 1024,
+    "k": 1000 / (1024 * 1024),
+    "M": 1000 * 1000 / (1024 * 1024),
+    "G": 1000 * 1000 * 1000 / (1024 * 1024)
+}
+
+
+# CPU quantity ("200m", "1", "1.5") in millicores
+def parse_cpu(quantity):
+    quantity = str(quantity).strip()
+    if quantity.endswith("m"):
+        return float(quantity[:-1])
+    return float(quantity) * 1000
+
+
+# Memory quantity ("200Mi", "1Gi", "500M", bytes) in MiB
+def parse_memory(quantity):
+    match = re.fullmatch(r"([0-9.]+)\s*([A-Za-z]*)", str(quantity).strip())
+    if not match or match.group(2) not in MEMORY_UNITS:
+        raise ValueError(f"Invalid memory quantity '{quantity}'")
+    return float(match.group(1)) * MEMORY_UNITS[match.group(2)]
+
+
+# Check that every configuration has the fields the executor applies and parsable resource quantities.
+# Returns the configurations, so it can build the cached value of configration_states.json.
+def validate_configurations(configurations):
+    if not configurations:
+        raise ValueError("No configurations defined")
+    for config_key, config in configurations.items():
+        missing = [field for field in CONFIGURATION_FIELDS if field not in config]
+        if missing:
+            raise ValueError(f"Configuration {config_key} is missing {', '.join(missing)}")
+        if not isinstance(config["num_pods"], int) or config["num_pods"] < 1:
+            raise ValueError(f"Configuration {config_key} needs a positive integer num_pods")
+        parse_cpu(config["cpu_request"])
+        parse_cpu(config["cpu_limit"])
+        parse_memory(config["memory_request"])
+        parse_memory(config["memory_limit"])
+        if "cost" in config and not isinstance(config["cost"], (int, float)):
+            raise ValueError(f"Configuration {config_key} needs a numeric cost")
+
+    # A configuration without a cost would sort as the cheapest next to priced ones
+    unpriced = [config_key for config_key, config in configurations.items() if "cost" not in config]
+    if unpriced and len(unpriced) < len(configurations):
+        raise ValueError(f"Configurations {', '.join(unpriced)} have no cost; set a cost for all configurations or for none")
+    return configurations
+
+
+# Total CPU (millicores) and memory (MiB) requested by a configuration over all of its pods
+def resource_totals(config):
+    num_pods = config["num_pods"]
+    return parse_cpu(config["cpu_request"]) * num_pods, parse_memory(config["memory_request"]) * num_pods
+
+
+# Sort key of a configuration: explicit cost if given, then total CPU and memory requests, then the key with numbers compared numerically
+def cost_key(config_key, config):
+    cpu_total, memory_total = resource_totals(config)
+    natural_key = [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", config_key)]
+    return (config.get("cost", 0), cpu_total, memory_total, natural_key)
+
+
+# Configuration keys from the cheapest to the most expensive
+def order_by_cost(configurations):
+    return sorted(configurations, key=lambda config_key: cost_key(config_key, configurations[config_key]))
+
+
+# Cheapest of the given configuration keys
+def cheapest(config_keys, configurations):
+    return min(config_keys, key=lambda config_key: cost_key(config_key, configurations[config_key]))
+
+
+# Cheapest configuration among those with the highest utility
+def select_configuration(utility_dict, configurations):
+    max_value = max(utility_dict.values())
+    highest_value_keys = [key for key, value in utility_dict.items() if value >= max_value - UTILITY_TOLERANCE]
+    return cheapest(highest_value_keys, configurations)
+
+
+# Human readable description, e.g. "2 Pods with limits: CPU 1000m (each), ..."
+def describe_configuration(config):
+    num_pods = config["num_pods"]
+    each = " (each)" if num_pods > 1 else ""
+    pods = "Pods" if num_pods > 1 else "Pod"
+    return (f"{num_pods} {pods} with limits: CPU {config['cpu_limit']}{each}, Memory {config['memory_limit']}{each}, "
+            f"and requests: CPU {config['cpu_request']}{each}, Memory {config['memory_request']}{each}.")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+# App-to-database dependencies used by the planner.
+#
+# configurations/dependencies.json maps a service to the database it depends on, with saturation
+# thresholds on the database metrics (window means). While a database is above any of its thresholds,
+# adding resources or pods to the service would only put more load on the real bottleneck, so the
+# planner keeps the service from scaling up; scaling down is still allowed.
+
+import os
+
+import config_cache
+
+# Constants
+DEPENDENCIES_FILE = "../configurations/dependencies.json"
+
+
+def load_dependencies(path=DEPENDENCIES_FILE):
+    if not os.path.exists(path):
+        return {}
+    return config_cache.load_json(path)
+
+
+# Databases of a list of dependencies (None for a service without one)
+def databases(service_dependencies):
+    return sorted({dependency["database"] for dependency in service_dependencies if dependency})
+
+
+# Database metrics of a dependency above their saturation threshold, as {metric: (value, threshold)}
+def database_saturation(dependency, windows):
+    if dependency is None or not windows.has_data(dependency["database"]):
+        return {}
+
+    saturated = {}
+    for metric, threshold in dependency["saturation thresholds"].items():
+        value = windows.statistics(dependency["database"], metric)["mean"]
+        # A missing window mean (NaN) never counts as saturated
+        if value > threshold:
+            saturated[metric] = (value, threshold)
+    return saturated
+
+
+# Keep the current configuration instead of a more expensive one while the database is saturated.
+# ranking lists the configuration keys from cheapest to most expensive.
+def cap_scale_up(latest_config, current_config, ranking, saturated):
+    if saturated and current_config in ranking and ranking.index(latest_config) > ranking.index(current_config):
+        return current_config
+    return latest_config
+
+
+def describe_saturation(service, dependency, saturated):
+    metrics = ", ".join(f"{metric} {value:.1f} > {threshold}" for metric, (value, threshold) in saturated.items())
+    return f"Database {dependency['database']} of {service} is saturated ({metrics})"
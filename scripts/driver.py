@@ -2,75 +2,174 @@
 
 import os
 import subprocess
-import sys
+import argparse
 import datetime
-import schedule
 import time
 
+import telemetry
+from loop_health import LoopHealth, phase_timeouts, write_health
+from scheduler import LoopScheduler
+
 # Constants
 SCRIPTS_FOLDER = "../scripts"
 LOGS_FOLDER = "../logs"
 
+# Default adaptation interval (in seconds)
+DEFAULT_INTERVAL_S = 300
+
 # Path to the log file
 log_file = os.path.join(LOGS_FOLDER, "driver.log")
 
-# Get the current date and time
-current_time = datetime.datetime.now()
 
-# Format the timestamp
-timestamp = current_time.strftime("%Y-%m-%d %H:%M:%S")
+def get_timestamp():
+    # Get the current date and time
+    current_time = datetime.datetime.now()
 
-# Open the log file in append mode and write the timestamp
-with open(log_file, "a") as file:
-    file.write(f"Script execution started at {timestamp}\n")
+    # Format the timestamp
+    return current_time.strftime("%Y-%m-%d %H:%M:%S")
 
-def run_monitoring_script():
-    monitor_script = os.path.join(SCRIPTS_FOLDER, "monitor.py")
+
+def write_log(line):
+    # Open the log file in append mode and write the line
+    with open(log_file, "a") as file:
+        file.write(line + "\n")
+
+
+# Run a script with its arguments and a time limit (the child is killed when it runs out of time) and count the outcome in health.
+# A failure, also of starting the script, is logged and the driver goes on with the next phase or cycle.
+def run_script(name, script, timeout_s, health, script_args=()):
+    start = time.monotonic()
     try:
-        subprocess.run(["python3", monitor_script], check=True)
-        print("Successfully ran monitor script")
-        # Call the analyzer script after the monitor script has completed
-        run_analyzer_script()
+        subprocess.run(["python3", script, *script_args], check=True, timeout=timeout_s)
+        outcome = "ok"
+        print(f"Successfully ran {name} script")
 
     except subprocess.CalledProcessError as e:
-        print(f"Error running the monitor script: {e}")
-        # Get the current date and time
-        current_time = datetime.datetime.now()
+        outcome = "failed"
+        print(f"Error running the {name} script: {e}")
+        write_log(f"ERROR at {get_timestamp()}: {e}")
+
+    except subprocess.TimeoutExpired as e:
+        outcome = "timed_out"
+        print(f"The {name} script did not finish in time: {e}")
+        write_log(f"ERROR at {get_timestamp()}: {e}")
+
+    except OSError as e:
+        outcome = "failed"
+        print(f"Could not start the {name} script: {e}")
+        write_log(f"ERROR at {get_timestamp()}: {e}")
 
-        # Format the timestamp
-        timestamp = current_time.strftime("%Y-%m-%d %H:%M:%S")
+    health.record_phase(name, outcome, time.monotonic() - start, timeout_s)
+    return outcome == "ok"
+
+def run_monitoring_script(health, timeouts, interval_s):
+    monitor_script = os.path.join(SCRIPTS_FOLDER, "monitor.py")
+    health.begin_cycle()
+    # The monitor fetches the samples of one adaptation interval
+    run_script("monitor", monitor_script, timeouts["monitor"], health, ["--fetch-window", str(interval_s)])
 
-        # Open the log file in append mode and write the timestamp
-        with open(log_file, "a") as file:
-            file.write(f"ERROR at {timestamp}: {e}\n")
-        sys.exit(1)
+    # The analyzer runs even when some workloads could not be fetched: it keeps the configuration of the services without new samples
+    run_analyzer_script(health, timeouts)
 
-def run_analyzer_script():
+def run_analyzer_script(health, timeouts):
     analyzer_script = os.path.join(SCRIPTS_FOLDER, "analyzer.py")
+    # The analyzer script also waits for the deployment updates
+    run_script("analyze", analyzer_script, timeouts["analyze"] + timeouts["execute"], health)
+
+def run_in_process_cycle(loop, profile_cycle=None, profiler="cprofile"):
+    # The phases of a cycle handle their own errors; anything else is logged and the next cycle runs as scheduled
     try:
-        subprocess.run(["python3", analyzer_script], check=True)
-        print("Successfully ran analyzer script")
-        
-    except subprocess.CalledProcessError as e:
-        print(f"Error running the analyzer script: {e}")
-        # Get the current date and time
-        current_time = datetime.datetime.now()
+        # Optionally profile one chosen cycle (cycles are numbered from 1)
+        if profile_cycle == loop.cycle + 1:
+            telemetry.profile_call(loop.run_cycle, os.path.join(LOGS_FOLDER, f"cycle_{profile_cycle}"), profiler)
+        else:
+            loop.run_cycle()
+        print("Successfully ran adaptation cycle")
+
+    except Exception as e:
+        print(f"Error running the adaptation cycle: {e}")
+        write_log(f"ERROR at {get_timestamp()}: {e}")
+
+def run_fast_path_poll(watcher):
+    # A failed poll is only logged; the next one is seconds away and the regular cycle still runs
+    start = time.monotonic()
+    try:
+        for service in watcher.poll():
+            print(f"Fast path adaptation triggered for {service}")
+            write_log(f"Fast path adaptation triggered for {service} at {get_timestamp()}")
+        outcome = "ok"
+
+    except Exception as e:
+        outcome = "failed"
+        print(f"Error running the fast path poll: {e}")
+        write_log(f"ERROR (fast path) at {get_timestamp()}: {e}")
+
+    watcher.loop.health.record_phase("fast_path_poll", outcome, time.monotonic() - start)
+
+# After every run: rewrite the loop health file, and log the lag and health of every cycle
+def after_run(job, health, scheduler):
+    write_health(health, scheduler)
+    if job.name != "cycle":
+        return
+
+    message = (f"Cycle {job.runs}: lag {job.last_lag_s:.1f}s, took {job.last_duration_s:.1f}s of {job.interval_s}s, "
+               f"{job.overruns} overruns, {job.skipped} skipped cycles; {health.summary()}")
+    print(message)
+    write_log(f"{message} at {get_timestamp()}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the MAPE-K adaptation loop.")
+    parser.add_argument("--in-process", action="store_true",
+                        help="Run monitor, analyzer and executor in this process, reusing the client and configs across cycles.")
+    parser.add_argument("--interval", type=int, default=DEFAULT_INTERVAL_S,
+                        help="Adaptation interval in seconds (default: 300).")
+    parser.add_argument("--fetch-concurrency", type=int, default=1,
+                        help="In-process mode only: fetch up to this many workloads in parallel (default: 1, sequential).")
+    parser.add_argument("--batched-fetch", action="store_true",
+                        help="In-process mode only: query groups of workloads with one request per metric spec.")
+    parser.add_argument("--profile-cycle", type=int,
+                        help="In-process mode only: profile this cycle (1 = first) and save the profile in the logs folder.")
+    parser.add_argument("--profiler", choices=["cprofile", "pyinstrument"], default="cprofile",
+                        help="Profiler used by --profile-cycle (default: cprofile).")
+    parser.add_argument("--fast-path", action="store_true",
+                        help="In-process mode only: between cycles, poll a few metrics and adapt a service as soon as it breaches its top threshold.")
+    parser.add_argument("--watch-interval", type=int,
+                        help="Poll interval of the fast path in seconds (default: 10).")
+    return parser.parse_args()
 
-        # Format the timestamp
-        timestamp = current_time.strftime("%Y-%m-%d %H:%M:%S")
+def main():
+    args = parse_args()
 
-        # Open the log file in append mode and write the timestamp
-        with open(log_file, "a") as file:
-            file.write(f"ERROR at {timestamp}: {e}\n")
-        sys.exit(1)
+    # Open the log file in append mode and write the timestamp
+    write_log(f"Script execution started at {get_timestamp()}")
 
-def main():
-    # Schedule the script to run every 5 minutes
-    schedule.every(5).minutes.do(run_monitoring_script)
+    # Cycles start on a fixed grid of monotonic deadlines, one interval apart
+    scheduler = LoopScheduler()
+    timeouts = phase_timeouts(args.interval)
+
+    if args.in_process:
+        # Imported here so that the default mode does not pay for pandas and sdcclient in the driver
+        from mape_loop import MapeLoop
+
+        loop = MapeLoop(fetch_window_s=args.interval, fetch_concurrency=args.fetch_concurrency, batched_fetch=args.batched_fetch, timeouts=timeouts)
+        health = loop.health
+        scheduler.every(args.interval, "cycle", run_in_process_cycle, loop, args.profile_cycle, args.profiler)
+
+        if args.fast_path:
+            from fast_path import FastPathWatcher, WATCH_INTERVAL_S
+
+            # Runs in the same scheduler thread, so a poll never overlaps with a cycle
+            watcher = FastPathWatcher(loop)
+            scheduler.every(args.watch_interval or WATCH_INTERVAL_S, "fast_path_poll", run_fast_path_poll, watcher)
+    else:
+        if args.fast_path:
+            print("--fast-path requires --in-process, ignoring it.")
+
+        # Schedule the script to run every 5 minutes
+        health = LoopHealth()
+        scheduler.every(args.interval, "cycle", run_monitoring_script, health, timeouts, args.interval)
 
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    scheduler.run_forever(lambda job: after_run(job, health, scheduler))
 
 if __name__ == "__main__":
     main()
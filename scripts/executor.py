@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Constants
+# oc binary and cluster login used by DeploymentExecutor. The token is read from the environment;
+# without it the executor assumes `oc` is already logged in.
+OC_BINARY = os.environ.get("OC_BINARY", "oc")
+OC_SERVER = os.environ.get("OC_SERVER", "https://c104-e.ca-tor.containers.cloud.ibm.com:31635")
+OC_TOKEN = os.environ.get("OC_TOKEN", "")
+
+# Maximum number of deployments updated at the same time, and the time allowed for one update
+MAX_PARALLEL_UPDATES = 4
+UPDATE_TIMEOUT_S = 120
+
+
+# JSON patch setting the container resources and the replica count of a deployment in one request
+def build_patch(cpu_request, cpu_limit, memory_request, memory_limit, num_pods):
+    resources = {
+        "requests": {"cpu": cpu_request, "memory": memory_request},
+        "limits": {"cpu": cpu_limit, "memory": memory_limit}
+    }
+    return json.dumps([
+        {"op": "add", "path": "/spec/template/spec/containers/0/resources", "value": resources},
+        {"op": "replace", "path": "/spec/replicas", "value": int(num_pods)}
+    ])
+
+
+class ExecutionResult:
+    def __init__(self, deployment, ok, duration_s, output, timed_out=False):
+        self.deployment = deployment
+        self.ok = ok
+        self.duration_s = duration_s
+        self.output = output
+        self.timed_out = timed_out
+
+    def __str__(self):
+        status = "completed" if self.ok else "TIMED OUT" if self.timed_out else "FAILED"
+        return f"Deployment update of {self.deployment} {status} in {self.duration_s:.2f}s"
+
+
+# Applies deployment updates in parallel with a bounded worker pool.
+# The cluster login happens once for the lifetime of the executor; every update is a single `oc patch`
+# that sets resources and replicas together, so the deployment rolls out once.
+class DeploymentExecutor:
+    def __init__(self, namespace, max_workers=MAX_PARALLEL_UPDATES, oc_binary=OC_BINARY, timeout_s=UPDATE_TIMEOUT_S, server=OC_SERVER, token=OC_TOKEN, kubeconfig=None):
+        self.namespace = namespace
+        self.oc_binary = oc_binary
+        self.server = server
+        self.token = token
+        self.kubeconfig = kubeconfig
+        self.timeout_s = timeout_s
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = []
+        self.login_lock = threading.Lock()
+        self.logged_in = False
+
+    # With a kubeconfig of its own the executor's login does not change the context used by other executors
+    def run_oc(self, args):
+        if self.kubeconfig:
+            args = args + [f"--kubeconfig={self.kubeconfig}"]
+        completed = subprocess.run([self.oc_binary] + args, capture_output=True, text=True, timeout=self.timeout_s)
+        return completed.returncode == 0, (completed.stdout + completed.stderr).strip()
+
+    def login(self):
+        with self.login_lock:
+            if self.logged_in:
+                return
+            if self.token:
+                ok, output = self.run_oc(["login", f"--token={self.token}", f"--server={self.server}"])
+                if not ok:
+                    raise RuntimeError(f"oc login failed: {output}")
+            else:
+                print("OC_TOKEN is not set, assuming oc is already logged in.")
+            self.logged_in = True
+
+    def apply(self, deployment, cpu_request, cpu_limit, memory_request, memory_limit, num_pods):
+        start = time.monotonic()
+        try:
+            self.login()
+            patch = build_patch(cpu_request, cpu_limit, memory_request, memory_limit, num_pods)
+            ok, output = self.run_oc(["patch", "deployment", deployment, "-n", self.namespace, "--type=json", "-p", patch])
+        except (RuntimeError, OSError) as e:
+            ok, output = False, str(e)
+        except subprocess.TimeoutExpired as e:
+            # The API server may still apply a patch whose oc call ran out of time
+            return ExecutionResult(deployment, False, time.monotonic() - start, str(e), timed_out=True)
+        return ExecutionResult(deployment, ok, time.monotonic() - start, output)
+
+    # Queue an update without waiting for it
+    def submit(self, deployment, cpu_request, cpu_limit, memory_request, memory_limit, num_pods):
+        future = self.pool.submit(self.apply, deployment, cpu_request, cpu_limit, memory_request, memory_limit, num_pods)
+        self.pending.append((deployment, future))
+        return future
+
+    # Wait for all queued updates and return their results.
+    # With a timeout, the updates still running then are reported as timed out and left to finish in the background.
+    def wait(self, timeout_s=None):
+        pending, self.pending = self.pending, []
+        wait([future for _, future in pending], timeout=timeout_s)
+
+        results = []
+        for deployment, future in pending:
+            if future.done():
+                results.append(future.result())
+            else:
+                results.append(ExecutionResult(deployment, False, timeout_s, f"Still running after {timeout_s}s", timed_out=True))
+        return results
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+
+# Stand-in for the oc binary to try the executor without a cluster:
+#   OC_BINARY=./fake_oc.py python3 driver.py --in-process
+# Every call prints its arguments and sleeps FAKE_OC_DELAY_S seconds (default: 1) to simulate a rollout.
+# A patch of a deployment listed in FAKE_OC_FAIL (comma separated) fails, e.g. FAKE_OC_FAIL=acmeair-authservice.
+
+import os
+import sys
+import time
+
+
+def main():
+    time.sleep(float(os.environ.get("FAKE_OC_DELAY_S", "1")))
+    failing = [name for name in os.environ.get("FAKE_OC_FAIL", "").split(",") if name]
+    if sys.argv[1:2] == ["patch"] and set(sys.argv[2:4]) & set(failing):
+        print(f"fake oc: error patching {sys.argv[3]}", file=sys.stderr)
+        sys.exit(1)
+    print("fake oc " + " ".join(sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    main()
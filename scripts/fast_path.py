@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+# Event-driven fast path between the regular adaptation cycles.
+#
+# Every WATCH_INTERVAL_S seconds the watcher fetches a small subset of metrics for all analyzed services
+# with a single batched request. When a new sample of a service is above the top "scaled thresholds" band of
+# its analyzer_utility.json for DEBOUNCE_POLLS polls in a row, that service alone is analyzed and, if a
+# more expensive configuration wins, updated right away. After an update the service is left alone for
+# COOLDOWN_S seconds; a trigger that changes nothing (e.g. held by the stabilization controller) starts no cooldown.
+# Scaling down is left to the regular cycle.
+
+import copy
+import datetime
+import time
+
+import numpy as np
+
+import monitor
+import analyzer
+import dependencies
+from configuration_table import order_by_cost, select_configuration
+from metrics_store import TIMESTAMP_COLUMN
+from utility_model import evaluate, value_vector
+
+# Constants
+WATCH_INTERVAL_S = 10
+
+# Time span fetched by every poll; a couple of samples is enough to get the latest one
+WATCH_WINDOW_S = 30
+
+# Metrics watched by the fast path (a subset of metrics.json)
+WATCHED_METRICS = ["Sysdig Container Net HTTP Request Count", "Sysdig Container File In IOPS"]
+
+# Consecutive polls with a new sample above the threshold before a service is adapted
+DEBOUNCE_POLLS = 2
+
+# Minimum time between two fast path adaptations of the same service
+COOLDOWN_S = 300
+
+# A poll is small, so it gets a short timeout and no retries; the next poll is only seconds away
+POLL_TIMEOUT_S = 5
+
+# Path to the log file
+log_file = "../logs/fast_path.log"
+
+
+def write_log(message):
+    # Get the current date and time
+    current_time = datetime.datetime.now()
+
+    # Format the timestamp
+    timestamp = current_time.strftime("%Y-%m-%d %H:%M:%S")
+
+    # Open the log file in append mode and write the timestamp
+    with open(log_file, "a") as file:
+        file.write(f"{message} at {timestamp}\n")
+
+
+# Metric specs of the watched metrics, in the order of metrics.json
+def watched_specs(data_dict, watched_metrics):
+    names = []
+    metrics = []
+    for name, spec in zip(data_dict["column_display_name"], data_dict["metrics"]):
+        if name in watched_metrics:
+            names.append(name)
+            metrics.append(spec)
+    return names, metrics
+
+
+# Upper bound of the top band of every watched metric in a utility config
+def breach_thresholds(utility_config, watched_metrics):
+    return {item["name"]: max(item["scaled thresholds"]) for item in utility_config if item["name"] in watched_metrics}
+
+
+# Latest sample of a polled block (values followed by the timestamp) as (timestamp, {metric: value}); missing values are skipped
+def latest_sample(rows, names):
+    if not len(rows):
+        return None, {}
+    row = rows[np.argmax(rows[:, -1])]
+    values = {name: float(value) for name, value in zip(names, row[:-1]) if not np.isnan(value)}
+    return float(row[-1]), values
+
+
+class FastPathWatcher:
+    def __init__(self, loop, debounce_polls=DEBOUNCE_POLLS, cooldown_s=COOLDOWN_S, watched_metrics=WATCHED_METRICS):
+        self.loop = loop
+        self.debounce_polls = debounce_polls
+        self.cooldown_s = cooldown_s
+        self.names, self.metrics = watched_specs(loop.metric_specs["app"], watched_metrics)
+        self.services = list(loop.service_configs)
+        self.refresh_thresholds()
+
+        # Per service: consecutive breaching samples, timestamp of the last sample seen and end of the cooldown
+        self.streaks = {service: 0 for service in self.services}
+        self.last_timestamps = {}
+        self.cooldown_until = {}
+        self.triggers = 0
+
+    # Thresholds of the utility configs currently loaded by the loop
+    def refresh_thresholds(self):
+        self.thresholds = {service: breach_thresholds(self.loop.service_configs[service]["utility_config"], self.names) for service in self.services}
+        self.config_version = self.loop.config_version
+
+    def poll(self):
+        # Follow threshold edits picked up by the loop's hot reload
+        if self.config_version != self.loop.config_version:
+            self.refresh_thresholds()
+
+        responses = monitor.call_with_retries("fast path poll", POLL_TIMEOUT_S, 0, monitor.fetch_metrics_batch,
+                                              self.loop.sdclient, self.metrics, self.names + [TIMESTAMP_COLUMN], self.services, -WATCH_WINDOW_S, self.loop.target.scope)
+
+        triggered = []
+        for service in self.services:
+            timestamp, values = latest_sample(responses[service], self.names)
+
+            # The poll windows overlap, so a sample is only counted once
+            if timestamp is None or timestamp == self.last_timestamps.get(service):
+                continue
+            self.last_timestamps[service] = timestamp
+
+            breached = {metric: value for metric, value in values.items() if value > self.thresholds[service].get(metric, np.inf)}
+            self.streaks[service] = self.streaks[service] + 1 if breached else 0
+
+            if self.streaks[service] >= self.debounce_polls and time.monotonic() >= self.cooldown_until.get(service, 0):
+                self.trigger(service, values, breached)
+                triggered.append(service)
+
+        return triggered
+
+    # Analyze a single service on its current window, with the watched metrics raised to the latest polled values
+    def trigger(self, service, values, breached):
+        self.triggers += 1
+        self.streaks[service] = 0
+
+        service_config = self.loop.service_configs[service]
+        configurations = self.loop.configurations
+        model = service_config["utility_model"]
+
+        metric_values = self.loop.windows.metric_values(service, service_config["utility_config"]) if self.loop.windows.has_data(service) else {}
+        for metric, value in values.items():
+            if metric in model.metric_names:
+                metric_values[metric] = max(value, metric_values.get(metric, value))
+
+        utilities = evaluate(model, value_vector(model.metric_names, metric_values))
+        utility_dict = dict(zip(model.config_keys, utilities.tolist()))
+
+        breaches = ", ".join(f"{metric} {value:.2f} > {self.thresholds[service][metric]}" for metric, value in breached.items())
+        write_log(f"Threshold breach for {service}: {breaches}")
+
+        saturated = dependencies.database_saturation(service_config["dependency"], self.loop.windows)
+
+        # With the planner enabled, the service is planned within what the other services leave of the namespace budget
+        planned = None
+        latest_config = select_configuration(utility_dict, configurations)
+        if self.loop.planner_config["enabled"]:
+            assignment, _, _ = analyzer.plan_services(self.loop.service_configs, configurations, self.loop.windows, {service: metric_values}, {service: utility_dict},
+                                                      {service: saturated}, {}, self.loop.planner_config)
+            if assignment is None:
+                write_log(f"No room in the namespace budget to scale up {service}")
+                return
+            planned = latest_config = assignment[service].config_key
+
+        # Only scale up; a cheaper configuration waits for the regular cycle
+        ranking = order_by_cost(configurations)
+        current_config = service_config["config_state"].get("current_config", ranking[-1])
+        if current_config in ranking and ranking.index(latest_config) <= ranking.index(current_config):
+            write_log(f"No scale up needed for {service} ({current_config})")
+            return
+
+        previous_state = copy.deepcopy(service_config["config_state"])
+        try:
+            _, to_update = analyzer.analyze_service(service, utility_dict, service_config, configurations, self.loop.executor, saturated, journal=self.loop.journal, planned=planned)
+        finally:
+            analyzer.cycle_log.flush()
+        if to_update:
+            self.cooldown_until[service] = time.monotonic() + self.cooldown_s
+
+        # A hung oc patch must not block the scheduler thread: wait at most the execute time limit of the loop
+        for result in self.loop.executor.wait(self.loop.timeouts.get("execute")):
+            print(result)
+            write_log(str(result))
+            if not result.ok:
+                write_log(result.output)
+            analyzer.reconcile_update(service, service_config, previous_state, result, self.loop.journal)
+        # Committed once the result of the update is known
+        self.loop.journal.commit()
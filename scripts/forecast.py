@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+# Load forecasting for predictive scaling.
+#
+# Between the window aggregation and the utility computation, the analyzer can replace the current value
+# of selected metrics by the value forecast for the next interval, starting `lead_time_s` from now. The
+# settings are in configurations/forecast.json; forecasting is off unless "enabled" is true.
+
+import math
+import os
+
+import numpy as np
+
+import config_cache
+
+# Constants
+FORECAST_CONFIG_FILE = "../configurations/forecast.json"
+
+DEFAULT_FORECAST_CONFIG = {
+    "enabled": False,
+    "method": "holt",
+    "metrics": ["Sysdig Container Net HTTP Request Count", "Sysdig Container CPU Quota Used Percent"],
+    "sampling_s": 10,
+    "history_s": 10800,
+    "lead_time_s": 300,
+    "horizon_s": 300,
+    "season_length_s": 3600,
+    "alpha": 0.3,
+    "beta": 0.05,
+    "gamma": 0.1,
+    "phi": 0.9
+}
+
+METHODS = ["holt", "holt_winters", "seasonal_naive", "last_value"]
+
+
+# Holt-Winters needs two full seasons of history. The default history holds three, so that gaps in the samples
+# do not make it fall back to Holt; a shorter history is accepted but always falls back, which is printed once per load.
+def build_forecast_config(data):
+    config = dict(DEFAULT_FORECAST_CONFIG, **data)
+    if config["method"] not in METHODS:
+        raise ValueError(f"Unknown forecast method '{config['method']}', choose from {', '.join(METHODS)}")
+    if config["method"] == "holt_winters" and config["history_s"] < 2 * config["season_length_s"]:
+        print(f"Forecast history_s {config['history_s']}s is shorter than two seasons ({2 * config['season_length_s']}s): Holt-Winters falls back to Holt")
+    return config
+
+
+# The config is cached until the file changes and must not be modified
+def load_forecast_config(path=FORECAST_CONFIG_FILE):
+    if not os.path.exists(path):
+        return DEFAULT_FORECAST_CONFIG
+    return config_cache.load_json(path, build_forecast_config)
+
+
+# Drop missing samples; the forecasters work on the remaining sequence
+def clean(series):
+    series = np.asarray(series, dtype=float)
+    return series[~np.isnan(series)]
+
+
+# Trend contribution after 1..steps steps; with phi < 1 the trend is damped so long lead times do not run away
+def damped_trend(trend, steps, phi):
+    if phi >= 1:
+        return trend * np.arange(1, steps + 1)
+    return trend * np.cumsum(phi ** np.arange(1, steps + 1))
+
+
+# Double exponential smoothing (level + damped trend); returns the next `steps` predictions
+def holt_forecast(series, steps, alpha, beta, phi=1.0):
+    series = clean(series)
+    if len(series) == 0:
+        return np.full(steps, np.nan)
+    if len(series) == 1:
+        return np.full(steps, series[0])
+
+    level = series[0]
+    trend = series[1] - series[0]
+    for value in series[1:]:
+        previous_level = level
+        level = alpha * value + (1 - alpha) * (level + phi * trend)
+        trend = beta * (level - previous_level) + (1 - beta) * phi * trend
+
+    return level + damped_trend(trend, steps, phi)
+
+
+# Additive Holt-Winters; needs two full seasons of history, otherwise falls back to Holt
+def holt_winters_forecast(series, steps, season_length, alpha, beta, gamma, phi=1.0):
+    series = clean(series)
+    if season_length < 2 or len(series) < 2 * season_length:
+        return holt_forecast(series, steps, alpha, beta, phi)
+
+    first_season = series[:season_length]
+    second_season = series[season_length:2 * season_length]
+    level = first_season.mean()
+    trend = (second_season.mean() - first_season.mean()) / season_length
+    seasonals = list(first_season - level)
+
+    for i, value in enumerate(series):
+        seasonal = seasonals[i % season_length]
+        previous_level = level
+        level = alpha * (value - seasonal) + (1 - alpha) * (level + phi * trend)
+        trend = beta * (level - previous_level) + (1 - beta) * phi * trend
+        seasonals[i % season_length] = gamma * (value - level) + (1 - gamma) * seasonal
+
+    start = len(series)
+    trends = damped_trend(trend, steps, phi)
+    return np.array([level + trends[h] + seasonals[(start + h) % season_length] for h in range(steps)])
+
+
+# The values one season earlier
+def seasonal_naive_forecast(series, steps, season_length):
+    series = clean(series)
+    if len(series) < season_length or season_length < 1:
+        return np.full(steps, series[-1] if len(series) else np.nan)
+    last_season = series[-season_length:]
+    return np.array([last_season[h % season_length] for h in range(steps)])
+
+
+def forecast(series, steps, config):
+    method = config["method"]
+    season_length = int(config["season_length_s"] // config["sampling_s"])
+    if method == "holt":
+        return holt_forecast(series, steps, config["alpha"], config["beta"], config["phi"])
+    if method == "holt_winters":
+        return holt_winters_forecast(series, steps, season_length, config["alpha"], config["beta"], config["gamma"], config["phi"])
+    if method == "seasonal_naive":
+        return seasonal_naive_forecast(series, steps, season_length)
+    series = clean(series)
+    return np.full(steps, series[-1] if len(series) else np.nan)
+
+
+# Mean forecast over the interval [lead time, lead time + horizon); negative forecasts are clamped to 0
+def predict_interval(series, config):
+    lead_steps = int(config["lead_time_s"] // config["sampling_s"])
+    horizon_steps = max(1, int(config["horizon_s"] // config["sampling_s"]))
+    predictions = forecast(series, lead_steps + horizon_steps, config)[lead_steps:]
+    value = float(np.mean(predictions))
+    return max(0.0, value) if not math.isnan(value) else value
+
+
+# Replace the values of the forecast metrics of a service by their predicted values.
+# history is a (rows, columns) array with the given column names; metrics without history keep their value.
+def forecast_metric_values(metric_values, history, columns, config):
+    predicted = dict(metric_values)
+    for metric in config["metrics"]:
+        if metric not in metric_values or metric not in columns or len(history) == 0:
+            continue
+        value = predict_interval(history[:, columns.index(metric)], config)
+        if not math.isnan(value):
+            predicted[metric] = value
+    return predicted
+
+
+# Number of samples of history the forecasters look at
+def history_samples(config):
+    return int(config["history_s"] // config["sampling_s"])
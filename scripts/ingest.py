@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# Decoding of get_data responses into the row blocks of the metrics store.
+#
+# The column names of metrics.json / db_metrics.json are checked once against the metric list, and every
+# response is checked against that schema (values per row) instead of assuming the order by position.
+# A response is decoded with np.fromiter straight into a preallocated float64 block of
+# (samples, metrics + timestamp), the layout of the store segments, so no per-row lists are built.
+
+from itertools import chain, islice
+
+import numpy as np
+
+from metrics_store import DTYPE, TIMESTAMP_COLUMN
+
+
+class SchemaError(ValueError):
+    pass
+
+
+# Check that a metrics JSON file names every metric once, in order, followed by the timestamp column
+def validate_metric_spec(data_dict, label):
+    columns = data_dict["column_display_name"]
+    metrics = data_dict["metrics"]
+
+    if not columns or columns[-1] != TIMESTAMP_COLUMN:
+        raise SchemaError(f"{label}: the last column must be '{TIMESTAMP_COLUMN}'")
+    if len(columns) != len(metrics) + 1:
+        raise SchemaError(f"{label}: {len(metrics)} metrics but {len(columns) - 1} column names")
+    if len(set(columns)) != len(columns):
+        raise SchemaError(f"{label}: duplicated column names")
+    for metric in metrics:
+        if "id" not in metric or "aggregations" not in metric:
+            raise SchemaError(f"{label}: metric {metric} needs an id and aggregations")
+
+
+# Decode a response into a (samples, len(columns)) block, values in column order and the timestamp last.
+# With grouped=True every row starts with the group-by key, which is skipped.
+def decode(res, columns, grouped=False, label="response"):
+    data = res["data"]
+    samples = len(data)
+    values_per_row = len(columns) - 1
+    offset = 1 if grouped else 0
+
+    lengths = {len(entry["d"]) for entry in data}
+    if lengths - {values_per_row + offset}:
+        raise SchemaError(f"{label}: expected {values_per_row + offset} values per sample, got {sorted(lengths)}")
+
+    rows = np.empty((samples, len(columns)), dtype=DTYPE)
+    rows[:, -1] = np.fromiter((entry["t"] for entry in data), dtype=DTYPE, count=samples)
+
+    # Missing values (None) are converted to NaN
+    values = chain.from_iterable(islice(entry["d"], offset, None) for entry in data)
+    rows[:, :-1] = np.fromiter(values, dtype=DTYPE, count=samples * values_per_row).reshape(samples, values_per_row)
+
+    return rows
+
+
+# Decode a response grouped by workload into one block per requested workload (empty if it returned nothing)
+def decode_grouped(res, columns, workloads, label="response"):
+    rows = decode(res, columns, grouped=True, label=label)
+    keys = np.array([entry["d"][0] for entry in res["data"]], dtype=object)
+    return {workload: rows[keys == workload] for workload in workloads}
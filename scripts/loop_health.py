@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+# Health of the adaptation loop itself.
+#
+# The timings in telemetry.py describe one cycle; LoopHealth keeps counters over the lifetime of the driver:
+# the outcome of every phase (ok, failed or timed out) and its success ratio, the services (or targets) that
+# were degraded, i.e. kept their configuration because their data or analysis failed, and from the scheduler
+# the lag, duration, overruns and skipped cycles of every job. After every run the driver rewrites
+# logs/loop_health.prom in the Prometheus text exposition format.
+#
+# The time limits of the phases are shares of the adaptation interval, so that a cycle ends before the next one is due.
+
+import os
+import threading
+
+from telemetry import LOGS_FOLDER, format_labels, write_atomically
+
+# Constants
+LOOP_HEALTH_FILE = os.path.join(LOGS_FOLDER, "loop_health.prom")
+OUTCOMES = ["ok", "failed", "timed_out"]
+
+# Time limit of each phase as a share of the adaptation interval; the rest is left for the configuration reload
+PHASE_TIMEOUT_SHARES = {"monitor": 0.4, "analyze": 0.2, "execute": 0.3}
+
+
+# Time limit of each phase in seconds for an adaptation interval
+def phase_timeouts(interval_s):
+    return {phase: share * interval_s for phase, share in PHASE_TIMEOUT_SHARES.items()}
+
+
+class LoopHealth:
+    def __init__(self):
+        self.phases = {}
+        self.degraded = {}
+        self.last_degraded = {}
+        self.last_phases = {}
+        self.lock = threading.Lock()
+
+    # Forget the phases and degraded services of the previous cycle
+    def begin_cycle(self):
+        with self.lock:
+            self.last_degraded = {}
+            self.last_phases = {}
+
+    def record_phase(self, name, outcome, duration_s, timeout_s=None):
+        with self.lock:
+            counts = self.phases.setdefault(name, dict({outcome: 0 for outcome in OUTCOMES}, last_duration_s=0.0, max_duration_s=0.0, timeout_s=None))
+            counts[outcome] += 1
+            counts["last_duration_s"] = duration_s
+            counts["max_duration_s"] = max(counts["max_duration_s"], duration_s)
+            counts["timeout_s"] = timeout_s
+            self.last_phases[name] = (outcome, duration_s, timeout_s)
+
+    # A service (or target) that kept its configuration in this cycle, with the reason
+    def record_degraded(self, name, reason):
+        with self.lock:
+            self.degraded[name] = self.degraded.get(name, 0) + 1
+            self.last_degraded[name] = reason
+
+    # Phases and degraded services of the current cycle, e.g. to send them from a worker process to the controller
+    def last_cycle(self):
+        with self.lock:
+            return {"phases": dict(self.last_phases), "degraded": dict(self.last_degraded)}
+
+    # Count the last cycle of another loop (see last_cycle) as part of this one. Its phases add to the phases of the
+    # same name, its degraded services are named "<prefix>/<service>". Returns the phases that were not ok.
+    def merge_cycle(self, cycle, prefix):
+        for name, (outcome, duration_s, timeout_s) in cycle["phases"].items():
+            self.record_phase(name, outcome, duration_s, timeout_s)
+        for name, reason in cycle["degraded"].items():
+            self.record_degraded(f"{prefix}/{name}", reason)
+        return {name: outcome for name, (outcome, _, _) in cycle["phases"].items() if outcome != "ok"}
+
+    def success_ratio(self, name):
+        counts = self.phases.get(name)
+        if not counts:
+            return None
+        runs = sum(counts[outcome] for outcome in OUTCOMES)
+        return counts["ok"] / runs
+
+    # One line for the driver log, e.g. "monitor 98.0% ok, analyze 100.0% ok; degraded: acmeair-flight-db"
+    def summary(self):
+        ratios = ", ".join(f"{name} {self.success_ratio(name) * 100:.1f}% ok" for name in self.phases)
+        degraded = ", ".join(self.last_degraded) or "none"
+        return f"{ratios}; degraded: {degraded}"
+
+    def prometheus_lines(self):
+        lines = [
+            "# HELP mape_phase_runs_total Runs of each loop phase by outcome.",
+            "# TYPE mape_phase_runs_total counter"
+        ]
+        for name, counts in sorted(self.phases.items()):
+            lines += [f"mape_phase_runs_total{{{format_labels({'phase': name, 'outcome': outcome})}}} {counts[outcome]}" for outcome in OUTCOMES]
+        lines += [
+            "# HELP mape_phase_success_ratio Share of the runs of each loop phase that succeeded.",
+            "# TYPE mape_phase_success_ratio gauge"
+        ]
+        lines += [f'mape_phase_success_ratio{{phase="{name}"}} {self.success_ratio(name):.6f}' for name in sorted(self.phases)]
+        lines += [
+            "# HELP mape_phase_last_duration_seconds Duration of the last run of each loop phase.",
+            "# TYPE mape_phase_last_duration_seconds gauge"
+        ]
+        lines += [f'mape_phase_last_duration_seconds{{phase="{name}"}} {counts["last_duration_s"]:.6f}' for name, counts in sorted(self.phases.items())]
+        lines += [
+            "# HELP mape_phase_timeout_seconds Time limit of each loop phase.",
+            "# TYPE mape_phase_timeout_seconds gauge"
+        ]
+        lines += [f'mape_phase_timeout_seconds{{phase="{name}"}} {counts["timeout_s"]:.3f}' for name, counts in sorted(self.phases.items()) if counts["timeout_s"] is not None]
+        lines += [
+            "# HELP mape_degraded_total Cycles in which a service or target kept its configuration because of a failure.",
+            "# TYPE mape_degraded_total counter"
+        ]
+        lines += [f'mape_degraded_total{{name="{name}"}} {count}' for name, count in sorted(self.degraded.items())]
+        lines += [
+            "# HELP mape_degraded Whether a service or target was degraded in the last cycle.",
+            "# TYPE mape_degraded gauge"
+        ]
+        lines += [f'mape_degraded{{name="{name}"}} {1 if name in self.last_degraded else 0}' for name in sorted(self.degraded)]
+        return lines
+
+
+# Lag, duration, overruns and skipped runs of the scheduler jobs
+def scheduler_lines(scheduler):
+    stats = scheduler.stats()
+    metrics = [
+        ("mape_loop_lag_seconds", "gauge", "Delay between the scheduled and the actual start of the last run of each job.", "last_lag_s"),
+        ("mape_loop_max_lag_seconds", "gauge", "Largest start delay of each job.", "max_lag_s"),
+        ("mape_loop_run_duration_seconds", "gauge", "Duration of the last run of each job.", "last_duration_s"),
+        ("mape_loop_max_run_duration_seconds", "gauge", "Longest run of each job.", "max_duration_s"),
+        ("mape_loop_interval_seconds", "gauge", "Interval of each job.", "interval_s"),
+        ("mape_loop_runs_total", "counter", "Runs of each job.", "runs"),
+        ("mape_loop_overruns_total", "counter", "Runs that ended after the next run was due.", "overruns"),
+        ("mape_loop_skipped_total", "counter", "Runs skipped because an earlier run or another job was still busy.", "skipped")
+    ]
+    lines = []
+    for metric, metric_type, description, key in metrics:
+        lines += [f"# HELP {metric} {description}", f"# TYPE {metric} {metric_type}"]
+        lines += [f'{metric}{{job="{job}"}} {job_stats[key]:.6f}' if isinstance(job_stats[key], float) else f'{metric}{{job="{job}"}} {job_stats[key]}'
+                  for job, job_stats in sorted(stats.items())]
+    return lines
+
+
+def write_health(health=None, scheduler=None, path=LOOP_HEALTH_FILE):
+    lines = []
+    if scheduler is not None:
+        lines += scheduler_lines(scheduler)
+    if health is not None:
+        lines += health.prometheus_lines()
+    write_atomically(path, lines)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+import time
+
+import monitor
+import analyzer
+import telemetry
+import forecast
+import planner
+import targets
+from metrics_store import MetricsStore
+from window_engine import WindowEngine
+from executor import DeploymentExecutor
+from state_journal import StateJournal
+from loop_health import LoopHealth, phase_timeouts
+
+
+# Long-lived MAPE-K loop.
+# The monitoring client, metric specs, utility configs and configuration states are loaded once
+# and reused by every cycle instead of being re-created by a new python process each time.
+# A loop adapts one target (see targets.py); by default the namespace configured in monitor.py and analyzer.py.
+# With write_timings=False the cycle timings are only returned, e.g. to be aggregated by the sharded controller.
+# Edited configuration files are reloaded at the start of a cycle (see refresh_configs), without a restart.
+# Every phase has a time limit (by default a share of the fetch window, which is the adaptation interval). A phase
+# that fails or runs out of time is counted in self.health and the cycle goes on: the services it could not
+# handle keep their configuration until a later cycle, instead of stopping the loop.
+class MapeLoop:
+    def __init__(self, fetch_window_s=monitor.FETCH_WINDOW_S, fetch_concurrency=1, batched_fetch=False, target=None, write_timings=True, timeouts=None):
+        self.fetch_window_s = fetch_window_s
+        self.timeouts = timeouts or phase_timeouts(fetch_window_s)
+        self.health = LoopHealth()
+        self.fetch_concurrency = fetch_concurrency
+        self.batched_fetch = batched_fetch
+        self.target = target or targets.default_target()
+        self.write_timings = write_timings
+
+        # Metrics store shared by the monitor and the analyzer
+        self.store = MetricsStore(self.target.store_folder)
+
+        # Monitor knowledge
+        self.sdclient = monitor.create_client()
+        self.metric_specs = monitor.load_metric_specs()
+
+        # Analyzer knowledge
+        self.configurations = analyzer.load_configuration_states()
+        self.service_configs = {service: analyzer.load_service_config(service, self.configurations, self.target.state_folder) for service in self.target.services}
+        self.utility_stack = analyzer.build_utility_stack(self.service_configs)
+        self.windows = WindowEngine(analyzer.WINDOW_SIZE, state_path=self.target.window_state_path)
+        self.windows.load()
+        self.forecast_config = forecast.load_forecast_config()
+        self.planner_config = planner.load_planner_config()
+
+        # Config states are committed to the journal once per cycle; a restart continues from the last committed cycle
+        self.journal = StateJournal(self.target.journal_path)
+        for service in self.journal.recover(self.service_configs):
+            print(f"Restored the config state of {service} from the journal")
+            analyzer.write_log(f"Restored the config state of {service} from the journal")
+
+        # Increased on every reload that changed a utility model or the configurations
+        self.config_version = 0
+
+        # Executor knowledge: logs in to the cluster once and applies updates in parallel
+        self.executor = DeploymentExecutor(self.target.namespace, server=self.target.oc_server, token=self.target.token(), kubeconfig=self.target.kubeconfig)
+
+        self.cycle = 0
+
+    # Hot reload of the configuration files. Unchanged files cost one stat() each; a file that is missing, does not parse
+    # or validate raises a ValueError (logged by run_phase) and the previous configuration is kept until the file is fixed.
+    def refresh_configs(self):
+        try:
+            configurations = analyzer.load_configuration_states()
+            configurations_changed = configurations is not self.configurations
+            updates = {service: analyzer.reload_service_config(service, service_config, configurations, configurations_changed)
+                       for service, service_config in self.service_configs.items()}
+            recompiled = [service for service, service_updates in updates.items() if "utility_model" in service_updates]
+            utility_stack = analyzer.build_utility_stack({service: dict(self.service_configs[service], **updates[service]) for service in updates}) if recompiled else self.utility_stack
+            forecast_config = forecast.load_forecast_config()
+            planner_config = planner.load_planner_config()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"Configuration reload failed, keeping the previous configuration: {e}")
+
+        for service, service_updates in updates.items():
+            self.service_configs[service].update(service_updates)
+        self.configurations = configurations
+        self.utility_stack = utility_stack
+        self.forecast_config = forecast_config
+        self.planner_config = planner_config
+
+        if recompiled:
+            self.config_version += 1
+            print(f"Reloaded the utility models of {', '.join(recompiled)}")
+            analyzer.write_log(f"Reloaded the utility models of {', '.join(recompiled)}")
+        return bool(recompiled)
+
+    # Run func(deadline) as a phase with a time limit and count its outcome; errors are logged, not raised.
+    # The phases stop themselves at the deadline, so a phase that raises after it is counted as timed out.
+    def run_phase(self, name, log, func):
+        timeout_s = self.timeouts.get(name)
+        start = time.monotonic()
+        deadline = start + timeout_s if timeout_s is not None else None
+        try:
+            with telemetry.phase(name):
+                result = func(deadline)
+            outcome = "ok"
+        except Exception as e:
+            result = None
+            outcome = "timed_out" if deadline is not None and time.monotonic() > deadline else "failed"
+            print(f"Error in the {name} phase ({outcome}): {e}")
+            log.write_log(f"ERROR in the {name} phase ({outcome}): {e}")
+        self.health.record_phase(name, outcome, time.monotonic() - start, timeout_s)
+        return result
+
+    # Workloads that could not be fetched get no new samples, so the analyzer keeps their configuration
+    def monitor_phase(self, deadline):
+        monitor.run_monitor(self.sdclient, self.metric_specs, self.store, start_ts=-self.fetch_window_s, concurrency=self.fetch_concurrency, batched=self.batched_fetch,
+                            service_names=self.target.monitored_services, db_service_names=self.target.databases, scope=self.target.scope, deadline=deadline)
+
+    # The deadline bounds the analysis; the deployment updates are then awaited for the execute time limit
+    def analyze_phase(self, deadline):
+        return analyzer.run_analyzer(self.service_configs, self.configurations, self.store, self.windows, self.utility_stack, self.executor, self.forecast_config, self.journal,
+                                     self.planner_config, deadline, self.timeouts.get("execute"), self.health)
+
+    def run_cycle(self):
+        self.cycle += 1
+        telemetry.begin_cycle(self.cycle)
+        self.health.begin_cycle()
+
+        self.run_phase("config_reload", analyzer, lambda deadline: self.refresh_configs())
+
+        monitor.write_log("Script execution started")
+        self.run_phase("monitor", monitor, self.monitor_phase)
+        monitor.write_log("Script execution ended")
+
+        analyzer.write_log("Script execution started")
+        degraded = self.run_phase("analyze", analyzer, self.analyze_phase)
+        if degraded is None:
+            degraded = {service: "analysis failed" for service in self.service_configs}
+        for service, reason in degraded.items():
+            self.health.record_degraded(service, reason)
+        analyzer.write_log("Script execution ended")
+
+        if self.write_timings:
+            return telemetry.end_cycle()
+        return telemetry.end_cycle(None, None)
+
+    def close(self):
+        self.executor.shutdown()
+        self.journal.close()
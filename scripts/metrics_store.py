@@ -0,0 +1,494 @@
+#!/usr/bin/env python
+
+# Columnar, time-partitioned store for the monitored metrics.
+#
+# Every workload has its own folder with a schema.json (the column names, Timestamp last, same as the
+# CSV header) and one binary segment per UTC day. A segment is a plain array of little-endian float64
+# rows, so the last N samples are read with a single seek from the end of the newest segments
+# instead of parsing the whole history. Writers lock a segment (on a .lock file next to it) while they append
+# to it or rewrite it, so a backfill merging into the day the monitor is appending to does not lose samples.
+#
+# Rollups of the raw samples are kept alongside them in rollups/<tier>, as stores of their own with the same
+# layout: 1 minute, 5 minute and 1 hour buckets with the min, max, average and count of every metric, the
+# timestamp being the start of the bucket. They are updated with every append, from the raw samples for the
+# 1 minute tier and from the next finer tier for the others, once a bucket is complete. read_history() reads
+# a time horizon from the finest tier that keeps it under MAX_HISTORY_ROWS rows, so weeks of history cost
+# thousands of rows instead of millions. Raw retention does not touch the rollups.
+#
+# Usage: python3 metrics_store.py compact [--service <name>]
+#        python3 metrics_store.py retain --days <n> [--tier 1m|5m|1h] [--service <name>]
+#        python3 metrics_store.py rollup [--service <name>]   (rebuild the rollups of the stored samples)
+
+import argparse
+import contextlib
+import datetime
+import fcntl
+import json
+import os
+
+import numpy as np
+
+# Constants
+STORE_FOLDER = "../store"
+SCHEMA_FILE = "schema.json"
+SEGMENT_SUFFIX = ".bin"
+LOCK_SUFFIX = ".lock"
+TIMESTAMP_COLUMN = "Timestamp"
+DTYPE = np.dtype("<f8")
+
+ROLLUP_FOLDER = "rollups"
+ROLLUP_TIERS = {"1m": 60, "5m": 300, "1h": 3600}
+ROLLUP_STATISTICS = ["min", "max", "avg", "count"]
+
+# Interval of the raw samples written by the monitor, and the most rows read_history() returns
+RAW_STEP_S = 10
+MAX_HISTORY_ROWS = 5000
+
+
+class MetricsStore:
+    def __init__(self, root=STORE_FOLDER, rollups=True):
+        self.root = root
+        self.schemas = {}
+        self.last_timestamps = {}
+        # One store per rollup tier, finest first
+        self.tiers = {tier: MetricsStore(os.path.join(root, ROLLUP_FOLDER, tier), rollups=False) for tier in ROLLUP_TIERS} if rollups else {}
+
+    def services(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isfile(os.path.join(self.root, name, SCHEMA_FILE)))
+
+    def service_folder(self, service):
+        return os.path.join(self.root, service)
+
+    # Column names of a service (Timestamp last), or None if nothing was stored yet
+    def columns(self, service):
+        if service not in self.schemas:
+            schema_path = os.path.join(self.service_folder(service), SCHEMA_FILE)
+            if not os.path.exists(schema_path):
+                return None
+            with open(schema_path, "r") as json_file:
+                self.schemas[service] = json.load(json_file)["columns"]
+        return self.schemas[service]
+
+    def ensure_schema(self, service, columns):
+        columns = list(columns)
+        if columns[-1] != TIMESTAMP_COLUMN:
+            raise ValueError(f"The last column of {service} must be '{TIMESTAMP_COLUMN}', got '{columns[-1]}'")
+
+        existing = self.columns(service)
+        if existing is None:
+            os.makedirs(self.service_folder(service), exist_ok=True)
+            with open(os.path.join(self.service_folder(service), SCHEMA_FILE), "w") as json_file:
+                json.dump({"columns": columns}, json_file, indent=4)
+            self.schemas[service] = columns
+        elif existing != columns:
+            raise ValueError(f"Columns of {service} do not match the stored schema")
+
+    # Segment files of a service, oldest first
+    def segments(self, service):
+        folder = self.service_folder(service)
+        if not os.path.isdir(folder):
+            return []
+        names = sorted(name for name in os.listdir(folder) if name.endswith(SEGMENT_SUFFIX))
+        return [os.path.join(folder, name) for name in names]
+
+    def segment_path(self, service, day):
+        return os.path.join(self.service_folder(service), day + SEGMENT_SUFFIX)
+
+    def row_width(self, service):
+        return len(self.columns(service))
+
+    # Timestamp of the newest stored sample, or None
+    def last_timestamp(self, service):
+        if service not in self.last_timestamps:
+            rows = self.tail(service, 1)
+            self.last_timestamps[service] = rows[-1, -1] if len(rows) else None
+        return self.last_timestamps[service]
+
+    # Append rows (values followed by the timestamp) for a service.
+    # With dedupe=True rows that are not newer than the newest stored sample are dropped, so overlapping fetch windows do not duplicate samples.
+    def append(self, service, columns, rows, dedupe=True):
+        self.ensure_schema(service, columns)
+
+        rows = np.asarray(rows, dtype=DTYPE).reshape(-1, len(columns))
+        if dedupe:
+            last_timestamp = self.last_timestamp(service)
+            if last_timestamp is not None:
+                rows = rows[rows[:, -1] > last_timestamp]
+        if not len(rows):
+            return 0
+
+        days = day_of(rows[:, -1])
+        for day in np.unique(days):
+            path = self.segment_path(service, day)
+            with segment_lock(path), open(path, "ab") as file:
+                file.write(rows[days == day].tobytes())
+
+        newest = rows[:, -1].max()
+        if self.last_timestamps.get(service) is None or newest > self.last_timestamps[service]:
+            self.last_timestamps[service] = newest
+
+        if self.tiers:
+            self.update_rollups(service)
+        return len(rows)
+
+    # Write rows that may be older than the stored data (e.g. a backfill) and rewrite the touched segments sorted and deduplicated by timestamp.
+    # With rollups=False the rollups are left for a later refresh_rollups(), e.g. once a backfill of many chunks is done.
+    def merge(self, service, columns, rows, rollups=True):
+        self.ensure_schema(service, columns)
+
+        rows = np.asarray(rows, dtype=DTYPE).reshape(-1, len(columns))
+        if not len(rows):
+            return 0
+
+        days = day_of(rows[:, -1])
+        for day in np.unique(days):
+            self.compact_segment(service, self.segment_path(service, day), rows[days == day])
+
+        self.last_timestamps.pop(service, None)
+
+        if rollups:
+            self.refresh_rollups(service, rows[:, -1].min())
+        return len(rows)
+
+    def read_segment(self, service, path):
+        width = self.row_width(service)
+        values = np.fromfile(path, dtype=DTYPE)
+        # Ignore a partially written trailing row
+        return values[:len(values) // width * width].reshape(-1, width)
+
+    # Last n rows of a service; reads only the end of the newest segments
+    def tail(self, service, n):
+        columns = self.columns(service)
+        if columns is None:
+            return np.empty((0, 0), dtype=DTYPE)
+
+        width = len(columns)
+        row_bytes = width * DTYPE.itemsize
+        parts = []
+        remaining = n
+
+        for path in reversed(self.segments(service)):
+            if remaining <= 0:
+                break
+            available = os.path.getsize(path) // row_bytes
+            count = min(available, remaining)
+            with open(path, "rb") as file:
+                file.seek((available - count) * row_bytes)
+                parts.append(np.frombuffer(file.read(count * row_bytes), dtype=DTYPE).reshape(-1, width))
+            remaining -= count
+
+        if not parts:
+            return np.empty((0, width), dtype=DTYPE)
+        return np.concatenate(parts[::-1])
+
+    # Rows newer than timestamp (or at it, with inclusive=True), read backwards from the end in growing chunks
+    # so the cost follows the number of new rows
+    def read_since(self, service, timestamp, chunk=64, inclusive=False):
+        while True:
+            rows = self.tail(service, chunk)
+            if len(rows) < chunk or rows[0, -1] <= timestamp:
+                if not len(rows):
+                    return rows
+                return rows[rows[:, -1] >= timestamp] if inclusive else rows[rows[:, -1] > timestamp]
+            chunk *= 4
+
+    # Rows with start_ts <= timestamp < end_ts; only the segments of the days in the range are read
+    def read_range(self, service, start_ts, end_ts):
+        columns = self.columns(service)
+        if columns is None:
+            return np.empty((0, 0), dtype=DTYPE)
+
+        first_day = day_of(np.array([start_ts]))[0]
+        last_day = day_of(np.array([end_ts]))[0]
+        parts = []
+        for path in self.segments(service):
+            day = os.path.basename(path)[:-len(SEGMENT_SUFFIX)]
+            if first_day <= day <= last_day:
+                rows = self.read_segment(service, path)
+                parts.append(rows[(rows[:, -1] >= start_ts) & (rows[:, -1] < end_ts)])
+
+        if not parts:
+            return np.empty((0, len(columns)), dtype=DTYPE)
+        return np.concatenate(parts)
+
+    # All rows of a service, oldest segment first
+    def read_all(self, service):
+        columns = self.columns(service)
+        if columns is None:
+            return np.empty((0, 0), dtype=DTYPE)
+
+        parts = [self.read_segment(service, path) for path in self.segments(service)]
+        if not parts:
+            return np.empty((0, len(columns)), dtype=DTYPE)
+        return np.concatenate(parts)
+
+    # Add the buckets completed since the last update to every rollup tier; returns the number of rows written per tier
+    def update_rollups(self, service):
+        newest = self.last_timestamp(service)
+        if newest is None or not self.tiers:
+            return {}
+
+        metric_count = self.row_width(service) - 1
+        written = {}
+        source = None
+        for tier, size in ROLLUP_TIERS.items():
+            store = self.tiers[tier]
+            last_bucket = store.last_timestamp(service)
+            start = last_bucket + size if last_bucket is not None else -np.inf
+
+            # A bucket is complete once a sample of a later bucket was stored
+            complete_until = np.floor(newest / size) * size
+            finer, source = source, store
+            if complete_until <= start:
+                continue
+
+            # The finer tier is still empty (a (0, 0) array) until its first bucket is complete
+            rows = (finer or self).read_since(service, start, inclusive=True)
+            if rows.size == 0 or rows.ndim != 2:
+                continue
+            rows = rows[rows[:, -1] < complete_until]
+            buckets = aggregate(rows, size) if finer is None else combine(rows, size, metric_count)
+            if len(buckets):
+                written[tier] = store.append(service, rollup_columns(self.columns(service)), buckets)
+        return written
+
+    # Rebuild the rollups from the hour of timestamp on, after older samples were written
+    def refresh_rollups(self, service, timestamp):
+        start = np.floor(timestamp / ROLLUP_TIERS["1h"]) * ROLLUP_TIERS["1h"]
+        for store in self.tiers.values():
+            store.truncate(service, start)
+        return self.update_rollups(service)
+
+    # Rebuild all rollups of a service from its stored samples
+    def rebuild_rollups(self, service):
+        return self.refresh_rollups(service, -np.inf)
+
+    # Rows of a rollup tier from start_ts on, followed by the buckets not complete yet, computed from the finer data
+    def rollup_rows(self, service, tier, start_ts):
+        size = ROLLUP_TIERS[tier]
+        rows = self.tiers[tier].read_since(service, start_ts, inclusive=True)
+        if rows.size == 0:
+            rows = np.empty((0, len(rollup_columns(self.columns(service)))), dtype=DTYPE)
+
+        recent_start = rows[-1, -1] + size if len(rows) else np.floor(start_ts / size) * size
+        tiers = list(ROLLUP_TIERS)
+        finer = tiers[tiers.index(tier) - 1] if tiers.index(tier) > 0 else None
+        if finer is None:
+            recent = aggregate(self.read_since(service, recent_start, inclusive=True), size)
+        else:
+            recent = combine(self.rollup_rows(service, finer, recent_start), size, self.row_width(service) - 1)
+        return np.concatenate([rows, recent]) if len(recent) else rows
+
+    # The last horizon_s seconds of a service in the layout of the raw rows, from the finest tier that holds them in at
+    # most max_rows rows; a rollup tier gives one row per bucket with the chosen statistic. Returns (rows, step in seconds).
+    def read_history(self, service, horizon_s, max_rows=MAX_HISTORY_ROWS, statistic="avg"):
+        newest = self.last_timestamp(service)
+        if newest is None:
+            return np.empty((0, len(self.columns(service) or [])), dtype=DTYPE), RAW_STEP_S
+
+        start = newest - horizon_s
+        tier = select_tier(horizon_s, max_rows) if self.tiers else None
+        if tier is None:
+            return self.read_since(service, start), RAW_STEP_S
+
+        size = ROLLUP_TIERS[tier]
+        rows = self.rollup_rows(service, tier, np.floor(start / size) * size)
+        return rollup_statistic(rows, statistic), size
+
+    # Drop the rows at or after timestamp
+    def truncate(self, service, timestamp):
+        if self.columns(service) is None:
+            return 0
+        first_day = day_of(np.array([max(timestamp, 0)]))[0]
+
+        removed = 0
+        for path in self.segments(service):
+            if os.path.basename(path)[:-len(SEGMENT_SUFFIX)] < first_day:
+                continue
+            with segment_lock(path):
+                rows = self.read_segment(service, path)
+                kept = rows[rows[:, -1] < timestamp]
+                removed += len(rows) - len(kept)
+                if len(kept):
+                    temp_path = path + ".tmp"
+                    kept.tofile(temp_path)
+                    os.replace(temp_path, path)
+                else:
+                    os.remove(path)
+        self.last_timestamps.pop(service, None)
+        return removed
+
+    # Last n rows of a service as a DataFrame with the stored column names
+    def tail_frame(self, service, n):
+        # Imported here so that writers (e.g. the monitor) do not pay for pandas
+        import pandas as pd
+
+        columns = self.columns(service) or []
+        return pd.DataFrame(self.tail(service, n), columns=columns)
+
+    # Sort a segment by timestamp and drop duplicated timestamps (keeping the last written row), after adding new_rows to it.
+    # The segment stays locked from the read to the replace, so rows appended meanwhile by another process are not lost.
+    def compact_segment(self, service, path, new_rows=None):
+        with segment_lock(path):
+            rows = self.read_segment(service, path) if os.path.exists(path) else np.empty((0, self.row_width(service)), dtype=DTYPE)
+            if new_rows is not None:
+                rows = np.concatenate([rows, new_rows])
+            # Reverse so that np.unique keeps the last written row of each timestamp
+            reversed_rows = rows[::-1]
+            _, index = np.unique(reversed_rows[:, -1], return_index=True)
+            compacted = reversed_rows[index]
+
+            temp_path = path + ".tmp"
+            compacted.tofile(temp_path)
+            os.replace(temp_path, path)
+        return len(rows) - len(compacted)
+
+    def compact(self, service):
+        removed = 0
+        for path in self.segments(service):
+            removed += self.compact_segment(service, path)
+        self.last_timestamps.pop(service, None)
+        return removed
+
+    # Delete the segments of days older than `days` days, with their lock files.
+    # A segment is removed under its lock, so a writer holding it (e.g. a backfill of that day) finishes first.
+    def apply_retention(self, service, days, now=None):
+        now = now if now is not None else datetime.datetime.now(datetime.timezone.utc).timestamp()
+        oldest_day = day_of(np.array([now - days * 86400]))[0]
+
+        removed = []
+        for path in self.segments(service):
+            day = os.path.basename(path)[:-len(SEGMENT_SUFFIX)]
+            if day < oldest_day:
+                with segment_lock(path):
+                    os.remove(path)
+                    os.remove(path + LOCK_SUFFIX)
+                removed.append(day)
+        self.last_timestamps.pop(service, None)
+        return removed
+
+
+# Exclusive lock of a segment between processes, e.g. the monitor appending while a backfill rewrites the segment.
+# The lock is taken on a file next to the segment, since a rewrite replaces the segment file itself.
+# Retention removes the lock file while holding it; a lock obtained on a removed lock file is taken again on the current one.
+@contextlib.contextmanager
+def segment_lock(path):
+    lock_path = path + LOCK_SUFFIX
+    while True:
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                current = os.stat(lock_path)
+            except FileNotFoundError:
+                continue
+            if os.path.samestat(current, os.fstat(lock_file.fileno())):
+                yield
+                return
+
+
+# UTC day (YYYY-MM-DD) of every timestamp
+def day_of(timestamps):
+    return np.datetime_as_string(np.asarray(timestamps).astype("datetime64[s]"), unit="D")
+
+
+# Columns of a rollup tier: every statistic of every metric, statistic by statistic, then the bucket start
+def rollup_columns(columns):
+    return [f"{metric} {statistic}" for statistic in ROLLUP_STATISTICS for metric in columns[:-1]] + [TIMESTAMP_COLUMN]
+
+
+# Finest rollup tier holding horizon_s seconds in at most max_rows rows, or None when the raw samples do
+def select_tier(horizon_s, max_rows=MAX_HISTORY_ROWS):
+    if horizon_s / RAW_STEP_S <= max_rows:
+        return None
+    for tier, size in ROLLUP_TIERS.items():
+        if horizon_s / size <= max_rows:
+            return tier
+    return list(ROLLUP_TIERS)[-1]
+
+
+# Reduce per-row minima, maxima, sums and counts (rows sorted by timestamp) to one rollup row per bucket
+def reduce_buckets(timestamps, size, minima, maxima, sums, counts):
+    buckets = np.floor(timestamps / size) * size
+    starts, index = np.unique(buckets, return_index=True)
+
+    present = counts > 0
+    counts = np.add.reduceat(counts, index, axis=0)
+    sums = np.add.reduceat(np.where(present, sums, 0.0), index, axis=0)
+    minima = np.minimum.reduceat(np.where(present, minima, np.inf), index, axis=0)
+    maxima = np.maximum.reduceat(np.where(present, maxima, -np.inf), index, axis=0)
+
+    # A metric without any sample in a bucket is NaN, like a missing raw value
+    empty = counts == 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        averages = sums / counts
+    for block in (minima, maxima, averages):
+        block[empty] = np.nan
+    return np.hstack([minima, maxima, averages, counts, starts[:, None]]).astype(DTYPE)
+
+
+# Rollup rows of raw rows (values followed by the timestamp)
+def aggregate(rows, size):
+    if not len(rows):
+        return np.empty((0, 0), dtype=DTYPE)
+    rows = rows[np.argsort(rows[:, -1], kind="stable")]
+    values = rows[:, :-1]
+    present = ~np.isnan(values)
+    return reduce_buckets(rows[:, -1], size, values, values, values, present.astype(DTYPE))
+
+
+# Rollup rows of coarser buckets from rollup rows of a finer tier
+def combine(rows, size, metric_count):
+    if not len(rows):
+        return np.empty((0, 0), dtype=DTYPE)
+    rows = rows[np.argsort(rows[:, -1], kind="stable")]
+    minima, maxima, averages, counts = (rows[:, k * metric_count:(k + 1) * metric_count] for k in range(len(ROLLUP_STATISTICS)))
+    return reduce_buckets(rows[:, -1], size, minima, maxima, averages * counts, counts)
+
+
+# Rollup rows reduced to the layout of the raw rows: one statistic of every metric, then the timestamp
+def rollup_statistic(rows, statistic):
+    metric_count = (rows.shape[1] - 1) // len(ROLLUP_STATISTICS)
+    k = ROLLUP_STATISTICS.index(statistic)
+    return np.hstack([rows[:, k * metric_count:(k + 1) * metric_count], rows[:, -1:]])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Maintain the metrics store.")
+    parser.add_argument("--store-folder", default=STORE_FOLDER, help="Store location (default: ../store).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compact_parser = subparsers.add_parser("compact", help="Sort segments by timestamp and drop duplicated samples.")
+    compact_parser.add_argument("--service", help="Only this service (default: all).")
+
+    retain_parser = subparsers.add_parser("retain", help="Delete segments older than the retention period.")
+    retain_parser.add_argument("--days", type=int, required=True, help="Number of days to keep.")
+    retain_parser.add_argument("--tier", choices=list(ROLLUP_TIERS), help="Apply to this rollup tier instead of the raw samples.")
+    retain_parser.add_argument("--service", help="Only this service (default: all).")
+
+    rollup_parser = subparsers.add_parser("rollup", help="Rebuild the rollup tiers from the stored samples.")
+    rollup_parser.add_argument("--service", help="Only this service (default: all).")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    store = MetricsStore(args.store_folder)
+    services = [args.service] if args.service else store.services()
+
+    for service in services:
+        if args.command == "compact":
+            removed = store.compact(service)
+            print(f"{service}: removed {removed} duplicated samples")
+        elif args.command == "rollup":
+            written = store.rebuild_rollups(service)
+            print(f"{service}: " + ", ".join(f"{count} rows in {tier}" for tier, count in written.items()))
+        else:
+            removed = (store.tiers[args.tier] if args.tier else store).apply_retention(service, args.days)
+            print(f"{service}: deleted {len(removed)} segments")
+
+
+if __name__ == "__main__":
+    main()
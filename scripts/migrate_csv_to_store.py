@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+# One-off migration of the CSV files in output/ into the metrics store.
+# Usage: python3 migrate_csv_to_store.py [--output-folder ../output] [--store-folder ../store]
+
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from metrics_store import MetricsStore, STORE_FOLDER
+
+# Constants
+OUTPUT_FOLDER = "../output"
+CSV_SUFFIX = "_output.csv"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Migrate the output/*_output.csv files into the metrics store.")
+    parser.add_argument("--output-folder", default=OUTPUT_FOLDER, help="Folder with the CSV files (default: ../output).")
+    parser.add_argument("--store-folder", default=STORE_FOLDER, help="Store location (default: ../store).")
+    return parser.parse_args()
+
+
+def read_csv(csv_file_location):
+    # Read the header row
+    with open(csv_file_location, "r", newline="") as file:
+        columns = next(csv.reader(file))
+
+    # Read the data rows, empty values become NaN
+    rows = np.genfromtxt(csv_file_location, delimiter=",", skip_header=1, dtype=float).reshape(-1, len(columns))
+    return columns, rows
+
+
+def main():
+    args = parse_args()
+    store = MetricsStore(args.store_folder)
+
+    for csv_file in sorted(os.listdir(args.output_folder)):
+        if not csv_file.endswith(CSV_SUFFIX):
+            continue
+
+        service = csv_file[:-len(CSV_SUFFIX)]
+        columns, rows = read_csv(os.path.join(args.output_folder, csv_file))
+
+        # merge sorts and deduplicates by timestamp, so the migration can be re-run safely
+        store.merge(service, columns, rows)
+        print(f"Migrated {len(rows)} rows of {csv_file}")
+
+
+if __name__ == "__main__":
+    main()
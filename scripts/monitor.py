@@ -2,139 +2,351 @@
 
 # Import necessary libraries
 import sys
-import csv
 import os
-from sdcclient import IbmAuthHelper, SdMonitorClient
-import json
+import argparse
 import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import telemetry
+import ingest
+import config_cache
+from metrics_store import MetricsStore
 
 # Constants
 
 SCRIPTS_FOLDER = "../scripts"
+METRICS_FOLDER = "../metrics"
 
 # Add the monitoring instance information that is required for authentication
 URL = "https://ca-tor.monitoring.cloud.ibm.com"
 APIKEY = "*****"
 GUID = "*****"
-ibm_headers = IbmAuthHelper.get_headers(URL, APIKEY, GUID)
-
-# Instantiate the Python client
-sdclient = SdMonitorClient(sdc_url=URL, custom_headers=ibm_headers)
 
 # Define the Kubernetes namespace you want to monitor
+# (the default scope; the sharded controller passes a (cluster, namespace) scope per target)
 kube_namespace = "acmeair-g4"
 kube_cluster_name = "ece750cluster"
 
+# Workloads to monitor
+SERVICE_NAMES = ["acmeair-authservice", "acmeair-bookingservice", "acmeair-customerservice", "acmeair-flightservice", "acmeair-mainservice"]
+DB_SERVICE_NAMES = ["acmeair-booking-db", "acmeair-customer-db", "acmeair-flight-db"]
+
+# Time span (in seconds, counting backward from now) fetched in every cycle
+FETCH_WINDOW_S = 300
+
+# Concurrent fetch settings: maximum requests in flight, per-request timeout and retries
+MAX_CONCURRENT_FETCHES = 8
+FETCH_TIMEOUT_S = 30
+FETCH_RETRIES = 2
+RETRY_BACKOFF_S = 1
+
+# Batched fetch settings: the workload name is requested as a group-by key in front of the metrics
+GROUP_BY_WORKLOAD = {"id": "kubernetes.workload.name"}
+MAX_WORKLOADS_PER_BATCH = 50
+
 # Path to the log file
 log_file = "../logs/monitor.log"
 
-# Get the current date and time
-current_time = datetime.datetime.now()
 
-# Format the timestamp
-timestamp = current_time.strftime("%Y-%m-%d %H:%M:%S")
+def write_log(message):
+    # Get the current date and time
+    current_time = datetime.datetime.now()
 
-# Open the log file in append mode and write the timestamp
-with open(log_file, "a") as file:
-    file.write(f"Script execution started at {timestamp}\n")
+    # Format the timestamp
+    timestamp = current_time.strftime("%Y-%m-%d %H:%M:%S")
 
+    # Open the log file in append mode and write the timestamp
+    with open(log_file, "a") as file:
+        file.write(f"{message} at {timestamp}\n")
 
-# Function to fetch and save metrics
-def fetch_and_save_metrics(metrics, coulumn_names, service_names):
-    # Iterate over each item in kube_pods_list
-    for service_name in service_names:
 
-        #
-        # Prepare the filter
-        #
+# Authenticate against the monitoring instance and instantiate the Python client
+def create_client():
+    # Imported here so that the module can be imported (e.g. by the driver) before the client is needed
+    from sdcclient import IbmAuthHelper, SdMonitorClient
+
+    ibm_headers = IbmAuthHelper.get_headers(URL, APIKEY, GUID)
+    return SdMonitorClient(sdc_url=URL, custom_headers=ibm_headers)
+
+
+# Load and validate a metrics JSON file; the result is cached until the file changes
+def load_metric_spec(file_name):
+    def build(data_dict):
+        ingest.validate_metric_spec(data_dict, file_name)
+        return data_dict
+
+    return config_cache.load_json(os.path.join(METRICS_FOLDER, file_name), build)
+
+
+def load_metric_specs():
+    return {"app": load_metric_spec("metrics.json"), "db": load_metric_spec("db_metrics.json")}
+
 
-        filter = "kubernetes.cluster.name='%s' and kubernetes.namespace.name='%s' and kubernetes.workload.name='%s'" % (kube_cluster_name, kube_namespace, service_name)
+# (cluster, namespace) of a scope, defaulting to the module settings
+def resolve_scope(scope=None):
+    return scope or (kube_cluster_name, kube_namespace)
 
+
+# Build the filter selecting a single workload
+def build_filter(service_name, scope=None):
+    cluster_name, namespace = resolve_scope(scope)
+    return "kubernetes.cluster.name='%s' and kubernetes.namespace.name='%s' and kubernetes.workload.name='%s'" % (cluster_name, namespace, service_name)
+
+
+# Fetch the metrics of a single workload
+# start_ts and end_ts are relative to now when not positive, epoch seconds otherwise
+def fetch_metrics(sdclient, metrics, service_name, start_ts=-FETCH_WINDOW_S, scope=None, end_ts=0):
+    with telemetry.phase("fetch", service=service_name):
         ok, res = sdclient.get_data(metrics=metrics,  # List of metrics to query
-                                    start_ts= -300,
-                                    end_ts= 0,
+                                    start_ts=start_ts,
+                                    end_ts=end_ts,
                                     sampling_s=10,  # 1 data point per 10 seconds
-                                    filter=filter,  # The filter specifying the target host
+                                    filter=build_filter(service_name, scope),  # The filter specifying the target workload
                                     datasource_type='container')  # The source for our metrics is the container
 
+    if not ok:
+        raise RuntimeError(f"Error fetching metrics for {service_name}: {res}")
 
-        if not ok:
-            print("Error")
-            print(res)
-            sys.exit(1)
-            
-        # Specify the name of the CSV file
-        csv_file = service_name + "_output.csv"
-        csv_file_location = "../output/" + csv_file
-
-        to_write_column = True
-        is_file_not_exists = False
-
-        if not os.path.exists(csv_file_location):
-            is_file_not_exists = True
-
-        # Write data to CSV
-        with open(csv_file_location, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            
-            if to_write_column and is_file_not_exists:
-                # Write the header row
-                writer.writerow(coulumn_names)
-                to_write_column = False
-            
-
-            # Write the data rows        
-            data_rows = res['data']
-            for entry in data_rows:
-                timestamp = entry['t']
-                values = entry['d']
-                row = values + [timestamp]  # Combine values and timestamp in one row
-                writer.writerow(row)
-      
-        print(f"Data has been saved to {csv_file}")
+    return res
 
 
-def main():
-    try:
+# Decode a get_data response into rows of values followed by the timestamp (missing values become NaN)
+def response_to_rows(res, coulumn_names, service_name):
+    with telemetry.phase("decode", service=service_name):
+        return ingest.decode(res, coulumn_names, label=service_name)
+
+
+# Append the decoded rows of a workload to the metrics store
+def save_metrics(store, service_name, coulumn_names, rows):
+    with telemetry.phase("store_write", service=service_name):
+        saved = store.append(service_name, coulumn_names, rows)
 
-        service_names = ["acmeair-authservice", "acmeair-bookingservice", "acmeair-customerservice", "acmeair-flightservice", "acmeair-mainservice"]
-        db_service_names = ["acmeair-booking-db", "acmeair-customer-db", "acmeair-flight-db"]
- 
-        # Initialize an empty dictionary
-        data_dict = {}
-        
-        # Read the JSON file and store its contents in the dictionary
-        with open("../metrics/metrics.json", "r") as json_file:
-            data_dict = json.load(json_file)
+    print(f"{saved} new samples have been saved for {service_name}")
 
 
-        # Initialize an empty dictionary
-        db_data_dict = {}
+# Raised when the metrics of some workloads could not be fetched; the metrics of the other workloads are saved
+class FetchError(RuntimeError):
+    def __init__(self, service_names):
+        super().__init__(f"Error fetching metrics for {', '.join(service_names)}")
+        self.service_names = service_names
 
-        # Read the JSON file and store its contents in the dictionary
-        with open("../metrics/db_metrics.json", "r") as json_file:
-            db_data_dict = json.load(json_file)
 
-        
-        # Fetch and save metrics for Kubernetes pods
-        fetch_and_save_metrics(data_dict["metrics"], data_dict["column_display_name"], service_names)
+# Function to fetch and save metrics.
+# Every request has a timeout, and a workload that fails is reported at the end without stopping the others.
+# A malformed response (ingest.SchemaError) or rows that do not match the stored schema (ValueError) fail that workload only.
+def fetch_and_save_metrics(sdclient, store, metrics, coulumn_names, service_names, start_ts=-FETCH_WINDOW_S, scope=None, deadline=None):
+    failed = []
 
-        # Fetch and save metrics for Kubernetes DB pods
-        fetch_and_save_metrics(db_data_dict["metrics"], db_data_dict["column_display_name"], db_service_names)
+    # Iterate over each item in kube_pods_list
+    for service_name in service_names:
+        try:
+            res = fetch_metrics_with_retries(sdclient, metrics, service_name, start_ts, scope=scope, deadline=deadline)
+            save_metrics(store, service_name, coulumn_names, response_to_rows(res, coulumn_names, service_name))
+        except (RuntimeError, ValueError) as e:
+            print(e)
+            failed.append(service_name)
+
+    if failed:
+        raise FetchError(failed)
+
+
+# Run func in a daemon thread and give up waiting for it after timeout_s seconds.
+# The client has no per-request timeout, so a hung call is abandoned rather than cancelled.
+def call_with_timeout(timeout_s, func, *args, **kwargs):
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = func(*args, **kwargs)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout_s)
+
+    if thread.is_alive():
+        raise TimeoutError(f"Call did not complete within {timeout_s} seconds")
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+# Call func with a timeout, retrying failed or timed out calls with exponential backoff.
+# With a deadline (time.monotonic() value) no attempt runs or waits past it.
+def call_with_retries(label, timeout_s, retries, func, *args, deadline=None):
+    for attempt in range(retries + 1):
+        attempt_timeout_s = timeout_s if deadline is None else min(timeout_s, deadline - time.monotonic())
+        if attempt_timeout_s <= 0:
+            raise RuntimeError(f"Giving up on {label}: the phase deadline has passed")
+        try:
+            return call_with_timeout(attempt_timeout_s, func, *args)
+        except Exception as e:
+            backoff_s = RETRY_BACKOFF_S * (2 ** attempt)
+            if attempt == retries or (deadline is not None and time.monotonic() + backoff_s >= deadline):
+                raise RuntimeError(f"Giving up on {label} after {attempt + 1} attempts: {e}")
+            print(f"Retrying {label} after error: {e}")
+            time.sleep(backoff_s)
+
+
+# Fetch the metrics of a single workload, retrying failed or timed out requests
+def fetch_metrics_with_retries(sdclient, metrics, service_name, start_ts=-FETCH_WINDOW_S, timeout_s=FETCH_TIMEOUT_S, retries=FETCH_RETRIES, scope=None, deadline=None):
+    return call_with_retries(service_name, timeout_s, retries, fetch_metrics, sdclient, metrics, service_name, start_ts, scope, deadline=deadline)
+
+
+# Fetch the metrics of many workloads at once with a bounded thread pool.
+# jobs is a list of (metrics, column names, service name); the samples are stored from the calling thread.
+def fetch_and_save_metrics_concurrently(sdclient, store, jobs, start_ts=-FETCH_WINDOW_S, max_workers=MAX_CONCURRENT_FETCHES, timeout_s=FETCH_TIMEOUT_S, retries=FETCH_RETRIES, scope=None, deadline=None):
+    failed = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for metrics, coulumn_names, service_name in jobs:
+            future = pool.submit(fetch_metrics_with_retries, sdclient, metrics, service_name, start_ts, timeout_s, retries, scope, deadline)
+            futures[future] = (coulumn_names, service_name)
+
+        for future in as_completed(futures):
+            coulumn_names, service_name = futures[future]
+            try:
+                save_metrics(store, service_name, coulumn_names, response_to_rows(future.result(), coulumn_names, service_name))
+            except (RuntimeError, ValueError) as e:
+                print(e)
+                failed.append(service_name)
+
+    if failed:
+        raise FetchError(failed)
+
+
+# Build the filter selecting a group of workloads
+def build_batch_filter(service_names, scope=None):
+    cluster_name, namespace = resolve_scope(scope)
+    workloads = ", ".join("'%s'" % service_name for service_name in service_names)
+    return "kubernetes.cluster.name='%s' and kubernetes.namespace.name='%s' and kubernetes.workload.name in (%s)" % (cluster_name, namespace, workloads)
+
+
+# Fetch the metrics of a group of workloads with a single request, grouped by workload name.
+# Every returned row starts with the workload name; the decoded rows are split into one block per workload.
+def fetch_metrics_batch(sdclient, metrics, coulumn_names, service_names, start_ts=-FETCH_WINDOW_S, scope=None, end_ts=0):
+    with telemetry.phase("fetch_batch", first_service=service_names[0], workloads=len(service_names)):
+        ok, res = sdclient.get_data(metrics=[GROUP_BY_WORKLOAD] + metrics,  # Group by workload, then the list of metrics to query
+                                    start_ts=start_ts,
+                                    end_ts=end_ts,
+                                    sampling_s=10,  # 1 data point per 10 seconds
+                                    filter=build_batch_filter(service_names, scope),  # The filter specifying the target workloads
+                                    datasource_type='container')  # The source for our metrics is the container
 
+    if not ok:
+        raise RuntimeError(f"Error fetching metrics for {', '.join(service_names)}: {res}")
+
+    with telemetry.phase("decode", first_service=service_names[0], workloads=len(service_names)):
+        return ingest.decode_grouped(res, coulumn_names, service_names, label=", ".join(service_names))
+
+
+# Split a list of workloads into groups of at most batch_size workloads
+def make_batches(service_names, batch_size=MAX_WORKLOADS_PER_BATCH):
+    return [service_names[i:i + batch_size] for i in range(0, len(service_names), batch_size)]
+
+
+# Fetch and save metrics with one request per group of workloads instead of one request per workload.
+# batches is a list of (metrics, column names, service names); independent batches run in parallel when max_workers > 1.
+def fetch_and_save_metrics_batched(sdclient, store, batches, start_ts=-FETCH_WINDOW_S, max_workers=1, timeout_s=FETCH_TIMEOUT_S, retries=FETCH_RETRIES, scope=None, deadline=None):
+    failed = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for metrics, coulumn_names, service_names in batches:
+            label = ", ".join(service_names)
+            future = pool.submit(call_with_retries, label, timeout_s, retries, fetch_metrics_batch, sdclient, metrics, coulumn_names, service_names, start_ts, scope, deadline=deadline)
+            futures[future] = (coulumn_names, service_names)
+
+        for future in as_completed(futures):
+            coulumn_names, service_names = futures[future]
+            try:
+                blocks = future.result()
+            except (RuntimeError, ValueError) as e:
+                print(e)
+                failed.extend(service_names)
+                continue
+
+            for service_name in service_names:
+                if not len(blocks[service_name]):
+                    print(f"No data returned for {service_name}")
+                    continue
+                try:
+                    save_metrics(store, service_name, coulumn_names, blocks[service_name])
+                except ValueError as e:
+                    print(e)
+                    failed.append(service_name)
+
+    if failed:
+        raise FetchError(failed)
+
+
+# One monitoring pass over all app and DB workloads, reusing an existing client and metric specs.
+# With concurrency > 1 all workloads are fetched in parallel, at most `concurrency` requests at a time.
+# With batched=True there is one request per metric spec (and per MAX_WORKLOADS_PER_BATCH workloads) instead of one per workload.
+# service_names, db_service_names and scope select other workloads than the module defaults (see sharded_controller.py).
+# With a deadline (time.monotonic() value) no request runs past it. Workloads that could not be fetched are
+# raised together in a FetchError once the others are saved.
+def run_monitor(sdclient, metric_specs, store, start_ts=-FETCH_WINDOW_S, concurrency=1, batched=False, service_names=None, db_service_names=None, scope=None, deadline=None):
+    data_dict = metric_specs["app"]
+    db_data_dict = metric_specs["db"]
+    service_names = SERVICE_NAMES if service_names is None else service_names
+    db_service_names = DB_SERVICE_NAMES if db_service_names is None else db_service_names
+
+    if batched:
+        batches = [(data_dict["metrics"], data_dict["column_display_name"], batch) for batch in make_batches(service_names)]
+        batches += [(db_data_dict["metrics"], db_data_dict["column_display_name"], batch) for batch in make_batches(db_service_names)]
+
+        fetch_and_save_metrics_batched(sdclient, store, batches, start_ts, max_workers=concurrency, scope=scope, deadline=deadline)
+        return
+
+    if concurrency > 1:
+        jobs = [(data_dict["metrics"], data_dict["column_display_name"], service_name) for service_name in service_names]
+        jobs += [(db_data_dict["metrics"], db_data_dict["column_display_name"], service_name) for service_name in db_service_names]
+
+        fetch_and_save_metrics_concurrently(sdclient, store, jobs, start_ts, max_workers=concurrency, scope=scope, deadline=deadline)
+        return
+
+    # A failed app workload does not keep the DB workloads from being fetched
+    failed = []
+
+    # Fetch and save metrics for Kubernetes pods, then for Kubernetes DB pods
+    for spec, names in [(data_dict, service_names), (db_data_dict, db_service_names)]:
+        try:
+            fetch_and_save_metrics(sdclient, store, spec["metrics"], spec["column_display_name"], names, start_ts, scope, deadline)
+        except FetchError as e:
+            failed += e.service_names
+
+    if failed:
+        raise FetchError(failed)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fetch the metrics of all workloads into the metrics store.")
+    parser.add_argument("--fetch-window", type=int, default=FETCH_WINDOW_S,
+                        help="Seconds of samples fetched, normally the adaptation interval of the driver (default: 300).")
+    return parser.parse_args()
 
-        # Get the current date and time
-        current_time = datetime.datetime.now()
+def main():
+    args = parse_args()
+    write_log("Script execution started")
+    telemetry.begin_cycle(component="monitor")
+
+    try:
+        sdclient = create_client()
+        metric_specs = load_metric_specs()
 
-        # Format the timestamp
-        timestamp = current_time.strftime("%Y-%m-%d %H:%M:%S")
+        run_monitor(sdclient, metric_specs, MetricsStore(), start_ts=-args.fetch_window)
 
-        # Open the log file in append mode and write the timestamp
-        with open(log_file, "a") as file:
-            file.write(f"Script execution ended at {timestamp}\n")
+        telemetry.end_cycle()
+        write_log("Script execution ended")
 
-    except ValueError:
-        print("Invalid input. Please enter a valid number of hours.")
+    except (RuntimeError, ValueError) as e:
+        print("Error")
+        print(e)
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+# Cost- and SLO-aware planning of all services under a shared namespace budget.
+#
+# Without the planner every service picks the cheapest configuration with the highest utility on its own.
+# With "enabled" set in configurations/planner.json, the analyzer instead assigns one configuration to every
+# service at once: the assignment whose total CPU and memory requests (request x pods) fit the budget, with
+# the fewest predicted SLO violations, then the lowest cost, then the highest total utility.
+#
+# The SLO of a service bounds its CPU quota used percent and its HTTP error count. Both are predicted for every
+# configuration from the current values: the CPU demand (quota used x CPU limit x pods) is divided by the CPU
+# limit of the configuration, and the error count is assumed to come from overload and scales with the same
+# ratio of CPU capacity. The cost of a configuration is its explicit "cost" if it has one, or its CPU cores and
+# GiB of memory requested, weighted by cpu_price and memory_price. The requests of the workloads the analyzer does
+# not manage ("unmanaged") are taken from the budget first.
+#
+# The assignment is solved exactly by a multiple-choice knapsack over the services: the partial assignments
+# are kept per total (CPU, memory), dropping those that use more of both resources for a worse objective.
+# The stabilization controller still decides when a service actually moves to its planned configuration, so a move
+# it would hold in this cycle is planned with the resources of the configuration the service keeps; the budget
+# then holds for the configurations that are really applied.
+#
+# Usage: python3 planner.py  (plans from the current windows without changing anything)
+
+import bisect
+import math
+import os
+from collections import namedtuple
+
+import config_cache
+from configuration_table import parse_cpu, parse_memory, resource_totals
+
+# Constants
+PLANNER_CONFIG_FILE = "../configurations/planner.json"
+CPU_METRIC = "Sysdig Container CPU Quota Used Percent"
+HTTP_ERROR_METRIC = "Sysdig Container Net HTTP Error Count"
+
+DEFAULT_PLANNER_CONFIG = {
+    "enabled": False,
+    "budget": {"cpu": None, "memory": None},
+    "cpu_price": 1.0,
+    "memory_price": 0.25,
+    "min_utility_fraction": 0.0,
+    "slo": {"max_cpu_quota_percent": 80, "max_http_errors": 5},
+    "services": {},
+    "unmanaged": {}
+}
+
+# One configuration a service can get: its resources, predicted SLO violations, cost and utility
+Option = namedtuple("Option", ["config_key", "cpu", "memory", "violations", "cost", "utility"])
+
+
+def build_planner_config(data):
+    config = dict(DEFAULT_PLANNER_CONFIG, **data)
+    config["budget"] = dict(DEFAULT_PLANNER_CONFIG["budget"], **config["budget"])
+    config["slo"] = dict(DEFAULT_PLANNER_CONFIG["slo"], **config["slo"])
+    # Fail on an invalid quantity when the file is loaded rather than in a cycle
+    budget_totals(config)
+    unmanaged_totals(config)
+    return config
+
+
+# The config is cached until the file changes and must not be modified
+def load_planner_config(path=PLANNER_CONFIG_FILE):
+    if not os.path.exists(path):
+        return DEFAULT_PLANNER_CONFIG
+    return config_cache.load_json(path, build_planner_config)
+
+
+# CPU (millicores) and memory (MiB) of the namespace budget; a resource without a budget is unlimited
+def budget_totals(planner_config):
+    budget = planner_config["budget"]
+    cpu = parse_cpu(budget["cpu"]) if budget["cpu"] is not None else float("inf")
+    memory = parse_memory(budget["memory"]) if budget["memory"] is not None else float("inf")
+    return cpu, memory
+
+
+# CPU (millicores) and memory (MiB) requested by the workloads of the namespace the analyzer does not manage
+# (e.g. acmeair-mainservice and the databases), each given by the total requests of all its pods
+def unmanaged_totals(planner_config):
+    workloads = planner_config["unmanaged"].values()
+    return sum(parse_cpu(workload["cpu"]) for workload in workloads), sum(parse_memory(workload["memory"]) for workload in workloads)
+
+
+def service_slo(planner_config, service):
+    return dict(planner_config["slo"], **planner_config["services"].get(service, {}))
+
+
+# Resources requested by a configuration running on `pods` pods (its own num_pods by default)
+def requested(config, pods=None):
+    if pods is None:
+        return resource_totals(config)
+    return resource_totals(dict(config, num_pods=pods))
+
+
+def config_cost(config, cpu, memory, planner_config):
+    if "cost" in config:
+        return float(config["cost"])
+    return cpu / 1000 * planner_config["cpu_price"] + memory / 1024 * planner_config["memory_price"]
+
+
+# Number of SLO bounds a configuration with cpu_capacity millicores of limits is predicted to break.
+# current_capacity is the CPU limit over all pods that served the measured values; missing values break nothing.
+def predict_violations(cpu_quota, http_errors, current_capacity, cpu_capacity, slo):
+    ratio = current_capacity / cpu_capacity
+    violations = 0
+    if not math.isnan(cpu_quota) and cpu_quota * ratio > slo["max_cpu_quota_percent"]:
+        violations += 1
+    if not math.isnan(http_errors) and http_errors * ratio > slo["max_http_errors"]:
+        violations += 1
+    return violations
+
+
+# Options of a service. allowed limits the configuration keys (e.g. no scale up while the database is saturated),
+# pods overrides the pods of every configuration when replica scaling sets them. applied maps a configuration key to
+# the configuration the service would actually run when it is planned (the stabilization controller may hold the move):
+# the option keeps the planned key and utility, but its resources, cost and SLO violations are those of the applied one.
+def service_options(utility_dict, configurations, current_config, current_pods, cpu_quota, http_errors, slo, planner_config, allowed=None, pods=None, applied=None):
+    current_capacity = parse_cpu(configurations[current_config]["cpu_limit"]) * current_pods
+    max_utility = max(utility_dict.values())
+    options = []
+    for config_key in (allowed if allowed is not None else configurations):
+        utility = utility_dict.get(config_key, 0.0)
+        if max_utility > 0 and utility < planner_config["min_utility_fraction"] * max_utility:
+            continue
+        config = configurations[applied.get(config_key, config_key) if applied else config_key]
+        config_pods = pods if pods is not None else config["num_pods"]
+        cpu, memory = requested(config, config_pods)
+        violations = predict_violations(cpu_quota, http_errors, current_capacity, parse_cpu(config["cpu_limit"]) * config_pods, slo)
+        options.append(Option(config_key, cpu, memory, violations, config_cost(config, cpu, memory, planner_config), utility))
+    return options
+
+
+def add_totals(totals, values):
+    return tuple(total + value for total, value in zip(totals, values))
+
+
+# Objective of a (partial) assignment, compared as a tuple: violations, then cost, then negated utility
+def objective(option):
+    return (option.violations, option.cost, -option.utility)
+
+
+# Objective of an assignment extended by option; the cost is rounded so that float noise does not hide a tie
+def extend(score, option):
+    violations, cost, negated_utility = objective(option)
+    return (score[0] + violations, round(score[1] + cost, 6), score[2] + negated_utility)
+
+
+# Drop the states that some other state beats on CPU, memory and objective at once.
+# states maps (cpu, memory) to (objective, assignment); the kept states form a staircase in (cpu, memory).
+def prune(states):
+    kept = {}
+    staircase_cpu = []
+    staircase_memory = []
+    for (cpu, memory), state in sorted(states.items(), key=lambda item: (item[1][0], item[0])):
+        # Every staircase point has an objective at least as good; it dominates if it also uses no more resources
+        below = bisect.bisect_right(staircase_cpu, cpu)
+        if below > 0 and staircase_memory[below - 1] <= memory:
+            continue
+        kept[(cpu, memory)] = state
+
+        # Insert the point and remove the points it dominates (at least as much CPU and memory)
+        position = bisect.bisect_left(staircase_cpu, cpu)
+        end = position
+        while end < len(staircase_cpu) and staircase_memory[end] >= memory:
+            end += 1
+        staircase_cpu[position:end] = [cpu]
+        staircase_memory[position:end] = [memory]
+    return kept
+
+
+# Assign one option to every service within the budget; reserved holds the CPU and memory used by services that are
+# not planned. Returns {service: Option}, or None when not even the cheapest options fit.
+def plan(options_by_service, budget_cpu, budget_memory, reserved=(0.0, 0.0)):
+    states = {reserved: ((0, 0.0, 0.0), {})}
+    for service, options in options_by_service.items():
+        next_states = {}
+        for (cpu, memory), (score, assignment) in states.items():
+            for option in options:
+                totals = (cpu + option.cpu, memory + option.memory)
+                if totals[0] > budget_cpu or totals[1] > budget_memory:
+                    continue
+                candidate = extend(score, option)
+                if totals not in next_states or candidate < next_states[totals][0]:
+                    next_states[totals] = (candidate, dict(assignment, **{service: option}))
+        if not next_states:
+            return None
+        states = prune(next_states)
+
+    _, (score, assignment) = min(states.items(), key=lambda item: item[1][0])
+    return assignment
+
+
+def describe_total(total, budget, unit):
+    if budget == float("inf"):
+        return f"{total:.0f}{unit}"
+    return f"{total:.0f}{unit} of {budget:.0f}{unit}"
+
+
+# One line summary of an assignment, e.g. "authservice C2, flightservice C3 (CPU 1000m of 4000m, ...)"
+def describe_plan(assignment, reserved, budget_cpu, budget_memory):
+    cpu = reserved[0] + sum(option.cpu for option in assignment.values())
+    memory = reserved[1] + sum(option.memory for option in assignment.values())
+    violations = sum(option.violations for option in assignment.values())
+    cost = sum(option.cost for option in assignment.values())
+    choices = ", ".join(f"{service} {option.config_key}" for service, option in assignment.items())
+    return (f"{choices} (CPU {describe_total(cpu, budget_cpu, 'm')}, memory {describe_total(memory, budget_memory, 'Mi')}, "
+            f"cost {cost:.2f}, {violations} predicted SLO violations)")
+
+
+def main():
+    import analyzer
+    from utility_model import evaluate_services
+    from window_engine import WindowEngine
+
+    planner_config = load_planner_config()
+    configurations = analyzer.load_configuration_states()
+    service_configs = {service: analyzer.load_service_config(service, configurations) for service in analyzer.SERVICES}
+    windows = WindowEngine(analyzer.WINDOW_SIZE)
+    windows.load()
+
+    metric_values = {service: windows.metric_values(service, service_config["utility_config"])
+                     for service, service_config in service_configs.items() if windows.has_data(service)}
+    if not metric_values:
+        print("No windows saved yet, run the analyzer first")
+        return
+    utilities = evaluate_services(analyzer.build_utility_stack(service_configs), metric_values)
+
+    assignment, reserved, budget = analyzer.plan_services(service_configs, configurations, windows, metric_values, utilities, {}, {}, planner_config)
+    if assignment is None:
+        print("The budget cannot hold the cheapest configurations of all services")
+        return
+    print(describe_plan(assignment, reserved, *budget))
+    for service, option in assignment.items():
+        print(f"{service}: {option.config_key}, CPU {option.cpu:.0f}m, memory {option.memory:.0f}Mi, cost {option.cost:.2f}, "
+              f"utility {option.utility:.3f}, {option.violations} predicted SLO violations")
+
+
+if __name__ == "__main__":
+    main()
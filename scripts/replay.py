@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+# Offline replay of recorded metric traces through the analyzer's decision logic.
+#
+# The traces (output/*_output.csv, or the metrics store) are cut into cycles of 30 samples (5 minutes).
+# Every cycle each policy averages the window, computes the utilities, picks a configuration and decides
+# whether to reconfigure; updates go to a simulated executor. The report shows decisions per second,
+# cycle latency and the number of reconfigurations per policy, without needing a cluster.
+#
+# Usage: python3 replay.py [--policies utility,one-cycle-wait] [--speedup 0] [--source csv|store] [--json report.json]
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import analyzer
+import forecast
+from configuration_table import order_by_cost, resource_totals, select_configuration
+from metrics_store import MetricsStore
+from utility_model import evaluate, value_vector
+
+# Constants
+OUTPUT_FOLDER = "../output"
+CYCLE_INTERVAL_S = 300
+
+
+# Traces and knowledge shared by all policies
+class ReplayContext:
+    def __init__(self, traces, configurations, service_configs):
+        self.traces = traces
+        self.configurations = configurations
+        self.service_configs = service_configs
+        self.services = list(traces)
+
+    def initial_state(self, service):
+        config_state = self.service_configs[service]["config_state"]
+        current_config = config_state.get("current_config", order_by_cost(self.configurations)[-1])
+        return {"current_config": current_config, "previous_config": current_config}
+
+
+# The analyzer's policy: highest utility, cheapest on ties, changes filtered by the stabilization controller.
+# The simulated time is the timestamp of the last sample in the window.
+class UtilityPolicy:
+    def __init__(self, context):
+        self.context = context
+        self.states = {service: context.initial_state(service) for service in context.services}
+
+    def utilities(self, service, window):
+        service_config = self.context.service_configs[service]
+        model = service_config["utility_model"]
+        averages = analyzer.calculate_averages(window, model.metric_names)
+        utilities = evaluate(model, value_vector(model.metric_names, averages))
+        return dict(zip(model.config_keys, utilities.tolist()))
+
+    def decide(self, service, window):
+        utility_dict = self.utilities(service, window)
+        latest_config = select_configuration(utility_dict, self.context.configurations)
+        settings = self.context.service_configs[service]["stabilization"]
+        now = float(window["Timestamp"].iloc[-1])
+        # Same state transition as the analyzer, which updates the state in place
+        to_update, _ = analyzer.handle_state_change(self.states[service], latest_config, utility_dict, self.context.configurations, settings, now)
+        return to_update, self.states[service]["current_config"]
+
+
+# The former rule: one cycle of waiting after every change
+class OneCycleWaitPolicy(UtilityPolicy):
+    def decide(self, service, window):
+        latest_config = select_configuration(self.utilities(service, window), self.context.configurations)
+        to_update, data = analyzer.decide_state_change(self.states[service], latest_config)
+        self.states[service].update(data)
+        return to_update, self.states[service]["current_config"]
+
+
+# Same utility decision, but applied immediately without the stabilization cycle
+class ImmediateUtilityPolicy(UtilityPolicy):
+    def decide(self, service, window):
+        latest_config = select_configuration(self.utilities(service, window), self.context.configurations)
+        state = self.states[service]
+        to_update = latest_config != state["current_config"]
+        state["previous_config"] = state["current_config"]
+        state["current_config"] = latest_config
+        return to_update, latest_config
+
+
+# Utility decision on the load forecast for the next interval (configurations/forecast.json, enabled or not)
+class PredictiveUtilityPolicy(UtilityPolicy):
+    def __init__(self, context):
+        super().__init__(context)
+        self.forecast_config = forecast.load_forecast_config()
+        self.history_samples = forecast.history_samples(self.forecast_config)
+
+    def utilities(self, service, window):
+        service_config = self.context.service_configs[service]
+        model = service_config["utility_model"]
+        averages = analyzer.calculate_averages(window, model.metric_names)
+
+        # The history is everything recorded up to the end of this window
+        trace = self.context.traces[service]
+        end = window.index[-1] + 1
+        history = trace.iloc[max(0, end - self.history_samples):end]
+        averages = forecast.forecast_metric_values(averages, history.to_numpy(dtype=float), list(trace.columns), self.forecast_config)
+
+        utilities = evaluate(model, value_vector(model.metric_names, averages))
+        return dict(zip(model.config_keys, utilities.tolist()))
+
+
+POLICIES = {
+    "utility": UtilityPolicy,
+    "one-cycle-wait": OneCycleWaitPolicy,
+    "utility-no-wait": ImmediateUtilityPolicy,
+    "predictive": PredictiveUtilityPolicy
+}
+
+
+# Records the deployment updates a policy would have made
+class SimulatedExecutor:
+    def __init__(self, delay_s=0.0):
+        self.delay_s = delay_s
+        self.updates = []
+
+    def submit(self, cycle, service, config_key):
+        if self.delay_s:
+            time.sleep(self.delay_s)
+        self.updates.append((cycle, service, config_key))
+
+
+# Recorded traces of the analyzed services as DataFrames, from the CSV files or the metrics store
+def load_traces(services, source="csv", output_folder=OUTPUT_FOLDER, store=None):
+    traces = {}
+    for service in services:
+        if source == "store":
+            store = store or MetricsStore()
+            columns = store.columns(service)
+            if columns is None:
+                continue
+            traces[service] = pd.DataFrame(store.read_all(service), columns=columns)
+        else:
+            csv_file_location = os.path.join(output_folder, service + "_output.csv")
+            if os.path.exists(csv_file_location):
+                traces[service] = pd.read_csv(csv_file_location)
+    return traces
+
+
+def replay(policy_class, context, cycle_samples=analyzer.WINDOW_SIZE, speedup=0, executor=None):
+    policy = policy_class(context)
+    executor = executor or SimulatedExecutor()
+    cycles = min(len(trace) for trace in context.traces.values()) // cycle_samples
+
+    latencies = []
+    cpu_requests = []
+    started = time.perf_counter()
+
+    for cycle in range(1, cycles + 1):
+        cycle_start = time.perf_counter()
+
+        cpu_total = 0.0
+        for service in context.services:
+            window = context.traces[service].iloc[(cycle - 1) * cycle_samples:cycle * cycle_samples]
+            to_update, config_key = policy.decide(service, window)
+            if to_update:
+                executor.submit(cycle, service, config_key)
+            cpu_total += resource_totals(context.configurations[config_key])[0]
+
+        latency = time.perf_counter() - cycle_start
+        latencies.append(latency)
+        cpu_requests.append(cpu_total)
+
+        # With a speedup factor, keep the real cycle spacing compressed by that factor
+        if speedup:
+            time.sleep(max(0.0, CYCLE_INTERVAL_S / speedup - latency))
+
+    elapsed = time.perf_counter() - started
+    decisions = cycles * len(context.services)
+    latencies_ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+
+    reconfigurations = {service: 0 for service in context.services}
+    for _, service, _ in executor.updates:
+        reconfigurations[service] += 1
+
+    return {
+        "cycles": cycles,
+        "decisions": decisions,
+        "decisions_per_second": decisions / elapsed if elapsed else 0.0,
+        "cycle_latency_ms": {
+            "mean": float(latencies_ms.mean()),
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p95": float(np.percentile(latencies_ms, 95)),
+            "max": float(latencies_ms.max())
+        },
+        "reconfigurations": sum(reconfigurations.values()),
+        "reconfigurations_per_service": reconfigurations,
+        "mean_cpu_request_millicores": float(np.mean(cpu_requests)) if cpu_requests else 0.0
+    }
+
+
+def print_report(name, report):
+    latency = report["cycle_latency_ms"]
+    print(f"\nPolicy: {name}")
+    print(f"  Cycles: {report['cycles']}, decisions: {report['decisions']}, decisions/s: {report['decisions_per_second']:.0f}")
+    print(f"  Cycle latency (ms): mean {latency['mean']:.3f}, p50 {latency['p50']:.3f}, p95 {latency['p95']:.3f}, max {latency['max']:.3f}")
+    print(f"  Reconfigurations: {report['reconfigurations']}")
+    for service, count in report["reconfigurations_per_service"].items():
+        print(f"    {service}: {count}")
+    print(f"  Mean total CPU request (millicores): {report['mean_cpu_request_millicores']:.0f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay recorded traces through the analyzer's decision logic.")
+    parser.add_argument("--policies", default=",".join(POLICIES), help=f"Comma separated policies (default: all of {', '.join(POLICIES)}).")
+    parser.add_argument("--speedup", type=float, default=0, help="Time compression factor; 0 replays as fast as possible (default: 0).")
+    parser.add_argument("--cycle-samples", type=int, default=analyzer.WINDOW_SIZE, help="Samples per cycle (default: 30).")
+    parser.add_argument("--source", choices=["csv", "store"], default="csv", help="Read traces from output/*.csv or from the metrics store (default: csv).")
+    parser.add_argument("--json", help="Also write the reports to this JSON file.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    configurations = analyzer.load_configuration_states()
+    service_configs = {service: analyzer.load_service_config(service, configurations) for service in analyzer.SERVICES}
+    traces = load_traces(analyzer.SERVICES, args.source)
+    context = ReplayContext(traces, configurations, service_configs)
+
+    reports = {}
+    for name in args.policies.split(","):
+        if name not in POLICIES:
+            raise SystemExit(f"Unknown policy '{name}', choose from {', '.join(POLICIES)}")
+        reports[name] = replay(POLICIES[name], context, args.cycle_samples, args.speedup)
+        print_report(name, reports[name])
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(reports, json_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
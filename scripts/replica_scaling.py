@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+# Replica count derived from throughput.
+#
+# With "enabled" set in configurations/replica_scaling.json, the configuration tiers only set the resources of
+# a pod; the number of pods is the request rate of the service divided by the capacity of one pod, clamped to
+# the service's min/max replicas. The capacity is learned from the metrics store: a least squares line of CPU
+# quota used percent against request count (both per pod) gives the request count at target_cpu_percent.
+# The CPU quota is relative to the pod limit of the configuration running at the time, so the capacity is an
+# estimate for the tier the service usually runs in.
+#
+# Usage: python3 replica_scaling.py  (prints the learned capacity of every service)
+
+import math
+import os
+
+import numpy as np
+
+import config_cache
+
+# Constants
+REPLICA_SCALING_FILE = "../configurations/replica_scaling.json"
+REQUEST_METRIC = "Sysdig Container Net HTTP Request Count"
+CPU_METRIC = "Sysdig Container CPU Quota Used Percent"
+
+DEFAULT_REPLICA_CONFIG = {
+    "enabled": False,
+    "target_cpu_percent": 70,
+    "history_s": 86400,
+    "min_samples": 60,
+    "services": {}
+}
+DEFAULT_BOUNDS = {"min_replicas": 1, "max_replicas": 2}
+
+
+# The config is cached until the file changes and must not be modified
+def load_replica_config(path=REPLICA_SCALING_FILE):
+    if not os.path.exists(path):
+        return DEFAULT_REPLICA_CONFIG
+    return config_cache.load_json(path, lambda data: dict(DEFAULT_REPLICA_CONFIG, **data))
+
+
+def bounds(replica_config, service):
+    return dict(DEFAULT_BOUNDS, **replica_config["services"].get(service, {}))
+
+
+# Requests per pod at the target CPU quota used percent, or None when the history does not show a positive relation
+def estimate_capacity(rows, columns, target_cpu_percent, min_samples):
+    if CPU_METRIC not in columns or REQUEST_METRIC not in columns or len(rows) == 0:
+        return None
+
+    requests = rows[:, columns.index(REQUEST_METRIC)]
+    cpu = rows[:, columns.index(CPU_METRIC)]
+    valid = ~(np.isnan(requests) | np.isnan(cpu))
+    requests = requests[valid]
+    cpu = cpu[valid]
+    if len(requests) < min_samples or np.ptp(requests) == 0:
+        return None
+
+    slope, intercept = np.polyfit(requests, cpu, 1)
+    if slope <= 0:
+        return None
+    capacity = (target_cpu_percent - intercept) / slope
+    return capacity if capacity > 0 else None
+
+
+# Learn the capacity of a service from the last history_s seconds in the store
+def learn_capacity(store, service, replica_config):
+    columns = store.columns(service)
+    if columns is None:
+        return None
+    rows, _ = store.read_history(service, replica_config["history_s"])
+    return estimate_capacity(rows, columns, replica_config["target_cpu_percent"], replica_config["min_samples"])
+
+
+# Pods needed for the total request rate; the request count metric is an average per pod
+def desired_replicas(requests_per_pod, current_replicas, capacity, service_bounds):
+    total_requests = requests_per_pod * current_replicas
+    replicas = math.ceil(total_requests / capacity) if total_requests > 0 else service_bounds["min_replicas"]
+    return int(min(max(replicas, service_bounds["min_replicas"]), service_bounds["max_replicas"]))
+
+
+# Scale out as soon as more pods are needed, scale in only after scale_down_cycles consecutive cycles needing fewer.
+# Returns (changed, new config state) without writing anything.
+def decide_replicas(config_state, desired, default_replicas, settings):
+    data = dict(config_state)
+    current = data.get("replicas", default_replicas)
+    data["replicas"] = current
+
+    if desired > current:
+        data["replicas"] = desired
+        data["replica_down_cycles"] = 0
+    elif desired < current:
+        data["replica_down_cycles"] = data.get("replica_down_cycles", 0) + 1
+        if data["replica_down_cycles"] >= settings["scale_down_cycles"]:
+            data["replicas"] = desired
+            data["replica_down_cycles"] = 0
+    else:
+        data["replica_down_cycles"] = 0
+
+    return data["replicas"] != current, data
+
+
+def main():
+    from analyzer import SERVICES
+    from metrics_store import MetricsStore
+
+    store = MetricsStore()
+    replica_config = load_replica_config()
+    print(f"Target CPU quota used: {replica_config['target_cpu_percent']}%")
+    for service in SERVICES:
+        capacity = learn_capacity(store, service, replica_config)
+        service_bounds = bounds(replica_config, service)
+        if capacity is None:
+            print(f"{service}: not enough history to learn the capacity")
+            continue
+        print(f"{service}: {capacity:.1f} requests per pod, replicas between {service_bounds['min_replicas']} and {service_bounds['max_replicas']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# Fixed-rate scheduler for the adaptation loop.
+#
+# Every job runs on a grid of monotonic deadlines (start, start + interval, ...), so a slow run does not shift
+# the following ones. The scheduler sleeps until the earliest deadline instead of polling every second.
+# A job that is picked up late runs once for the latest slot it missed; the slots that passed in between
+# are counted as skipped rather than run back to back. A run that ends after its next slot is an overrun.
+# Jobs run one at a time in the calling thread, so a fast path poll never overlaps with a cycle.
+
+import time
+
+
+class Job:
+    def __init__(self, name, interval_s, func, args, next_run):
+        self.name = name
+        self.interval_s = interval_s
+        self.func = func
+        self.args = args
+        self.next_run = next_run
+        self.runs = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.last_lag_s = 0.0
+        self.max_lag_s = 0.0
+        self.last_duration_s = 0.0
+        self.max_duration_s = 0.0
+
+    def to_dict(self):
+        return {
+            "interval_s": self.interval_s,
+            "runs": self.runs,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "last_lag_s": self.last_lag_s,
+            "max_lag_s": self.max_lag_s,
+            "last_duration_s": self.last_duration_s,
+            "max_duration_s": self.max_duration_s
+        }
+
+
+class LoopScheduler:
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.jobs = []
+
+    # Run func(*args) every interval_s seconds, the first time one interval from now (or right away with run_now)
+    def every(self, interval_s, name, func, *args, run_now=False):
+        now = self.clock()
+        job = Job(name, interval_s, func, args, now if run_now else now + interval_s)
+        self.jobs.append(job)
+        return job
+
+    # Run one job that is due; returns the job, or None when no job is due yet.
+    # An exception of the job is raised to the caller; the job stays on its grid.
+    def run_pending(self):
+        now = self.clock()
+        due = [job for job in self.jobs if job.next_run <= now]
+        if not due:
+            return None
+        job = min(due, key=lambda job: job.next_run)
+
+        # Latest slot that has passed; the earlier ones are skipped
+        missed = int((now - job.next_run) // job.interval_s)
+        slot = job.next_run + missed * job.interval_s
+        job.skipped += missed
+        job.last_lag_s = now - slot
+        job.max_lag_s = max(job.max_lag_s, job.last_lag_s)
+        job.next_run = slot + job.interval_s
+
+        job.runs += 1
+        try:
+            job.func(*job.args)
+        finally:
+            end = self.clock()
+            job.last_duration_s = end - now
+            job.max_duration_s = max(job.max_duration_s, job.last_duration_s)
+            if end > job.next_run:
+                job.overruns += 1
+        return job
+
+    # Seconds until the next job is due
+    def idle_seconds(self):
+        if not self.jobs:
+            return None
+        return max(0.0, min(job.next_run for job in self.jobs) - self.clock())
+
+    # Run the jobs forever; after_run(job) is called after every run, e.g. to write the loop health
+    def run_forever(self, after_run=None):
+        while True:
+            job = self.run_pending()
+            if job is None:
+                self.sleep(self.idle_seconds())
+            elif after_run is not None:
+                after_run(job)
+
+    def stats(self):
+        return {job.name: job.to_dict() for job in self.jobs}
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+# Sharded MAPE-K controller for many namespaces and clusters.
+#
+# The targets of configurations/targets.json (cluster, namespace, services) are partitioned over worker
+# processes. Every worker keeps one long-lived MapeLoop per target, each with its own metrics store,
+# windows, config states and oc login, and runs the cycles of its targets when the controller asks for one.
+# The controller collects the results and writes the timings of all targets as one cycle to
+# logs/cycle_timings.jsonl and logs/cycle_timings.prom. With enough workers the cycle takes as long as
+# the slowest target instead of the sum of all targets. The outcome of every target and the lag of the
+# cycles are written to logs/loop_health.prom (see loop_health.py).
+#
+# Usage: python3 sharded_controller.py [--targets ../configurations/targets.json] [--workers 4] [--interval 300] [--once]
+
+import argparse
+import datetime
+import multiprocessing
+import os
+import queue
+import time
+
+import telemetry
+import targets as target_config
+from loop_health import LoopHealth, write_health
+from scheduler import LoopScheduler
+
+# Constants
+LOGS_FOLDER = "../logs"
+DEFAULT_INTERVAL_S = 300
+
+# Path to the log file
+log_file = os.path.join(LOGS_FOLDER, "sharded_controller.log")
+
+
+def write_log(message):
+    # Get the current date and time
+    current_time = datetime.datetime.now()
+
+    # Format the timestamp
+    timestamp = current_time.strftime("%Y-%m-%d %H:%M:%S")
+
+    # Open the log file in append mode and write the timestamp
+    with open(log_file, "a") as file:
+        file.write(f"{message} at {timestamp}\n")
+
+
+# Worker process: one MapeLoop per target, a cycle of every target for each cycle number received.
+# Results are (cycle, target name, timings or None, loop health of the cycle or None, error or None).
+def shard_worker(shard_targets, loop_options, commands, results):
+    # Imported here so that the controller process does not need the monitoring client
+    from mape_loop import MapeLoop
+
+    loops = {}
+    for target in shard_targets:
+        try:
+            loops[target.name] = MapeLoop(target=target, write_timings=False, **loop_options)
+        except Exception as e:
+            results.put((0, target.name, None, None, f"Setup failed: {e}"))
+
+    while True:
+        cycle = commands.get()
+        if cycle is None:
+            break
+
+        for target in shard_targets:
+            if target.name not in loops:
+                results.put((cycle, target.name, None, None, "Not set up"))
+                continue
+            try:
+                loop = loops[target.name]
+                timer = loop.run_cycle()
+                results.put((cycle, target.name, timer.to_dict(), loop.health.last_cycle(), None))
+            except Exception as e:
+                results.put((cycle, target.name, None, None, str(e)))
+
+    for loop in loops.values():
+        loop.close()
+
+
+class ShardedController:
+    def __init__(self, targets, workers, loop_options, cycle_timeout_s):
+        self.targets = targets
+        self.shards = target_config.partition(targets, workers)
+        self.loop_options = loop_options
+        self.cycle_timeout_s = cycle_timeout_s
+        self.results = multiprocessing.Queue()
+        self.workers = []
+        self.cycle = 0
+
+    def start(self):
+        for shard in self.shards:
+            commands = multiprocessing.Queue()
+            process = multiprocessing.Process(target=shard_worker, args=(shard, self.loop_options, commands, self.results), daemon=True)
+            process.start()
+            self.workers.append((process, commands))
+            print(f"Worker {process.pid}: {', '.join(target.name for target in shard)}")
+
+    # Run one cycle of every target and wait for all results, at most cycle_timeout_s seconds
+    def run_cycle(self):
+        self.cycle += 1
+        started_at = time.time()
+        start = time.monotonic()
+
+        for _, commands in self.workers:
+            commands.put(self.cycle)
+
+        timings = {target.name: None for target in self.targets}
+        healths = {}
+        errors = {}
+        pending = set(timings)
+        while pending:
+            remaining = self.cycle_timeout_s - (time.monotonic() - start)
+            try:
+                cycle, name, target_timings, target_health, error = self.results.get(timeout=max(0.0, remaining))
+            except queue.Empty:
+                break
+
+            # Setup errors are reported with cycle 0, late results of earlier cycles are dropped
+            if error and cycle in (0, self.cycle):
+                errors[name] = error
+            if cycle != self.cycle:
+                continue
+            timings[name] = target_timings
+            if target_health is not None:
+                healths[name] = target_health
+            pending.discard(name)
+
+        for name in pending:
+            errors.setdefault(name, f"No result within {self.cycle_timeout_s}s")
+
+        duration_s = time.monotonic() - start
+        telemetry.write_sharded(self.cycle, started_at, duration_s, timings)
+        return duration_s, timings, healths, errors, pending
+
+    def stop(self):
+        for _, commands in self.workers:
+            commands.put(None)
+        for process, _ in self.workers:
+            process.join(timeout=30)
+
+
+def run_sharded_cycle(controller, health):
+    health.begin_cycle()
+    duration_s, timings, healths, errors, late = controller.run_cycle()
+    slowest = max((t["duration_s"] for t in timings.values() if t), default=0.0)
+
+    print(f"Cycle {controller.cycle}: {len(timings) - len(errors)}/{len(timings)} targets adapted in {duration_s:.2f}s (slowest target {slowest:.2f}s)")
+    write_log(f"Cycle {controller.cycle}: {len(timings) - len(errors)}/{len(timings)} targets adapted in {duration_s:.2f}s")
+    for name, error in errors.items():
+        print(f"Error in target {name}: {error}")
+        write_log(f"ERROR in target {name}: {error}")
+
+    # A failed target keeps its configurations until a later cycle; the other targets are not affected.
+    # The phases and degraded services of every target count in the health of the controller, and a target
+    # whose cycle completed but with a phase that failed or timed out is degraded too.
+    for name, target_timings in timings.items():
+        outcome = "timed_out" if name in late else "failed" if name in errors else "ok"
+        health.record_phase("target_cycle", outcome, target_timings["duration_s"] if target_timings else duration_s, controller.cycle_timeout_s)
+        failed_phases = health.merge_cycle(healths[name], name) if name in healths else {}
+        if name in errors:
+            health.record_degraded(name, errors[name])
+        elif failed_phases:
+            reason = ", ".join(f"{phase} {phase_outcome}" for phase, phase_outcome in failed_phases.items())
+            health.record_degraded(name, reason)
+            print(f"Target {name} degraded: {reason}")
+            write_log(f"Target {name} degraded: {reason}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the MAPE-K loop for many namespaces and clusters in worker processes.")
+    parser.add_argument("--targets", default=target_config.TARGETS_FILE, help="JSON file with the targets (default: ../configurations/targets.json).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes (default: number of CPUs, at most one per target).")
+    parser.add_argument("--interval", type=int, default=DEFAULT_INTERVAL_S, help="Adaptation interval in seconds (default: 300).")
+    parser.add_argument("--fetch-concurrency", type=int, default=1, help="Fetch up to this many workloads of a target in parallel (default: 1).")
+    parser.add_argument("--batched-fetch", action="store_true", help="Query groups of workloads with one request per metric spec.")
+    parser.add_argument("--once", action="store_true", help="Run a single cycle and exit.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    targets = target_config.load_targets(args.targets)
+    loop_options = {"fetch_window_s": args.interval, "fetch_concurrency": args.fetch_concurrency, "batched_fetch": args.batched_fetch}
+
+    # A cycle must finish before the next one is due
+    controller = ShardedController(targets, args.workers, loop_options, cycle_timeout_s=args.interval)
+    controller.start()
+    write_log(f"Controller started with {len(targets)} targets and {len(controller.workers)} workers")
+
+    health = LoopHealth()
+    try:
+        if args.once:
+            run_sharded_cycle(controller, health)
+            write_health(health)
+            return
+
+        # Cycles start on a fixed grid of monotonic deadlines; a cycle that overruns skips the slots it missed
+        scheduler = LoopScheduler()
+        scheduler.every(args.interval, "cycle", run_sharded_cycle, controller, health)
+        scheduler.run_forever(lambda job: write_health(health, scheduler))
+    finally:
+        controller.stop()
+        write_log("Controller stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+# Per-service stabilization of configuration changes.
+#
+# The analyzer picks the best configuration every cycle; the controller decides whether to actually move
+# there. Scaling up (to a more expensive configuration) happens after scale_up_cycles cycles and only when
+# it gains at least utility_margin utility; scaling down happens only after scale_down_cycles consecutive
+# cycles that asked for a cheaper configuration. No change is made within min_dwell_s seconds of the
+# previous one. The counters, the time of the last change and the last history_size decisions are kept
+# in the service's config_state.json. A current configuration that was removed from configration_states.json
+# cannot be held, so the service moves to the latest configuration right away.
+#
+# The settings are read from configurations/<service>/stabilization.json; missing keys use the defaults below.
+
+import os
+
+import config_cache
+
+# Constants
+CONFIGURATIONS_FOLDER = "../configurations"
+
+DEFAULT_SETTINGS = {
+    "scale_up_cycles": 1,
+    "scale_down_cycles": 3,
+    "min_dwell_s": 240,
+    "utility_margin": 0.05,
+    "history_size": 20
+}
+
+
+# The settings are cached until the file changes and must not be modified
+def load_settings(service, configurations_folder=CONFIGURATIONS_FOLDER):
+    settings_path = os.path.join(configurations_folder, service, "stabilization.json")
+    if not os.path.exists(settings_path):
+        return DEFAULT_SETTINGS
+    return config_cache.load_json(settings_path, lambda data: dict(DEFAULT_SETTINGS, **data))
+
+
+# Decide whether to move from the current configuration to latest_config.
+# ranking lists the configuration keys from cheapest to most expensive.
+# Returns (to_update, new config state, action) without writing anything.
+def decide(config_state, latest_config, utility_dict, ranking, settings, now):
+    current_config = config_state.get("current_config", latest_config)
+
+    # Other keys of the state (e.g. the replica count) are carried over unchanged
+    data = dict(config_state)
+    data.update({
+        "current_config": current_config,
+        "previous_config": config_state.get("previous_config", current_config),
+        "changed_at": config_state.get("changed_at", 0),
+        "up_cycles": config_state.get("up_cycles", 0),
+        "down_cycles": config_state.get("down_cycles", 0),
+        "history": list(config_state.get("history", []))
+    })
+    dwelling = now - data["changed_at"] < settings["min_dwell_s"]
+    to_update = False
+
+    if latest_config == current_config:
+        data["up_cycles"] = 0
+        data["down_cycles"] = 0
+        action = "hold"
+
+    elif current_config not in ranking:
+        to_update = True
+        action = f"move: {current_config} is no longer configured"
+
+    elif ranking.index(latest_config) > ranking.index(current_config):
+        data["up_cycles"] += 1
+        data["down_cycles"] = 0
+        gain = utility_dict[latest_config] - utility_dict.get(current_config, 0.0)
+        if gain < settings["utility_margin"]:
+            action = f"hold: utility gain {gain:.3f} below margin"
+        elif data["up_cycles"] < settings["scale_up_cycles"]:
+            action = f"wait: scale up {data['up_cycles']}/{settings['scale_up_cycles']}"
+        elif dwelling:
+            action = "wait: dwell time"
+        else:
+            to_update = True
+            action = "scale up"
+
+    else:
+        data["down_cycles"] += 1
+        data["up_cycles"] = 0
+        if data["down_cycles"] < settings["scale_down_cycles"]:
+            action = f"wait: scale down {data['down_cycles']}/{settings['scale_down_cycles']}"
+        elif dwelling:
+            action = "wait: dwell time"
+        else:
+            to_update = True
+            action = "scale down"
+
+    if to_update:
+        data["previous_config"] = current_config
+        data["current_config"] = latest_config
+        data["changed_at"] = now
+        data["up_cycles"] = 0
+        data["down_cycles"] = 0
+
+    # Bounded decision history, newest last
+    data["history"].append({"time": now, "latest_config": latest_config, "current_config": data["current_config"], "action": action})
+    data["history"] = data["history"][-settings["history_size"]:] if settings["history_size"] > 0 else []
+
+    return to_update, data, action
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+# Crash-safe journal of the config states.
+#
+# The config states of the services of a target are kept in a small SQLite database (state/state.db, or
+# state.db in the state folder of a target of the sharded controller). The decisions of a cycle are staged
+# in memory and written in one transaction, so after a crash the database holds the states of the last
+# complete cycle and never a mix of two cycles. Every decision is also appended to the decisions table.
+# The analyzer commits once the deployment updates of the cycle are done, after restoring the states of the
+# services whose update failed, so the journal only holds configurations that were applied.
+#
+# The config_state.json files remain as a readable copy: they are rewritten atomically (temporary file and
+# rename) after each commit. On start, the states in the database take precedence over the files, and files
+# of services that are not in the database yet are imported.
+#
+# Usage: python3 state_journal.py [--journal ../state/state.db] [--decisions 20]
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from window_engine import STATE_FOLDER
+
+# Constants
+JOURNAL_FILE = os.path.join(STATE_FOLDER, "state.db")
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS config_state (service TEXT PRIMARY KEY, state TEXT NOT NULL, cycle INTEGER NOT NULL, updated_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS decisions (cycle INTEGER NOT NULL, service TEXT NOT NULL, best TEXT, action TEXT, updated INTEGER NOT NULL, "
+    "state TEXT NOT NULL, decided_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS decisions_cycle ON decisions (cycle)"
+]
+
+
+# Write a config_state.json so that a crash leaves either the old or the new file, never a partial one
+def write_state_file(path, state):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as json_file:
+        json.dump(state, json_file, indent=4)
+        json_file.flush()
+        os.fsync(json_file.fileno())
+    os.replace(temp_path, path)
+
+
+class StateJournal:
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        # The loop may be created in another thread than the scheduler thread that runs its cycles
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=FULL")
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+        self.lock = threading.Lock()
+        self.states = {}
+        self.decisions = []
+        self.cycle = self.connection.execute("SELECT COALESCE(MAX(cycle), 0) FROM decisions").fetchone()[0]
+
+    # Restore the last committed states into the loaded service configs, and import the config_state.json
+    # of services the database does not know yet. Returns the services whose state was restored from the database.
+    def recover(self, service_configs):
+        stored = {service: json.loads(state) for service, state in self.connection.execute("SELECT service, state FROM config_state")}
+
+        restored = []
+        imported = []
+        for service, service_config in service_configs.items():
+            if service not in stored:
+                if service_config["config_state"]:
+                    imported.append((service, json.dumps(service_config["config_state"]), self.cycle, time.time()))
+                continue
+
+            # The file is behind the database when the process stopped between the commit and the file update
+            if stored[service] != service_config["config_state"]:
+                service_config["config_state"].clear()
+                service_config["config_state"].update(stored[service])
+                write_state_file(service_config["config_state_path"], stored[service])
+                restored.append(service)
+
+        if imported:
+            with self.lock, self.connection:
+                self.connection.executemany("INSERT INTO config_state VALUES (?, ?, ?, ?)", imported)
+        return restored
+
+    # Stage the new state of a service and the decision that led to it; written by the next commit()
+    def stage(self, service, state, path, best=None, action=None, updated=False):
+        with self.lock:
+            self.states[service] = (dict(state), path)
+            self.decisions.append((service, best, action, int(updated), json.dumps(state), time.time()))
+
+    # Write all staged states and decisions in one transaction, then update the config_state.json files.
+    # Returns the number of services written.
+    def commit(self):
+        with self.lock:
+            if not self.states:
+                return 0
+
+            cycle = self.cycle + 1
+            now = time.time()
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT INTO decisions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(cycle,) + decision for decision in self.decisions])
+                self.connection.executemany(
+                    "INSERT INTO config_state VALUES (?, ?, ?, ?) ON CONFLICT(service) DO UPDATE SET state = excluded.state, "
+                    "cycle = excluded.cycle, updated_at = excluded.updated_at",
+                    [(service, json.dumps(state), cycle, now) for service, (state, _) in self.states.items()])
+            self.cycle = cycle
+
+            for state, path in self.states.values():
+                write_state_file(path, state)
+
+            written = len(self.states)
+            self.states = {}
+            self.decisions = []
+            return written
+
+    # Last decisions, newest first, as (cycle, service, best, action, updated, decided_at)
+    def recent_decisions(self, limit):
+        return self.connection.execute(
+            "SELECT cycle, service, best, action, updated, decided_at FROM decisions ORDER BY cycle DESC, rowid DESC LIMIT ?", (limit,)).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the config states and last decisions kept in the state journal.")
+    parser.add_argument("--journal", default=JOURNAL_FILE, help="Path of the journal database (default: ../state/state.db).")
+    parser.add_argument("--decisions", type=int, default=20, help="Number of decisions to show (default: 20).")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.journal):
+        print(f"File '{args.journal}' not found.")
+        return
+
+    journal = StateJournal(args.journal)
+    for service, state, cycle in journal.connection.execute("SELECT service, state, cycle FROM config_state ORDER BY service"):
+        state = json.loads(state)
+        print(f"{service}: {state.get('current_config')} (previous {state.get('previous_config')}), cycle {cycle}")
+
+    print("\nLast decisions:")
+    for cycle, service, best, action, updated, decided_at in journal.recent_decisions(args.decisions):
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(decided_at))
+        print(f"  {timestamp} cycle {cycle} {service}: best {best}, {action}{' (updated)' if updated else ''}")
+    journal.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+import random
+import re
+import threading
+import time
+
+
+# Offline stand-in for SdMonitorClient.
+# get_data has the same signature and response shape as the real client, sleeps for a configurable
+# latency to simulate the network round trip, and returns random values for the requested metrics.
+# Like the real API, a metric without aggregations (e.g. kubernetes.workload.name) is a group-by key:
+# one row per workload and timestamp is returned, starting with the workload name.
+class StubMonitorClient:
+    def __init__(self, latency_s=0.2, jitter_s=0.0, failure_rate=0.0, seed=None):
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def get_data(self, metrics, start_ts, end_ts=0, sampling_s=0, filter="", datasource_type="host", paging=None):
+        with self.lock:
+            self.calls += 1
+            delay = self.latency_s + self.random.uniform(0, self.jitter_s)
+            failed = self.random.random() < self.failure_rate
+
+        time.sleep(delay)
+
+        if failed:
+            return False, "Stub monitoring API error"
+
+        # Relative timestamps count backward from now, like the real API
+        now = int(time.time())
+        start = now + start_ts if start_ts <= 0 else start_ts
+        end = now + end_ts if end_ts <= 0 else end_ts
+        step = sampling_s or 10
+
+        grouped = bool(metrics) and "aggregations" not in metrics[0]
+        values_per_row = len(metrics) - 1 if grouped else len(metrics)
+        groups = workloads_from_filter(filter) if grouped else [None]
+
+        rows = []
+        for timestamp in range(start - start % step + step, end + 1, step):
+            for group in groups:
+                values = [round(self.random.uniform(0, 100), 3) for _ in range(values_per_row)]
+                rows.append({"t": timestamp, "d": values if group is None else [group] + values})
+
+        return True, {"data": rows, "start": start, "end": end}
+
+
+
+# Extract the workload names selected by a filter built by monitor.build_filter or monitor.build_batch_filter
+def workloads_from_filter(filter):
+    match = re.search(r"kubernetes\.workload\.name in \(([^)]*)\)", filter)
+    if match:
+        return re.findall(r"'([^']*)'", match.group(1))
+
+    match = re.search(r"kubernetes\.workload\.name='([^']*)'", filter)
+    return [match.group(1)] if match else []
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# Adaptation targets: a set of services in one namespace of one cluster.
+#
+# The single-namespace scripts use the default target built from the module settings, which keeps the
+# metrics store, the windows and the config states in their usual places. The targets of the sharded
+# controller are read from configurations/targets.json and keep their store in store/targets/<name> and
+# their windows, config states, state journal and kubeconfig in state/targets/<name>, so targets never share state.
+#
+# A target may set "oc_server" and "oc_token_env" (the name of the environment variable holding its token);
+# otherwise OC_SERVER and OC_TOKEN are used.
+
+import json
+import os
+
+import monitor
+import analyzer
+import executor
+from window_engine import STATE_FOLDER, WINDOW_STATE_FILE
+from state_journal import JOURNAL_FILE
+from metrics_store import STORE_FOLDER
+
+# Constants
+TARGETS_FILE = "../configurations/targets.json"
+
+
+class Target:
+    def __init__(self, name, cluster, namespace, services, monitor_only=(), databases=(), oc_server=None, oc_token_env=None,
+                 store_folder=None, state_folder=None):
+        self.name = name
+        self.cluster = cluster
+        self.namespace = namespace
+        self.services = list(services)
+        self.monitor_only = list(monitor_only)
+        self.databases = list(databases)
+        self.oc_server = oc_server or executor.OC_SERVER
+        self.oc_token_env = oc_token_env
+        self.store_folder = store_folder or os.path.join(STORE_FOLDER, "targets", name)
+        self.state_folder = state_folder
+
+    @property
+    def scope(self):
+        return (self.cluster, self.namespace)
+
+    # App workloads whose metrics are fetched: the analyzed services and the monitored-only ones
+    @property
+    def monitored_services(self):
+        return self.services + self.monitor_only
+
+    @property
+    def window_state_path(self):
+        return os.path.join(self.state_folder, "windows.json") if self.state_folder else WINDOW_STATE_FILE
+
+    @property
+    def journal_path(self):
+        return os.path.join(self.state_folder, "state.db") if self.state_folder else JOURNAL_FILE
+
+    @property
+    def kubeconfig(self):
+        return os.path.join(self.state_folder, "kubeconfig") if self.state_folder else None
+
+    def token(self):
+        return os.environ.get(self.oc_token_env, "") if self.oc_token_env else executor.OC_TOKEN
+
+
+# The namespace configured in monitor.py and analyzer.py, with the usual store and state locations
+def default_target():
+    return Target(monitor.kube_namespace, monitor.kube_cluster_name, monitor.kube_namespace, analyzer.SERVICES,
+                  monitor_only=[service for service in monitor.SERVICE_NAMES if service not in analyzer.SERVICES],
+                  databases=monitor.DB_SERVICE_NAMES, store_folder=STORE_FOLDER)
+
+
+def load_targets(path=TARGETS_FILE):
+    with open(path, "r") as json_file:
+        entries = json.load(json_file)
+
+    targets = []
+    for entry in entries:
+        targets.append(Target(entry["name"], entry["cluster"], entry["namespace"], entry["services"],
+                              monitor_only=entry.get("monitor_only", []), databases=entry.get("databases", []),
+                              oc_server=entry.get("oc_server"), oc_token_env=entry.get("oc_token_env"),
+                              state_folder=os.path.join(STATE_FOLDER, "targets", entry["name"])))
+
+    names = [target.name for target in targets]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Target names must be unique: {names}")
+    return targets
+
+
+# Split the targets over at most `workers` groups, round robin
+def partition(targets, workers):
+    workers = max(1, min(workers, len(targets)))
+    return [targets[i::workers] for i in range(workers)]
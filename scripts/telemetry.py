@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+# Per-phase timings of the adaptation cycle.
+#
+# A cycle is started with begin_cycle(); code anywhere in the loop (including worker threads) then
+# times its work with `with telemetry.phase("fetch", service=...)`. end_cycle() appends the timings as
+# one JSON line to logs/cycle_timings.jsonl and rewrites logs/cycle_timings.prom in the Prometheus text
+# exposition format. Outside a cycle phase() does nothing, so instrumented code also runs untimed.
+# The monitor and analyzer scripts, which the driver runs as separate processes by default, each write their own
+# file (logs/cycle_timings_monitor.prom, logs/cycle_timings_analyzer.prom) so that neither replaces the other's timings.
+
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Constants
+LOGS_FOLDER = "../logs"
+TIMINGS_JSONL_FILE = os.path.join(LOGS_FOLDER, "cycle_timings.jsonl")
+TIMINGS_PROMETHEUS_FILE = os.path.join(LOGS_FOLDER, "cycle_timings.prom")
+
+active_timer = None
+
+
+class CycleTimer:
+    def __init__(self, cycle, component):
+        self.cycle = cycle
+        self.component = component
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration_s = None
+        self.timings = []
+        self.lock = threading.Lock()
+
+    def record(self, name, duration_s, **labels):
+        with self.lock:
+            self.timings.append({"phase": name, "labels": labels, "duration_s": duration_s})
+
+    def finish(self):
+        self.duration_s = time.perf_counter() - self.started
+
+    def to_dict(self):
+        return {
+            "cycle": self.cycle,
+            "component": self.component,
+            "timestamp": self.started_at,
+            "duration_s": self.duration_s,
+            "phases": self.timings
+        }
+
+
+def begin_cycle(cycle=0, component="loop"):
+    global active_timer
+    active_timer = CycleTimer(cycle, component)
+    return active_timer
+
+
+# Prometheus file of a component: the given path for the whole loop, e.g. cycle_timings_monitor.prom for the monitor script
+def component_path(path, component):
+    if component == "loop":
+        return path
+    base, extension = os.path.splitext(path)
+    return f"{base}_{component}{extension}"
+
+
+# Finish the active cycle and write its timings (a path of None skips that output, e.g. in a shard worker)
+def end_cycle(jsonl_path=TIMINGS_JSONL_FILE, prometheus_path=TIMINGS_PROMETHEUS_FILE):
+    global active_timer
+    timer = active_timer
+    active_timer = None
+    if timer is None:
+        return None
+
+    timer.finish()
+    if jsonl_path:
+        write_jsonl(timer, jsonl_path)
+    if prometheus_path:
+        write_prometheus(timer, component_path(prometheus_path, timer.component))
+    return timer
+
+
+@contextmanager
+def phase(name, **labels):
+    timer = active_timer
+    if timer is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.record(name, time.perf_counter() - start, **labels)
+
+
+# Record a duration measured elsewhere (e.g. reported by a subprocess)
+def record(name, duration_s, **labels):
+    if active_timer is not None:
+        active_timer.record(name, duration_s, **labels)
+
+
+def write_jsonl(timer, path=TIMINGS_JSONL_FILE):
+    with open(path, "a") as file:
+        file.write(json.dumps(timer.to_dict()) + "\n")
+
+
+def format_labels(labels):
+    return ",".join(f'{key}="{str(value)}"' for key, value in sorted(labels.items()))
+
+
+# Prometheus text exposition of the last cycle; a phase that ran several times with the same labels is summed
+def write_prometheus(timer, path=TIMINGS_PROMETHEUS_FILE):
+    totals = {}
+    for timing in timer.timings:
+        labels = dict(timing["labels"], phase=timing["phase"], component=timer.component)
+        key = format_labels(labels)
+        totals[key] = totals.get(key, 0.0) + timing["duration_s"]
+
+    lines = [
+        "# HELP mape_phase_duration_seconds Duration of each phase in the last adaptation cycle.",
+        "# TYPE mape_phase_duration_seconds gauge"
+    ]
+    lines += [f"mape_phase_duration_seconds{{{key}}} {value:.6f}" for key, value in sorted(totals.items())]
+    lines += [
+        "# HELP mape_cycle_duration_seconds Duration of the last adaptation cycle.",
+        "# TYPE mape_cycle_duration_seconds gauge",
+        f'mape_cycle_duration_seconds{{component="{timer.component}"}} {timer.duration_s:.6f}',
+        "# HELP mape_cycle_number Number of the last adaptation cycle.",
+        "# TYPE mape_cycle_number gauge",
+        f'mape_cycle_number{{component="{timer.component}"}} {timer.cycle}',
+        "# HELP mape_cycle_timestamp_seconds Start time of the last adaptation cycle.",
+        "# TYPE mape_cycle_timestamp_seconds gauge",
+        f'mape_cycle_timestamp_seconds{{component="{timer.component}"}} {timer.started_at:.3f}'
+    ]
+
+    write_atomically(path, lines)
+
+
+# Written to a temporary file first so a scraper never sees a half-written file
+def write_atomically(path, lines):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as file:
+        file.write("\n".join(lines) + "\n")
+    os.replace(temp_path, path)
+
+
+# Timings of one cycle of the sharded controller: the wall time of the whole cycle and the timings
+# returned by every target (None for a target that failed or did not answer in time)
+def write_sharded(cycle, started_at, duration_s, target_timings, jsonl_path=TIMINGS_JSONL_FILE, prometheus_path=TIMINGS_PROMETHEUS_FILE):
+    with open(jsonl_path, "a") as file:
+        file.write(json.dumps({
+            "cycle": cycle,
+            "component": "sharded",
+            "timestamp": started_at,
+            "duration_s": duration_s,
+            "targets": target_timings
+        }) + "\n")
+
+    totals = {}
+    for target, timings in target_timings.items():
+        for timing in (timings or {}).get("phases", []):
+            key = format_labels(dict(timing["labels"], phase=timing["phase"], target=target))
+            totals[key] = totals.get(key, 0.0) + timing["duration_s"]
+
+    lines = [
+        "# HELP mape_phase_duration_seconds Duration of each phase in the last adaptation cycle.",
+        "# TYPE mape_phase_duration_seconds gauge"
+    ]
+    lines += [f"mape_phase_duration_seconds{{{key}}} {value:.6f}" for key, value in sorted(totals.items())]
+    lines += [
+        "# HELP mape_target_cycle_duration_seconds Duration of the last adaptation cycle of each target.",
+        "# TYPE mape_target_cycle_duration_seconds gauge"
+    ]
+    lines += [f'mape_target_cycle_duration_seconds{{target="{target}"}} {timings["duration_s"]:.6f}' for target, timings in sorted(target_timings.items()) if timings]
+    lines += [
+        "# HELP mape_target_failed Whether the last adaptation cycle of each target failed.",
+        "# TYPE mape_target_failed gauge"
+    ]
+    lines += [f'mape_target_failed{{target="{target}"}} {0 if timings else 1}' for target, timings in sorted(target_timings.items())]
+    lines += [
+        "# HELP mape_cycle_duration_seconds Duration of the last adaptation cycle.",
+        "# TYPE mape_cycle_duration_seconds gauge",
+        f'mape_cycle_duration_seconds{{component="sharded"}} {duration_s:.6f}',
+        "# HELP mape_cycle_number Number of the last adaptation cycle.",
+        "# TYPE mape_cycle_number gauge",
+        f'mape_cycle_number{{component="sharded"}} {cycle}',
+        "# HELP mape_cycle_timestamp_seconds Start time of the last adaptation cycle.",
+        "# TYPE mape_cycle_timestamp_seconds gauge",
+        f'mape_cycle_timestamp_seconds{{component="sharded"}} {started_at:.3f}'
+    ]
+    write_atomically(prometheus_path, lines)
+
+
+# Run func under a profiler and save the profile. With profiler="pyinstrument" (if installed) an HTML report
+# is written, otherwise cProfile stats readable with `python3 -m pstats <file>`.
+def profile_call(func, output_prefix, profiler="cprofile"):
+    if profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument is not installed, falling back to cProfile.")
+        else:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                return func()
+            finally:
+                profiler.stop()
+                with open(output_prefix + ".html", "w") as file:
+                    file.write(profiler.output_html())
+                print(f"Profile saved to {output_prefix}.html")
+
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func)
+    finally:
+        profile.dump_stats(output_prefix + ".prof")
+        print(f"Profile saved to {output_prefix}.prof")
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+
+# Offline tuning of the utility thresholds, weights and (optionally) preferences against the recorded traces.
+#
+# Every candidate parameter set is replayed over the cycles of a service's trace (30 samples each): the
+# utilities are computed on the window of a cycle, the cheapest configuration with the highest utility is
+# chosen, and that configuration serves the next cycle. A candidate is scored with a simple cost/SLO model
+# (settings in configurations/tuning.json):
+#   cost            mean CPU and memory request of the chosen configurations, relative to the most expensive one
+#   SLO violations  share of cycles whose CPU demand (p95 of the window) is above target_cpu_percent of the
+#                   CPU limit of the configuration serving it. The demand is the CPU quota used percent of the
+#                   trace times the CPU limit of the configuration the trace was recorded with (trace_config).
+#   reconfigurations  share of cycles that change the configuration
+# objective = cost_weight * cost + slo_weight * violations + reconfiguration_weight * reconfigurations.
+#
+# The search is a random search in rounds: thresholds are drawn as quantiles of the recorded values, weights
+# from a Dirichlet distribution, and each round samples closer around the best candidate so far. The current
+# utility config is always a candidate, so the tuned config never scores worse on the training cycles.
+# Candidates are evaluated as arrays (one tensor contraction for a whole chunk) in parallel worker processes.
+# The first train_fraction of the cycles is used for the search, the rest to check the result.
+# The stabilization controller is not simulated; replay.py shows the tuned files with it.
+# With --source rollup the cycles are the 5 minute buckets of the metrics store rollups (see metrics_store.py), so
+# weeks of history are tuned on without reading the raw samples; percentiles are then approximated by the bucket maximum.
+#
+# Usage: python3 tune_utility.py [--services acmeair-authservice] [--candidates 4000] [--preferences] [--workers 4] [--apply]
+#        python3 tune_utility.py --source rollup --days 28
+
+import argparse
+import copy
+import json
+import math
+import os
+import shutil
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import analyzer
+import config_cache
+import telemetry
+from configuration_table import UTILITY_TOLERANCE, order_by_cost, parse_cpu, resource_totals
+from metrics_store import MetricsStore, rollup_statistic
+from replay import load_traces
+from utility_model import BANDS, compile_utility_model
+
+# Constants
+TUNING_CONFIG_FILE = "../configurations/tuning.json"
+CPU_METRIC = "Sysdig Container CPU Quota Used Percent"
+DEMAND_PERCENTILE = 95
+INITIAL_SPREAD = 0.3
+
+DEFAULT_TUNING_CONFIG = {
+    "trace_config": "C4",
+    "trace_configs": {},
+    "target_cpu_percent": 80,
+    "cost_weight": 1.0,
+    "slo_weight": 4.0,
+    "reconfiguration_weight": 0.05,
+    "train_fraction": 0.7,
+    "candidates": 4000,
+    "rounds": 3,
+    "seed": 1
+}
+
+
+def load_tuning_config(path=TUNING_CONFIG_FILE):
+    if not os.path.exists(path):
+        return DEFAULT_TUNING_CONFIG
+    return config_cache.load_json(path, lambda data: dict(DEFAULT_TUNING_CONFIG, **data))
+
+
+# Statistic of every window (rows of `windows`), as the analyzer's window engine computes it; ewma is approximated by the mean
+def window_statistic(windows, statistic):
+    with warnings.catch_warnings():
+        # Windows without any sample give NaN, which falls into the lowest band like in the analyzer
+        warnings.simplefilter("ignore", RuntimeWarning)
+        if statistic in ("min", "max"):
+            return getattr(np, "nan" + statistic)(windows, axis=1)
+        if statistic in ("p95", "p99"):
+            return np.nanpercentile(windows, int(statistic[1:]), axis=1)
+        if statistic == "count":
+            return np.sum(~np.isnan(windows), axis=1).astype(float)
+        return np.nanmean(windows, axis=1)
+
+
+# Per cycle: the metric values the analyzer would see, shape (cycles, metrics), and the CPU demand in millicores
+def cycle_features(trace, utility_config, trace_capacity_m, cycle_samples=analyzer.WINDOW_SIZE):
+    cycles = len(trace) // cycle_samples
+
+    def windows(column):
+        return trace[column].to_numpy(dtype=float)[:cycles * cycle_samples].reshape(cycles, cycle_samples)
+
+    values = np.full((cycles, len(utility_config)), np.nan)
+    for m, item in enumerate(utility_config):
+        if item["name"] in trace.columns:
+            values[:, m] = window_statistic(windows(item["name"]), item.get("statistic", "mean"))
+
+    demand = np.full(cycles, np.nan)
+    if CPU_METRIC in trace.columns:
+        demand = window_statistic(windows(CPU_METRIC), f"p{DEMAND_PERCENTILE}") / 100 * trace_capacity_m
+    return values, demand
+
+
+# Bucket statistic standing for a window statistic of the analyzer
+ROLLUP_STATISTIC = {"mean": "avg", "ewma": "avg", "min": "min", "max": "max", "p95": "max", "p99": "max", "count": "count"}
+
+
+# The same features from the 5 minute rollups of the last horizon_s seconds in the metrics store, one cycle per bucket
+def rollup_features(store, service, utility_config, trace_capacity_m, horizon_s):
+    columns = store.columns(service)
+    rows = store.rollup_rows(service, "5m", store.last_timestamp(service) - horizon_s)
+
+    values = np.full((len(rows), len(utility_config)), np.nan)
+    for m, item in enumerate(utility_config):
+        if item["name"] in columns:
+            values[:, m] = rollup_statistic(rows, ROLLUP_STATISTIC.get(item.get("statistic", "mean"), "avg"))[:, columns.index(item["name"])]
+
+    demand = np.full(len(rows), np.nan)
+    if CPU_METRIC in columns:
+        demand = rollup_statistic(rows, "max")[:, columns.index(CPU_METRIC)] / 100 * trace_capacity_m
+    return values, demand
+
+
+# CPU limit of all pods of a configuration, in millicores
+def cpu_capacity(config):
+    return parse_cpu(config["cpu_limit"]) * config["num_pods"]
+
+
+# Cost of every configuration (ordered by cost): mean of its CPU and memory requests relative to the largest ones
+def request_costs(configurations, config_keys):
+    totals = np.array([resource_totals(configurations[key]) for key in config_keys])
+    return (totals / totals.max(axis=0)).mean(axis=1)
+
+
+# Index of the configuration chosen every cycle by every candidate, shape (candidates, cycles).
+# The configuration axis is ordered by cost, so the first configuration within the tolerance of the best is the cheapest.
+def choose(thresholds, weights, preferences, values):
+    bands = (values[None, :, :, None] > thresholds[:, None, :, :]).sum(axis=-1)
+    one_hot = (bands[..., None] == np.arange(len(BANDS))).astype(float)
+    utilities = np.einsum("cnmb,cmbk,cm->cnk", one_hot, preferences, weights)
+    best = utilities >= utilities.max(axis=-1, keepdims=True) - UTILITY_TOLERANCE
+    return best.argmax(axis=-1)
+
+
+# Score of every candidate; the configuration chosen in a cycle serves the next cycle
+def score(choices, demand, costs, capacities, settings):
+    cost = costs[choices].mean(axis=1)
+    served = capacities[choices[:, :-1]]
+    violations = (demand[None, 1:] > settings["target_cpu_percent"] / 100 * served).mean(axis=1)
+    reconfigurations = (np.diff(choices, axis=1) != 0).mean(axis=1)
+    objective = settings["cost_weight"] * cost + settings["slo_weight"] * violations + settings["reconfiguration_weight"] * reconfigurations
+    return {"objective": objective, "cost": cost, "violations": violations, "reconfigurations": reconfigurations, "choices": choices}
+
+
+# Worker process: objective of a chunk of candidates
+def evaluate_chunk(thresholds, weights, preferences, values, demand, costs, capacities, settings):
+    return score(choose(thresholds, weights, preferences, values), demand, costs, capacities, settings)["objective"]
+
+
+# Quantile level of every threshold within the recorded values of its metric
+def threshold_levels(thresholds, values):
+    levels = np.full(thresholds.shape, 0.5)
+    for m in range(values.shape[1]):
+        recorded = values[:, m][~np.isnan(values[:, m])]
+        if len(recorded):
+            levels[m] = [np.mean(recorded <= threshold) for threshold in thresholds[m]]
+    return levels
+
+
+# Round to 4 significant digits, so that the written file holds exactly the evaluated values
+def round_significant(values):
+    values = np.asarray(values, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        digits = np.where(values == 0, 0, 3 - np.floor(np.log10(np.abs(values))))
+    return np.round(values * 10.0 ** digits) / 10.0 ** digits
+
+
+# Candidates around a center: thresholds drawn as sorted quantile levels of the recorded values, weights from a
+# Dirichlet distribution and, with tune_preferences, preferences perturbed and kept non-decreasing with the cost.
+# The center itself is the first candidate.
+def sample_candidates(rng, count, center, values, spread, tune_preferences):
+    thresholds, weights, preferences = center
+    metric_count = thresholds.shape[0]
+
+    levels = threshold_levels(thresholds, values)
+    sampled_levels = np.sort(np.clip(levels[None] + rng.normal(0, spread, (count, metric_count, len(BANDS) - 1)), 0.01, 0.999), axis=-1)
+    candidate_thresholds = np.repeat(thresholds[None], count, axis=0)
+    for m in range(metric_count):
+        recorded = values[:, m][~np.isnan(values[:, m])]
+        if len(recorded):
+            candidate_thresholds[:, m] = round_significant(np.quantile(recorded, sampled_levels[:, m]))
+
+    concentration = 2 / spread
+    candidate_weights = np.round(rng.dirichlet(np.maximum(weights / weights.sum(), 0.01) * concentration * metric_count, count), 2)
+
+    candidate_preferences = np.repeat(preferences[None], count, axis=0)
+    if tune_preferences:
+        noise = rng.normal(0, spread / 2, candidate_preferences.shape)
+        candidate_preferences = np.maximum.accumulate(np.round(np.clip(candidate_preferences + noise, 0, 1), 2), axis=-1)
+
+    candidate_thresholds[0], candidate_weights[0], candidate_preferences[0] = thresholds, weights, preferences
+    return candidate_thresholds, candidate_weights, candidate_preferences
+
+
+# Random search in rounds, each round sampling closer around the best candidate so far
+def search(pool, workers, base, values, demand, costs, capacities, settings, rng, tune_preferences):
+    best = base
+    best_objective = math.inf
+    spread = INITIAL_SPREAD
+    per_round = max(1, settings["candidates"] // settings["rounds"])
+
+    for _ in range(settings["rounds"]):
+        candidates = sample_candidates(rng, per_round, best, values, spread, tune_preferences)
+        chunks = np.array_split(np.arange(per_round), workers)
+        futures = [pool.submit(evaluate_chunk, *(array[chunk] for array in candidates), values, demand, costs, capacities, settings)
+                   for chunk in chunks if len(chunk)]
+        objective = np.concatenate([future.result() for future in futures])
+
+        index = int(np.argmin(objective))
+        if objective[index] < best_objective:
+            best_objective = objective[index]
+            best = tuple(array[index] for array in candidates)
+        spread /= 3
+
+    return best
+
+
+# Utility config with the tuned values, in the layout of analyzer_utility.json
+def to_utility_config(utility_config, parameters, config_keys, tune_preferences):
+    thresholds, weights, preferences = parameters
+    tuned = copy.deepcopy(utility_config)
+    for m, item in enumerate(tuned):
+        item["weight"] = float(weights[m])
+        item["scaled thresholds"] = [int(value) if float(value).is_integer() else float(value) for value in thresholds[m]]
+        if tune_preferences:
+            item["preferences"] = {band: {key: float(preferences[m, b, k]) for k, key in enumerate(config_keys)} for b, band in enumerate(BANDS)}
+    return tuned
+
+
+def summary(result, costs_m):
+    return {
+        "objective": float(result["objective"][0]),
+        "mean_cpu_request_millicores": float(costs_m[result["choices"][0]].mean()),
+        "slo_violations_percent": float(100 * result["violations"][0]),
+        "reconfigurations_percent": float(100 * result["reconfigurations"][0])
+    }
+
+
+# Tune a service on the cycles returned by features(utility_config, trace capacity); returns (tuned config, report)
+def tune_service(pool, workers, service, features, configurations, settings, rng, tune_preferences):
+    config_keys = order_by_cost(configurations)
+    utility_config = analyzer.load_utility_config(service)
+    model = compile_utility_model(utility_config, config_keys)
+
+    trace_config = settings["trace_configs"].get(service, settings["trace_config"])
+    values, demand = features(utility_config, cpu_capacity(configurations[trace_config]))
+    if np.isnan(demand).all():
+        print(f"{service}: no {CPU_METRIC} in the trace, only the cost is optimized")
+
+    costs = request_costs(configurations, config_keys)
+    capacities = np.array([cpu_capacity(configurations[key]) for key in config_keys])
+    cpu_requests_m = np.array([resource_totals(configurations[key])[0] for key in config_keys])
+
+    split = max(2, int(len(values) * settings["train_fraction"]))
+    train = (values[:split], demand[:split])
+    test = (values[split - 1:], demand[split - 1:])
+
+    base = (model.thresholds, model.weights, model.preferences)
+    best = search(pool, workers, base, *train, costs, capacities, settings, rng, tune_preferences)
+
+    report = {}
+    for name, parameters in [("current", base), ("tuned", best)]:
+        report[name] = {}
+        for split_name, (split_values, split_demand) in [("train", train), ("test", test)]:
+            result = score(choose(*(array[None] for array in parameters), split_values), split_demand, costs, capacities, settings)
+            report[name][split_name] = summary(result, cpu_requests_m)
+
+    return to_utility_config(utility_config, best, config_keys, tune_preferences), report
+
+
+def print_report(service, report):
+    print(f"\n{service}")
+    for name in ("current", "tuned"):
+        for split_name in ("train", "test"):
+            result = report[name][split_name]
+            print(f"  {name:<8}{split_name:<6} objective {result['objective']:.3f}  CPU request {result['mean_cpu_request_millicores']:6.0f}m  "
+                  f"SLO violations {result['slo_violations_percent']:5.1f}%  reconfigurations {result['reconfigurations_percent']:5.1f}%")
+
+
+# Written to a temporary file that is renamed over path, so a reader never sees a partial file
+def write_utility_config(path, utility_config):
+    telemetry.write_atomically(path, [json.dumps(utility_config, indent=4)])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Tune the utility thresholds and weights against the recorded traces.")
+    parser.add_argument("--services", default=",".join(analyzer.SERVICES), help="Comma separated services (default: all).")
+    parser.add_argument("--candidates", type=int, help="Candidates evaluated per service (default: from tuning.json).")
+    parser.add_argument("--rounds", type=int, help="Search rounds (default: from tuning.json).")
+    parser.add_argument("--preferences", action="store_true", help="Also tune the preference values.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: number of CPUs).")
+    parser.add_argument("--seed", type=int, help="Random seed (default: from tuning.json).")
+    parser.add_argument("--source", choices=["csv", "store", "rollup"], default="csv",
+                        help="Read traces from output/*.csv, the raw samples of the metrics store or its 5 minute rollups (default: csv).")
+    parser.add_argument("--days", type=float, default=28, help="History used with --source rollup, in days (default: 28).")
+    parser.add_argument("--apply", action="store_true", help="Replace analyzer_utility.json (kept as analyzer_utility.json.bak) when the tuned config also scores better on the held out cycles.")
+    parser.add_argument("--json", help="Also write the reports to this JSON file.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    settings = dict(load_tuning_config())
+    for key, value in [("candidates", args.candidates), ("rounds", args.rounds), ("seed", args.seed)]:
+        if value is not None:
+            settings[key] = value
+
+    configurations = analyzer.load_configuration_states()
+    services = args.services.split(",")
+    store = MetricsStore() if args.source == "rollup" else None
+    traces = load_traces(services, args.source) if store is None else {}
+    rng = np.random.default_rng(settings["seed"])
+
+    reports = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for service in services:
+            if store is not None and store.columns(service) is not None:
+                def features(utility_config, trace_capacity_m):
+                    return rollup_features(store, service, utility_config, trace_capacity_m, args.days * 86400)
+            elif service in traces:
+                def features(utility_config, trace_capacity_m):
+                    return cycle_features(traces[service], utility_config, trace_capacity_m)
+            else:
+                print(f"{service}: no trace found, skipping")
+                continue
+
+            tuned, reports[service] = tune_service(pool, args.workers, service, features, configurations, settings, rng, args.preferences)
+            print_report(service, reports[service])
+
+            utility_path = os.path.join(analyzer.CONFIGURATIONS_FOLDER, service, "analyzer_utility.json")
+            write_utility_config(utility_path.replace(".json", ".tuned.json"), tuned)
+
+            improved = reports[service]["tuned"]["test"]["objective"] < reports[service]["current"]["test"]["objective"]
+            if args.apply and improved:
+                # The live file is copied, not moved, so the analyzer always finds a complete file to reload
+                shutil.copy2(utility_path, utility_path + ".bak")
+                write_utility_config(utility_path, tuned)
+                print(f"  Applied to {utility_path}")
+            elif args.apply:
+                print("  Not applied: the tuned config does not score better on the held out cycles")
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(reports, json_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# Utility model compiled from an analyzer_utility.json into arrays.
+#
+# For M metrics and K configurations a model holds
+#   thresholds  (M, 3)     the scaled thresholds separating the 4 bands
+#   weights     (M,)       the metric weights
+#   preferences (M, 4, K)  the preference of every configuration, indexed by [metric, band, config]
+# and the utility of every configuration is sum_m weights[m] * preferences[m, band(m), :].
+#
+# Models of several services are stacked (padded with zero-weight metrics) so that the utilities of all
+# services, for any number of metric samples, are computed with one comparison and one tensor contraction.
+
+import numpy as np
+
+BANDS = ["low", "medium", "high", "very high"]
+
+
+class UtilityModel:
+    def __init__(self, metric_names, config_keys, thresholds, weights, preferences):
+        self.metric_names = metric_names
+        self.config_keys = config_keys
+        self.thresholds = thresholds
+        self.weights = weights
+        self.preferences = preferences
+
+
+class StackedUtilityModel:
+    def __init__(self, services, metric_names, config_keys, thresholds, weights, preferences):
+        self.services = services
+        self.metric_names = metric_names
+        self.config_keys = config_keys
+        self.thresholds = thresholds
+        self.weights = weights
+        self.preferences = preferences
+
+
+# Compile a utility config (the list loaded from analyzer_utility.json).
+# config_keys fixes the configuration axis; by default it is taken from the "low" preferences of the first metric.
+def compile_utility_model(utility_config, config_keys=None):
+    if config_keys is None:
+        config_keys = list(utility_config[0]["preferences"]["low"]) if utility_config else []
+
+    metric_count = len(utility_config)
+    thresholds = np.zeros((metric_count, len(BANDS) - 1))
+    weights = np.zeros(metric_count)
+    preferences = np.zeros((metric_count, len(BANDS), len(config_keys)))
+
+    for m, item in enumerate(utility_config):
+        if len(item["scaled thresholds"]) != len(BANDS) - 1:
+            raise ValueError(f"Metric '{item['name']}' must have {len(BANDS) - 1} scaled thresholds")
+        thresholds[m] = item["scaled thresholds"]
+        weights[m] = item["weight"]
+
+        for b, band in enumerate(BANDS):
+            band_preferences = item["preferences"][band]
+            missing = [key for key in config_keys if key not in band_preferences]
+            if missing:
+                raise ValueError(f"Metric '{item['name']}' has no '{band}' preference for {', '.join(missing)}")
+            preferences[m, b] = [band_preferences[key] for key in config_keys]
+
+    metric_names = [item["name"] for item in utility_config]
+    return UtilityModel(metric_names, list(config_keys), thresholds, weights, preferences)
+
+
+# Stack the models of several services ({service: UtilityModel}); they must share the configuration axis
+def stack_utility_models(models):
+    services = list(models)
+    config_keys = models[services[0]].config_keys if services else []
+    metric_count = max((len(model.metric_names) for model in models.values()), default=0)
+
+    thresholds = np.full((len(services), metric_count, len(BANDS) - 1), np.inf)
+    weights = np.zeros((len(services), metric_count))
+    preferences = np.zeros((len(services), metric_count, len(BANDS), len(config_keys)))
+    metric_names = []
+
+    for s, service in enumerate(services):
+        model = models[service]
+        if model.config_keys != config_keys:
+            raise ValueError(f"Utility model of {service} has configurations {model.config_keys}, expected {config_keys}")
+
+        count = len(model.metric_names)
+        thresholds[s, :count] = model.thresholds
+        weights[s, :count] = model.weights
+        preferences[s, :count] = model.preferences
+        metric_names.append(model.metric_names)
+
+    return StackedUtilityModel(services, metric_names, list(config_keys), thresholds, weights, preferences)
+
+
+# Band of every value: 0 (low) up to 3 (very high). A value equal to a threshold stays in the lower band and NaN is low.
+# This is np.digitize(value, thresholds, right=True), done for per-metric thresholds at once.
+def band_indices(values, thresholds):
+    return (values[..., None] > thresholds).sum(axis=-1)
+
+
+# Utilities of a single model for metric values of shape (..., M); returns shape (..., K)
+def evaluate(model, values):
+    bands = band_indices(np.asarray(values, dtype=float), model.thresholds)
+    one_hot = (bands[..., None] == np.arange(len(BANDS))).astype(float)
+    return np.einsum("...mb,mbk,m->...k", one_hot, model.preferences, model.weights)
+
+
+# Utilities of stacked models for values of shape (S, N, M), N samples per service; returns shape (S, N, K)
+def evaluate_stacked(stack, values):
+    values = np.asarray(values, dtype=float)
+    bands = band_indices(values, stack.thresholds[:, None])
+    one_hot = (bands[..., None] == np.arange(len(BANDS))).astype(float)
+    return np.einsum("snmb,smbk,sm->snk", one_hot, stack.preferences, stack.weights)
+
+
+# Metric values of one service in the order of the model (missing metrics are NaN)
+def value_vector(metric_names, metric_values, length=None):
+    vector = np.full(length if length is not None else len(metric_names), np.nan)
+    for m, name in enumerate(metric_names):
+        vector[m] = metric_values.get(name, np.nan)
+    return vector
+
+
+# Utilities of all services of a stack, one set of metric values per service ({service: {metric: value}})
+def evaluate_services(stack, metric_values):
+    metric_count = stack.weights.shape[1]
+    values = np.stack([value_vector(names, metric_values.get(service, {}), metric_count) for service, names in zip(stack.services, stack.metric_names)]) if stack.services else np.zeros((0, metric_count))
+    utilities = evaluate_stacked(stack, values[:, None, :])[:, 0, :]
+    return {service: dict(zip(stack.config_keys, utilities[s].tolist())) for s, service in enumerate(stack.services)}
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+# Incremental sliding-window statistics per (service, metric).
+#
+# Every metric keeps the last `window_size` samples in a ring buffer together with a running sum and
+# count, monotonic queues for the window min/max, an EWMA and a decaying quantile sketch for p95/p99.
+# New samples are folded in as they arrive, so a cycle costs O(new samples) instead of re-reading and
+# re-averaging the window. The state is persisted to a JSON file between cycles (and processes).
+
+import json
+import math
+import os
+from collections import deque
+
+# Constants
+STATE_FOLDER = "../state"
+WINDOW_STATE_FILE = os.path.join(STATE_FOLDER, "windows.json")
+
+DEFAULT_WINDOW_SIZE = 30
+DEFAULT_EWMA_ALPHA = 0.2
+
+# Quantile sketch: log-spaced buckets with ~1% relative error, weights decaying with a half-life in samples
+SKETCH_RELATIVE_ERROR = 0.01
+SKETCH_HALF_LIFE = 360
+
+# Recompute the running sum from the ring buffer every this many samples to cancel floating point drift
+RESUM_INTERVAL = 10000
+
+STATISTICS = ["mean", "count", "ewma", "min", "max", "p95", "p99"]
+
+
+# Approximate quantiles over a stream with exponentially decaying weights.
+# Values are counted in logarithmic buckets (a bucket covers a factor of gamma), so any quantile is
+# estimated with a relative error of SKETCH_RELATIVE_ERROR. Weights grow by a constant factor per sample
+# instead of decaying all buckets, and are rescaled when they get large.
+class QuantileSketch:
+    def __init__(self, relative_error=SKETCH_RELATIVE_ERROR, half_life=SKETCH_HALF_LIFE):
+        self.gamma = (1 + relative_error) / (1 - relative_error)
+        self.growth = 2 ** (1 / half_life)
+        self.weight = 1.0
+        self.buckets = {}
+        self.zero_weight = 0.0
+
+    def add(self, value):
+        if value <= 0:
+            self.zero_weight += self.weight
+        else:
+            key = math.ceil(math.log(value, self.gamma))
+            self.buckets[key] = self.buckets.get(key, 0.0) + self.weight
+
+        self.weight *= self.growth
+        if self.weight > 1e100:
+            self.rescale(1 / self.weight)
+
+    def rescale(self, factor):
+        self.weight *= factor
+        self.zero_weight *= factor
+        for key in self.buckets:
+            self.buckets[key] *= factor
+
+    def quantile(self, q):
+        total = self.zero_weight + sum(self.buckets.values())
+        if total == 0:
+            return math.nan
+
+        rank = q * total
+        cumulative = self.zero_weight
+        if cumulative >= rank:
+            return 0.0
+        for key in sorted(self.buckets):
+            cumulative += self.buckets[key]
+            if cumulative >= rank:
+                # Midpoint of the bucket (gamma^(key-1), gamma^key]
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_dict(self):
+        return {"weight": self.weight, "zero_weight": self.zero_weight, "buckets": {str(key): value for key, value in self.buckets.items()}}
+
+    def load(self, data):
+        self.weight = data["weight"]
+        self.zero_weight = data["zero_weight"]
+        self.buckets = {int(key): value for key, value in data["buckets"].items()}
+
+
+# Sliding window over the last `window_size` samples of one metric
+class MetricWindow:
+    def __init__(self, window_size=DEFAULT_WINDOW_SIZE, ewma_alpha=DEFAULT_EWMA_ALPHA):
+        self.window_size = window_size
+        self.ewma_alpha = ewma_alpha
+        self.values = deque(maxlen=window_size)
+        self.total = 0.0
+        self.count = 0
+        self.seen = 0
+        self.ewma = math.nan
+        # (sequence number, value) pairs with increasing values (minimums) and decreasing values (maximums)
+        self.minimums = deque()
+        self.maximums = deque()
+        self.sketch = QuantileSketch()
+
+    def push(self, value):
+        # Evict the oldest sample once the window is full
+        if len(self.values) == self.window_size:
+            evicted = self.values[0]
+            if not math.isnan(evicted):
+                self.total -= evicted
+                self.count -= 1
+
+        self.values.append(value)
+        self.seen += 1
+
+        oldest = self.seen - self.window_size
+        while self.minimums and self.minimums[0][0] <= oldest:
+            self.minimums.popleft()
+        while self.maximums and self.maximums[0][0] <= oldest:
+            self.maximums.popleft()
+
+        # Missing samples do not count, like DataFrame.mean()
+        if math.isnan(value):
+            return
+
+        self.total += value
+        self.count += 1
+        self.ewma = value if math.isnan(self.ewma) else self.ewma_alpha * value + (1 - self.ewma_alpha) * self.ewma
+
+        while self.minimums and self.minimums[-1][1] >= value:
+            self.minimums.pop()
+        self.minimums.append((self.seen, value))
+        while self.maximums and self.maximums[-1][1] <= value:
+            self.maximums.pop()
+        self.maximums.append((self.seen, value))
+
+        self.sketch.add(value)
+
+        if self.seen % RESUM_INTERVAL == 0:
+            self.total = math.fsum(v for v in self.values if not math.isnan(v))
+
+    def statistics(self):
+        return {
+            "mean": self.total / self.count if self.count else math.nan,
+            "count": self.count,
+            "ewma": self.ewma,
+            "min": self.minimums[0][1] if self.minimums else math.nan,
+            "max": self.maximums[0][1] if self.maximums else math.nan,
+            "p95": self.sketch.quantile(0.95),
+            "p99": self.sketch.quantile(0.99)
+        }
+
+    def to_dict(self):
+        return {
+            "values": list(self.values),
+            "total": self.total,
+            "count": self.count,
+            "seen": self.seen,
+            "ewma": self.ewma,
+            "minimums": list(self.minimums),
+            "maximums": list(self.maximums),
+            "sketch": self.sketch.to_dict()
+        }
+
+    def load(self, data):
+        self.values = deque(data["values"], maxlen=self.window_size)
+        self.total = data["total"]
+        self.count = data["count"]
+        self.seen = data["seen"]
+        self.ewma = data["ewma"]
+        self.minimums = deque(tuple(item) for item in data["minimums"])
+        self.maximums = deque(tuple(item) for item in data["maximums"])
+        self.sketch.load(data["sketch"])
+
+
+# Windows of all metrics of all services, plus the timestamp of the last sample folded in per service
+class WindowEngine:
+    def __init__(self, window_size=DEFAULT_WINDOW_SIZE, ewma_alpha=DEFAULT_EWMA_ALPHA, state_path=WINDOW_STATE_FILE):
+        self.window_size = window_size
+        self.ewma_alpha = ewma_alpha
+        self.state_path = state_path
+        self.windows = {}
+        self.last_timestamps = {}
+
+    def window(self, service, metric):
+        service_windows = self.windows.setdefault(service, {})
+        if metric not in service_windows:
+            service_windows[metric] = MetricWindow(self.window_size, self.ewma_alpha)
+        return service_windows[metric]
+
+    # Fold in rows (values followed by the timestamp); rows not newer than the last folded sample are ignored
+    def update(self, service, columns, rows):
+        last_timestamp = self.last_timestamps.get(service)
+        added = 0
+
+        for row in rows:
+            timestamp = float(row[-1])
+            if last_timestamp is not None and timestamp <= last_timestamp:
+                continue
+            for metric, value in zip(columns[:-1], row[:-1]):
+                self.window(service, metric).push(float(value))
+            last_timestamp = timestamp
+            added += 1
+
+        if last_timestamp is not None:
+            self.last_timestamps[service] = last_timestamp
+        return added
+
+    # Fold in the samples stored since the last update; a service seen for the first time is seeded with the last window of samples
+    def update_from_store(self, store, service):
+        columns = store.columns(service)
+        if columns is None:
+            return 0
+
+        last_timestamp = self.last_timestamps.get(service)
+        if last_timestamp is None:
+            rows = store.tail(service, self.window_size)
+        else:
+            rows = store.read_since(service, last_timestamp)
+        return self.update(service, columns, rows)
+
+    def statistics(self, service, metric):
+        return self.window(service, metric).statistics()
+
+    # Values of the metrics named in a utility config; a metric may pick its statistic with "statistic" (default: mean)
+    def metric_values(self, service, utility_config):
+        values = {}
+        for item in utility_config:
+            statistic = item.get("statistic", "mean")
+            if statistic not in STATISTICS:
+                raise ValueError(f"Unknown statistic '{statistic}' for metric '{item['name']}'")
+            values[item["name"]] = self.statistics(service, item["name"])[statistic]
+        return values
+
+    def has_data(self, service):
+        return service in self.last_timestamps
+
+    def save(self):
+        state = {
+            "window_size": self.window_size,
+            "ewma_alpha": self.ewma_alpha,
+            "last_timestamps": self.last_timestamps,
+            "windows": {service: {metric: window.to_dict() for metric, window in metrics.items()} for service, metrics in self.windows.items()}
+        }
+
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w") as json_file:
+            json.dump(state, json_file)
+        os.replace(temp_path, self.state_path)
+
+    # Load the persisted state; it is discarded if the window settings have changed
+    def load(self):
+        if not os.path.exists(self.state_path):
+            return False
+
+        with open(self.state_path, "r") as json_file:
+            state = json.load(json_file)
+
+        if state["window_size"] != self.window_size or state["ewma_alpha"] != self.ewma_alpha:
+            print("Window settings changed, rebuilding the windows from the metrics store.")
+            return False
+
+        self.last_timestamps = state["last_timestamps"]
+        for service, metrics in state["windows"].items():
+            for metric, data in metrics.items():
+                self.window(service, metric).load(data)
+        return True
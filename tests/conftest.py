@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts import each other by module name, as when they are run from the scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
@@ -0,0 +1,164 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import analyzer
+import stabilization
+from executor import DeploymentExecutor, ExecutionResult
+from metrics_store import MetricsStore
+from state_journal import StateJournal
+from utility_model import compile_utility_model
+from window_engine import WindowEngine
+
+CONFIGURATIONS = {
+    "C1": {"cpu_request": "200m", "cpu_limit": "400m", "memory_request": "200Mi", "memory_limit": "300Mi", "num_pods": 1},
+    "C3": {"cpu_request": "600m", "cpu_limit": "900m", "memory_request": "500Mi", "memory_limit": "700Mi", "num_pods": 1}
+}
+
+
+# One metric: C3 is preferred from the "high" band (above 60) on
+UTILITY_CONFIG = [{
+    "name": "cpu",
+    "weight": 1.0,
+    "scaled thresholds": [30, 60, 90],
+    "preferences": {band: {"C1": 1.0 if band in ("low", "medium") else 0.2, "C3": 1.0} for band in ("low", "medium", "high", "very high")}
+}]
+
+
+class RecordingExecutor:
+    def __init__(self, ok=True, timed_out=False):
+        self.updates = []
+        self.submitted = []
+        self.ok = ok
+        self.timed_out = timed_out
+
+    def submit(self, deployment, cpu_request, cpu_limit, memory_request, memory_limit, num_pods):
+        self.updates.append((deployment, cpu_request, cpu_limit, memory_request, memory_limit, num_pods))
+        self.submitted.append(self.updates[-1])
+
+    def wait(self, timeout_s=None):
+        updates, self.updates = self.updates, []
+        return [ExecutionResult(update[0], self.ok, 0.1, "" if self.ok else "patch failed", timed_out=self.timed_out) for update in updates]
+
+
+# A service on C1 whose stored samples ask for C3, with its store, windows and journal in tmp_path
+def make_cycle(tmp_path, config_state=None):
+    store = MetricsStore(str(tmp_path / "store"), rollups=False)
+    store.append("svc", ["cpu", "Timestamp"], np.array([[80.0, 1_700_000_000.0 + 10 * i] for i in range(5)]))
+    service_configs = {"svc": {
+        "utility_config": UTILITY_CONFIG,
+        "utility_model": compile_utility_model(UTILITY_CONFIG, ["C1", "C3"]),
+        "config_state": config_state if config_state is not None else {"current_config": "C1", "previous_config": "C1", "changed_at": 0},
+        "config_state_path": str(tmp_path / "config_state.json"),
+        "stabilization": stabilization.DEFAULT_SETTINGS,
+        "dependency": None,
+        "replica_scaling": {"enabled": False}
+    }}
+    windows = WindowEngine(5, state_path=str(tmp_path / "windows.json"))
+    journal = StateJournal(str(tmp_path / "state.db"))
+    return service_configs, store, windows, journal
+
+
+def run_cycle(service_configs, store, windows, journal, executor):
+    return analyzer.analyze_services(service_configs, CONFIGURATIONS, store, windows, analyzer.build_utility_stack(service_configs), executor, None, journal, None)
+
+
+def journaled_config(journal, service):
+    state = journal.connection.execute("SELECT state FROM config_state WHERE service = ?", (service,)).fetchone()[0]
+    return json.loads(state)["current_config"]
+
+
+def test_replicas_change_keeps_the_held_tier(tmp_path):
+    service_config = {
+        "config_state": {"current_config": "C3", "previous_config": "C3", "changed_at": 0, "replicas": 2},
+        "config_state_path": str(tmp_path / "config_state.json"),
+        "stabilization": stabilization.DEFAULT_SETTINGS,
+        "replica_scaling": {"enabled": True},
+        "dependency": None
+    }
+    executor = RecordingExecutor()
+
+    # C1 is the best tier, but scaling down waits for scale_down_cycles cycles; the replica count goes up right away
+    best, to_update = analyzer.analyze_service("svc", {"C1": 1.0, "C3": 0.5}, service_config, CONFIGURATIONS, executor, replicas=4)
+
+    assert best == "C1" and to_update
+    assert service_config["config_state"]["current_config"] == "C3"
+    assert executor.updates == [("svc", "600m", "900m", "500Mi", "700Mi", 4)]
+
+
+def test_reload_without_utility_file_keeps_the_model(tmp_path, monkeypatch):
+    monkeypatch.setattr(analyzer, "CONFIGURATIONS_FOLDER", str(tmp_path))
+    service_config = {"utility_config": {"C1": {}}}
+
+    # At startup a missing file gives an empty utility config; on a reload it raises and nothing is applied
+    assert analyzer.load_utility_config("svc") == {}
+    with pytest.raises(FileNotFoundError):
+        analyzer.reload_service_config("svc", service_config, CONFIGURATIONS)
+    assert service_config == {"utility_config": {"C1": {}}}
+
+
+def test_failed_update_is_not_committed(tmp_path):
+    service_configs, store, windows, journal = make_cycle(tmp_path)
+
+    degraded = run_cycle(service_configs, store, windows, journal, RecordingExecutor(ok=False))
+
+    # The scale up to C3 failed: the journal keeps C1 and the next cycle decides to scale up again
+    assert degraded == {"svc": "deployment update failed"}
+    assert service_configs["svc"]["config_state"]["current_config"] == "C1"
+    assert journaled_config(journal, "svc") == "C1"
+    executor = RecordingExecutor()
+    store.append("svc", ["cpu", "Timestamp"], np.array([[80.0, 1_700_000_100.0]]))
+    assert run_cycle(service_configs, store, windows, journal, executor) == {}
+    assert journaled_config(journal, "svc") == "C3"
+
+
+def test_failed_patch_with_fake_oc_is_reverted(tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_OC_DELAY_S", "0")
+    monkeypatch.setenv("FAKE_OC_FAIL", "svc")
+    service_configs, store, windows, journal = make_cycle(tmp_path)
+    executor = DeploymentExecutor("test", oc_binary=os.path.join(os.path.dirname(analyzer.__file__), "fake_oc.py"), token="")
+
+    degraded = run_cycle(service_configs, store, windows, journal, executor)
+    executor.shutdown()
+
+    assert degraded == {"svc": "deployment update failed"}
+    assert service_configs["svc"]["config_state"]["current_config"] == "C1"
+    assert journaled_config(journal, "svc") == "C1"
+
+
+def test_timed_out_update_is_applied_again(tmp_path):
+    service_configs, store, windows, journal = make_cycle(tmp_path)
+
+    # The patch may still land, so the state keeps C3 and is marked pending
+    assert run_cycle(service_configs, store, windows, journal, RecordingExecutor(ok=False, timed_out=True)) == {"svc": "deployment update timed out"}
+    assert service_configs["svc"]["config_state"]["pending_update"]
+    assert journaled_config(journal, "svc") == "C3"
+
+    # The next cycle holds C3 but applies it again
+    executor = RecordingExecutor()
+    store.append("svc", ["cpu", "Timestamp"], np.array([[80.0, 1_700_000_100.0]]))
+    assert run_cycle(service_configs, store, windows, journal, executor) == {}
+    assert executor.submitted == [("svc", "600m", "900m", "500Mi", "700Mi", 1)]
+    assert "pending_update" not in service_configs["svc"]["config_state"]
+
+
+def test_saturated_database_holds_the_scale_up(tmp_path):
+    service_configs, store, windows, journal = make_cycle(tmp_path)
+    service_configs["svc"]["dependency"] = {"database": "db", "saturation thresholds": {"connections": 20}}
+    store.append("db", ["connections", "Timestamp"], np.array([[30.0, 1_700_000_000.0 + 10 * i] for i in range(5)]))
+    executor = RecordingExecutor()
+
+    # svc asks for C3, but its database is above its connection threshold
+    assert run_cycle(service_configs, store, windows, journal, executor) == {}
+    assert executor.submitted == []
+    assert service_configs["svc"]["config_state"]["current_config"] == "C1"
+    assert journaled_config(journal, "svc") == "C1"
+
+    # Once the window mean of the database is back under the threshold the scale up goes through
+    store.append("db", ["connections", "Timestamp"], np.array([[5.0, 1_700_000_050.0 + 10 * i] for i in range(5)]))
+    store.append("svc", ["cpu", "Timestamp"], np.array([[80.0, 1_700_000_100.0]]))
+    assert run_cycle(service_configs, store, windows, journal, executor) == {}
+    assert executor.submitted == [("svc", "600m", "900m", "500Mi", "700Mi", 1)]
+    assert journaled_config(journal, "svc") == "C3"
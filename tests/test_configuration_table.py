@@ -0,0 +1,18 @@
+import pytest
+
+from configuration_table import order_by_cost, validate_configurations
+from test_analyzer import CONFIGURATIONS
+
+
+def test_costs_order_the_configurations():
+    priced = {"C1": dict(CONFIGURATIONS["C1"], cost=5), "C3": dict(CONFIGURATIONS["C3"], cost=2)}
+
+    assert order_by_cost(validate_configurations(priced)) == ["C3", "C1"]
+    assert order_by_cost(validate_configurations(CONFIGURATIONS)) == ["C1", "C3"]
+
+
+def test_a_table_mixing_priced_and_unpriced_configurations_is_rejected():
+    mixed = {"C1": CONFIGURATIONS["C1"], "C3": dict(CONFIGURATIONS["C3"], cost=2)}
+
+    with pytest.raises(ValueError, match="C1 have no cost"):
+        validate_configurations(mixed)
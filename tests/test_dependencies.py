@@ -0,0 +1,34 @@
+import math
+
+import dependencies
+from window_engine import WindowEngine
+
+DEPENDENCY = {"database": "db", "saturation thresholds": {"connections": 20, "threads": 60}}
+RANKING = ["C1", "C2", "C3"]
+
+
+def windows_with(tmp_path, rows):
+    windows = WindowEngine(5, state_path=str(tmp_path / "windows.json"))
+    windows.update("db", ["connections", "threads", "Timestamp"], rows)
+    return windows
+
+
+def test_only_metrics_above_their_threshold_are_saturated(tmp_path):
+    windows = windows_with(tmp_path, [[30.0, math.nan, 1.0], [10.0, math.nan, 2.0]])
+
+    # A mean equal to its threshold is not saturated, and the NaN mean of the threads window never is
+    assert dependencies.database_saturation(DEPENDENCY, windows) == {}
+    windows.update("db", ["connections", "threads", "Timestamp"], [[50.0, math.nan, 3.0]])
+    assert dependencies.database_saturation(DEPENDENCY, windows) == {"connections": (30.0, 20)}
+    assert dependencies.database_saturation(None, windows) == {}
+    assert dependencies.database_saturation({"database": "other", "saturation thresholds": {"connections": 0}}, windows) == {}
+
+
+def test_a_saturated_database_caps_scale_ups_only():
+    saturated = {"connections": (30.0, 20)}
+
+    assert dependencies.cap_scale_up("C3", "C2", RANKING, saturated) == "C2"
+    assert dependencies.cap_scale_up("C1", "C2", RANKING, saturated) == "C1"
+    assert dependencies.cap_scale_up("C3", "C2", RANKING, {}) == "C3"
+    # A current configuration that is no longer configured is not held
+    assert dependencies.cap_scale_up("C3", "C9", RANKING, saturated) == "C3"
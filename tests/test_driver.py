@@ -0,0 +1,20 @@
+import driver
+from loop_health import LoopHealth, phase_timeouts
+
+
+def test_monitor_gets_the_interval_and_a_start_failure_is_counted(tmp_path, monkeypatch):
+    monkeypatch.setattr(driver, "log_file", str(tmp_path / "driver.log"))
+    commands = []
+
+    # python3 cannot be started: the failure is counted and the cycle goes on
+    def run(command, **kwargs):
+        commands.append(command)
+        raise FileNotFoundError(2, "No such file or directory", command[0])
+
+    monkeypatch.setattr(driver.subprocess, "run", run)
+    health = LoopHealth()
+    driver.run_monitoring_script(health, phase_timeouts(60), 60)
+
+    assert commands[0][1:] == ["../scripts/monitor.py", "--fetch-window", "60"]
+    assert health.phases["monitor"]["failed"] == 1
+    assert health.phases["analyze"]["failed"] == 1
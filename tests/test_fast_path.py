@@ -0,0 +1,67 @@
+import time
+from types import SimpleNamespace
+
+import analyzer
+import fast_path
+import stabilization
+from buffered_log import BufferedLog
+from state_journal import StateJournal
+from test_analyzer import CONFIGURATIONS, RecordingExecutor
+from utility_model import compile_utility_model
+from window_engine import WindowEngine
+
+METRIC = "Sysdig Container Net HTTP Request Count"
+UTILITY_CONFIG = [{
+    "name": METRIC,
+    "weight": 1.0,
+    "scaled thresholds": [20, 60, 100],
+    "preferences": {band: {"C1": 1.0 if band == "low" else 0.2, "C3": 1.0} for band in ("low", "medium", "high", "very high")}
+}]
+
+
+class WaitRecordingExecutor(RecordingExecutor):
+    def wait(self, timeout_s=None):
+        self.wait_timeout_s = timeout_s
+        return super().wait(timeout_s)
+
+
+# A loop with one service on C1, changed at changed_at
+def make_watcher(tmp_path, monkeypatch, changed_at):
+    monkeypatch.setattr(fast_path, "log_file", str(tmp_path / "fast_path.log"))
+    monkeypatch.setattr(analyzer, "cycle_log", BufferedLog(str(tmp_path / "analyzer.log")))
+    service_config = {
+        "utility_config": UTILITY_CONFIG,
+        "utility_model": compile_utility_model(UTILITY_CONFIG, ["C1", "C3"]),
+        "config_state": {"current_config": "C1", "previous_config": "C1", "changed_at": changed_at},
+        "config_state_path": str(tmp_path / "config_state.json"),
+        "stabilization": stabilization.DEFAULT_SETTINGS,
+        "dependency": None,
+        "replica_scaling": {"enabled": False}
+    }
+    loop = SimpleNamespace(
+        metric_specs={"app": {"column_display_name": [METRIC, "Timestamp"], "metrics": [{"id": "net.http.request.count"}]}},
+        service_configs={"svc": service_config}, configurations=CONFIGURATIONS, config_version=0,
+        windows=WindowEngine(5, state_path=str(tmp_path / "windows.json")), planner_config={"enabled": False},
+        executor=WaitRecordingExecutor(), journal=StateJournal(str(tmp_path / "state.db")), timeouts={"execute": 7.0})
+    return fast_path.FastPathWatcher(loop), loop
+
+
+def test_held_trigger_starts_no_cooldown(tmp_path, monkeypatch):
+    # The service changed a moment ago, so the stabilization controller holds the scale up for the dwell time
+    watcher, loop = make_watcher(tmp_path, monkeypatch, changed_at=time.time())
+
+    watcher.trigger("svc", {METRIC: 150.0}, {METRIC: 150.0})
+
+    assert loop.service_configs["svc"]["config_state"]["current_config"] == "C1"
+    assert "svc" not in watcher.cooldown_until
+
+
+def test_update_starts_the_cooldown_and_waits_at_most_the_execute_limit(tmp_path, monkeypatch):
+    watcher, loop = make_watcher(tmp_path, monkeypatch, changed_at=0)
+
+    watcher.trigger("svc", {METRIC: 150.0}, {METRIC: 150.0})
+
+    assert loop.service_configs["svc"]["config_state"]["current_config"] == "C3"
+    assert loop.executor.submitted[0][0] == "svc"
+    assert loop.executor.wait_timeout_s == 7.0
+    assert watcher.cooldown_until["svc"] > time.monotonic()
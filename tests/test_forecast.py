@@ -0,0 +1,17 @@
+import numpy as np
+
+import forecast
+
+
+def test_default_history_covers_two_seasons():
+    config = dict(forecast.DEFAULT_FORECAST_CONFIG, method="holt_winters")
+    season = int(config["season_length_s"] // config["sampling_s"])
+    steps = np.arange(forecast.history_samples(config))
+    series = 100 + 50 * np.sin(2 * np.pi * steps / season)
+
+    # With the default history Holt-Winters follows the season instead of falling back to Holt
+    predicted = forecast.forecast(series, season // 4, config)
+    expected = 100 + 50 * np.sin(2 * np.pi * (len(series) + np.arange(season // 4)) / season)
+    assert np.abs(predicted - expected).max() < 5
+    holt = forecast.holt_forecast(series, season // 4, config["alpha"], config["beta"], config["phi"])
+    assert np.abs(holt - expected).max() > 5
@@ -0,0 +1,14 @@
+import math
+
+import ingest
+
+
+def test_missing_values_decode_as_nan():
+    res = {"data": [{"t": 1_700_000_000, "d": [1.5, None]}, {"t": 1_700_000_010, "d": [None, 4.0]}]}
+
+    rows = ingest.decode(res, ["cpu", "requests", "Timestamp"])
+
+    assert rows.shape == (2, 3)
+    assert rows[0, 0] == 1.5 and math.isnan(rows[0, 1])
+    assert math.isnan(rows[1, 0]) and rows[1, 1] == 4.0
+    assert rows[:, -1].tolist() == [1_700_000_000, 1_700_000_010]
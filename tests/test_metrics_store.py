@@ -0,0 +1,79 @@
+import contextlib
+import os
+import threading
+
+import numpy as np
+
+from metrics_store import LOCK_SUFFIX, MetricsStore, day_of, segment_lock
+
+COLUMNS = ["cpu", "requests", "Timestamp"]
+
+
+def test_append_into_a_fresh_store(tmp_path):
+    store = MetricsStore(str(tmp_path / "store"))
+    minute = 1_700_000_040.0
+
+    # Two appends within the same minute: no rollup bucket is complete yet and every tier is still empty
+    assert store.append("svc", COLUMNS, np.array([[1.0, 10.0, minute], [2.0, 20.0, minute + 10]])) == 2
+    assert store.append("svc", COLUMNS, np.array([[3.0, 30.0, minute + 20]])) == 1
+
+    assert len(store.read_all("svc")) == 3
+    assert store.update_rollups("svc") == {}
+
+    # A sample of the next minute completes the first 1 minute bucket
+    store.append("svc", COLUMNS, np.array([[4.0, 40.0, minute + 60]]))
+    rows = store.tiers["1m"].read_all("svc")
+    assert len(rows) == 1 and rows[0, -1] == minute
+
+
+def test_append_waits_for_a_segment_rewrite(tmp_path):
+    store = MetricsStore(str(tmp_path / "store"), rollups=False)
+    minute = 1_700_000_040.0
+    store.append("svc", COLUMNS, np.array([[1.0, 10.0, minute]]))
+    path = store.segment_path("svc", day_of(np.array([minute]))[0])
+
+    # While a backfill holds the segment, the live append waits instead of writing to the file being replaced
+    appender = threading.Thread(target=store.append, args=("svc", COLUMNS, np.array([[2.0, 20.0, minute + 10]])))
+    with segment_lock(path):
+        appender.start()
+        appender.join(0.2)
+        assert appender.is_alive()
+    appender.join()
+
+    store.merge("svc", COLUMNS, np.array([[0.5, 5.0, minute - 10]]))
+    assert store.read_all("svc")[:, -1].tolist() == [minute - 10, minute, minute + 10]
+
+
+def test_retention_removes_old_segments_with_their_lock_files(tmp_path):
+    store = MetricsStore(str(tmp_path / "store"), rollups=False)
+    day = 86400.0
+    store.append("svc", COLUMNS, np.array([[1.0, 10.0, 1_700_006_400.0 + d * day] for d in range(3)]))
+    paths = store.segments("svc")
+
+    assert store.apply_retention("svc", 1, now=1_700_006_400.0 + 2 * day) == [day_of(np.array([1_700_006_400.0]))[0]]
+    assert store.segments("svc") == paths[1:]
+    assert not os.path.exists(paths[0]) and not os.path.exists(paths[0] + LOCK_SUFFIX)
+    assert all(os.path.exists(path + LOCK_SUFFIX) for path in paths[1:])
+
+
+def test_a_lock_on_a_removed_lock_file_is_taken_again(tmp_path):
+    store = MetricsStore(str(tmp_path / "store"), rollups=False)
+    minute = 1_700_000_040.0
+    store.append("svc", COLUMNS, np.array([[1.0, 10.0, minute]]))
+    path = store.segment_path("svc", day_of(np.array([minute]))[0])
+
+    appender = threading.Thread(target=store.append, args=("svc", COLUMNS, np.array([[2.0, 20.0, minute + 10]])))
+    with contextlib.ExitStack() as held:
+        with segment_lock(path):
+            appender.start()
+            appender.join(0.2)
+            # The lock file is removed, as retention does, and another writer locks the new one
+            os.remove(path + LOCK_SUFFIX)
+            held.enter_context(segment_lock(path))
+
+        # The append got the lock of the removed file and waits for the lock of the new one
+        appender.join(0.2)
+        assert appender.is_alive()
+    appender.join()
+
+    assert len(store.read_all("svc")) == 2
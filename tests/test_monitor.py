@@ -0,0 +1,99 @@
+import pytest
+
+import monitor
+from metrics_store import MetricsStore
+from stub_monitor_client import StubMonitorClient, workloads_from_filter
+
+METRICS = [{"id": "cpu", "aggregations": {"time": "avg", "group": "avg"}}, {"id": "requests", "aggregations": {"time": "sum", "group": "sum"}}]
+COLUMNS = ["cpu", "requests", "Timestamp"]
+WORKLOAD_TAGS = {"a": 1.0, "b": 2.0, "c": 3.0, "bad": 4.0}
+
+
+# Every value returned for a workload is the tag of that workload; requests selecting a workload in `failing` fail
+class TaggedClient(StubMonitorClient):
+    def __init__(self, failing=()):
+        super().__init__(latency_s=0, seed=1)
+        self.failing = set(failing)
+
+    def get_data(self, metrics, start_ts, end_ts=0, sampling_s=0, filter="", datasource_type="host", paging=None):
+        workloads = workloads_from_filter(filter)
+        if self.failing.intersection(workloads):
+            return False, "Stub monitoring API error"
+
+        ok, res = super().get_data(metrics, start_ts, end_ts, sampling_s, filter, datasource_type, paging)
+        for row in res["data"]:
+            if isinstance(row["d"][0], str):
+                row["d"] = [row["d"][0]] + [WORKLOAD_TAGS[row["d"][0]]] * (len(row["d"]) - 1)
+            else:
+                row["d"] = [WORKLOAD_TAGS[workloads[0]]] * len(row["d"])
+        return ok, res
+
+
+def assert_saved_for_its_workload(store, service_name):
+    rows = store.read_all(service_name)
+    assert len(rows) == 30
+    assert (rows[:, :-1] == WORKLOAD_TAGS[service_name]).all()
+
+
+# Returns a sample with a value missing for the workload "bad"
+class MalformedClient(StubMonitorClient):
+    def get_data(self, metrics, start_ts, end_ts=0, sampling_s=0, filter="", datasource_type="host", paging=None):
+        ok, res = super().get_data(metrics, start_ts, end_ts, sampling_s, filter, datasource_type, paging)
+        if "'bad'" in filter:
+            res["data"][0]["d"] = res["data"][0]["d"][:-1]
+        return ok, res
+
+
+@pytest.mark.parametrize("fetch", [
+    lambda client, store: monitor.fetch_and_save_metrics(client, store, METRICS, COLUMNS, ["a", "bad", "b"]),
+    lambda client, store: monitor.fetch_and_save_metrics_concurrently(client, store, [(METRICS, COLUMNS, name) for name in ["a", "bad", "b"]], max_workers=3)
+])
+def test_malformed_response_fails_its_workload_only(tmp_path, fetch):
+    store = MetricsStore(str(tmp_path / "store"), rollups=False)
+
+    with pytest.raises(monitor.FetchError) as error:
+        fetch(MalformedClient(latency_s=0, seed=1), store)
+
+    assert error.value.service_names == ["bad"]
+    assert len(store.read_all("a")) == 30 and len(store.read_all("b")) == 30
+    assert store.columns("bad") is None
+
+
+def test_concurrent_fetch_splits_results_and_isolates_failures(tmp_path):
+    store = MetricsStore(str(tmp_path / "store"), rollups=False)
+    jobs = [(METRICS, COLUMNS, name) for name in ["a", "bad", "b", "c"]]
+
+    with pytest.raises(monitor.FetchError) as error:
+        monitor.fetch_and_save_metrics_concurrently(TaggedClient(failing=["bad"]), store, jobs, max_workers=4, retries=0)
+
+    assert error.value.service_names == ["bad"]
+    for service_name in ["a", "b", "c"]:
+        assert_saved_for_its_workload(store, service_name)
+    assert store.columns("bad") is None
+
+
+def test_batched_fetch_splits_rows_by_workload(tmp_path):
+    store = MetricsStore(str(tmp_path / "store"), rollups=False)
+    client = TaggedClient()
+    batches = [(METRICS, COLUMNS, batch) for batch in monitor.make_batches(["a", "b", "c"], batch_size=2)]
+
+    monitor.fetch_and_save_metrics_batched(client, store, batches, max_workers=2, retries=0)
+
+    assert client.calls == 2
+    for service_name in ["a", "b", "c"]:
+        assert_saved_for_its_workload(store, service_name)
+
+
+def test_batched_fetch_isolates_failed_batches_and_workloads(tmp_path):
+    store = MetricsStore(str(tmp_path / "store"), rollups=False)
+    # The stored schema of "c" does not match the fetched columns
+    store.append("c", ["other", "Timestamp"], [[1.0, 1.0]])
+    batches = [(METRICS, COLUMNS, ["a", "bad"]), (METRICS, COLUMNS, ["b", "c"])]
+
+    with pytest.raises(monitor.FetchError) as error:
+        monitor.fetch_and_save_metrics_batched(TaggedClient(failing=["bad"]), store, batches, max_workers=2, retries=0)
+
+    assert sorted(error.value.service_names) == ["a", "bad", "c"]
+    assert_saved_for_its_workload(store, "b")
+    assert store.columns("a") is None and store.columns("bad") is None
+    assert store.columns("c") == ["other", "Timestamp"]
@@ -0,0 +1,72 @@
+import itertools
+
+import numpy as np
+
+import analyzer
+import planner
+import stabilization
+from test_analyzer import CONFIGURATIONS
+
+NOW = 1_700_000_000.0
+PLANNER_CONFIG = planner.build_planner_config({"enabled": True, "budget": {"cpu": "1000m", "memory": None}})
+
+
+def test_a_held_scale_down_keeps_its_resources_in_the_budget():
+    # a moved to C3 ten seconds ago and wants C1, but the dwell time holds it on C3; b wants to scale up to C3
+    service_configs = {
+        "a": {"config_state": {"current_config": "C3", "changed_at": NOW - 10}, "stabilization": stabilization.DEFAULT_SETTINGS},
+        "b": {"config_state": {"current_config": "C1", "changed_at": 0}, "stabilization": stabilization.DEFAULT_SETTINGS}
+    }
+    metric_values = {service: {planner.CPU_METRIC: 10.0, planner.HTTP_ERROR_METRIC: 0.0} for service in service_configs}
+    utilities = {"a": {"C1": 1.0, "C3": 0.5}, "b": {"C1": 0.2, "C3": 1.0}}
+
+    assignment, reserved, _ = analyzer.plan_services(service_configs, CONFIGURATIONS, None, metric_values, utilities, {}, {}, PLANNER_CONFIG, NOW)
+
+    # Scaling b up only fits once a really runs C1, so b waits
+    assert assignment["b"].config_key == "C1"
+    assert reserved[0] + sum(option.cpu for option in assignment.values()) <= 1000
+
+
+def test_unmanaged_workloads_are_reserved():
+    service_configs = {"b": {"config_state": {"current_config": "C1", "changed_at": 0}, "stabilization": stabilization.DEFAULT_SETTINGS}}
+    metric_values = {"b": {planner.CPU_METRIC: 10.0, planner.HTTP_ERROR_METRIC: 0.0}}
+    planner_config = planner.build_planner_config({"enabled": True, "budget": {"cpu": "1000m", "memory": None},
+                                                   "unmanaged": {"db": {"cpu": "500m", "memory": "512Mi"}}})
+
+    assignment, reserved, _ = analyzer.plan_services(service_configs, CONFIGURATIONS, None, metric_values, {"b": {"C1": 0.2, "C3": 1.0}}, {}, {}, planner_config, NOW)
+
+    # C3 (600m) would fit the budget alone, but not next to the 500m of the database
+    assert reserved == (500, 512)
+    assert assignment["b"].config_key == "C1"
+
+
+def score(assignment):
+    total = (0, 0.0, 0.0)
+    for option in assignment:
+        total = planner.extend(total, option)
+    return total
+
+
+def test_plan_matches_brute_force():
+    rng = np.random.default_rng(7)
+    for _ in range(50):
+        options_by_service = {
+            f"s{s}": [planner.Option(f"C{o}", float(rng.integers(1, 10) * 100), float(rng.integers(1, 10) * 128), int(rng.integers(0, 3)),
+                                     float(rng.integers(1, 20)) / 4, float(rng.random())) for o in range(3)]
+            for s in range(4)
+        }
+        budget_cpu, budget_memory = float(rng.integers(8, 30) * 100), float(rng.integers(8, 30) * 128)
+        reserved = (100.0, 128.0)
+
+        feasible = [combination for combination in itertools.product(*options_by_service.values())
+                    if reserved[0] + sum(option.cpu for option in combination) <= budget_cpu
+                    and reserved[1] + sum(option.memory for option in combination) <= budget_memory]
+        assignment = planner.plan(options_by_service, budget_cpu, budget_memory, reserved)
+
+        if not feasible:
+            assert assignment is None
+            continue
+        assert list(assignment) == list(options_by_service)
+        assert reserved[0] + sum(option.cpu for option in assignment.values()) <= budget_cpu
+        assert reserved[1] + sum(option.memory for option in assignment.values()) <= budget_memory
+        assert score(assignment.values()) == min(score(combination) for combination in feasible)
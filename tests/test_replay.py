@@ -0,0 +1,20 @@
+import pandas as pd
+
+import analyzer
+import replay
+import stabilization
+from test_analyzer import CONFIGURATIONS
+
+
+def test_utility_policy_uses_the_analyzer_state_change():
+    service_configs = {"svc": {"config_state": {"current_config": "C3"}, "stabilization": stabilization.DEFAULT_SETTINGS}}
+    policy = replay.UtilityPolicy(replay.ReplayContext({"svc": None}, CONFIGURATIONS, service_configs))
+    policy.utilities = lambda service, window: {"C1": 1.0, "C3": 0.5}
+    window = pd.DataFrame({"Timestamp": [1_700_000_000.0]})
+
+    # The replayed state is the one the analyzer would keep: the scale down to C1 waits
+    expected = {"current_config": "C3", "previous_config": "C3"}
+    expected_update, _ = analyzer.handle_state_change(expected, "C1", {"C1": 1.0, "C3": 0.5}, CONFIGURATIONS, stabilization.DEFAULT_SETTINGS, 1_700_000_000.0)
+
+    assert policy.decide("svc", window) == (expected_update, "C3")
+    assert policy.states["svc"] == expected
@@ -0,0 +1,33 @@
+import sharded_controller
+from loop_health import LoopHealth
+
+
+class FakeController:
+    cycle = 1
+    cycle_timeout_s = 300
+
+    def __init__(self, result):
+        self.result = result
+
+    def run_cycle(self):
+        return self.result
+
+
+def test_target_with_a_failed_phase_is_degraded(tmp_path, monkeypatch):
+    monkeypatch.setattr(sharded_controller, "log_file", str(tmp_path / "sharded_controller.log"))
+    # Target a completed its cycle but its monitor phase failed, so service db kept its configuration
+    worker_health = LoopHealth()
+    worker_health.begin_cycle()
+    worker_health.record_phase("monitor", "failed", 1.0, 120)
+    worker_health.record_phase("analyze", "ok", 0.5, 60)
+    worker_health.record_degraded("db", "no data")
+    timings = {"a": {"duration_s": 1.5}, "b": {"duration_s": 0.5}}
+    healths = {"a": worker_health.last_cycle()}
+
+    health = LoopHealth()
+    sharded_controller.run_sharded_cycle(FakeController((2.0, timings, healths, {}, set())), health)
+
+    assert health.last_degraded == {"a/db": "no data", "a": "monitor failed"}
+    assert health.phases["monitor"]["failed"] == 1
+    assert health.phases["analyze"]["ok"] == 1
+    assert health.phases["target_cycle"]["ok"] == 2
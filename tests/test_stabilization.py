@@ -0,0 +1,75 @@
+import stabilization
+
+RANKING = ["C1", "C2", "C3"]
+SETTINGS = stabilization.DEFAULT_SETTINGS
+NOW = 1_700_000_000.0
+
+
+def state(current_config, changed_at=0, **counters):
+    return dict({"current_config": current_config, "previous_config": current_config, "changed_at": changed_at}, **counters)
+
+
+def test_unknown_current_config_moves_right_away():
+    # C9 was removed from the configurations within the dwell time
+    to_update, data, action = stabilization.decide(state("C9", changed_at=NOW - 10), "C1", {"C1": 1.0}, RANKING, SETTINGS, NOW)
+
+    assert to_update and data["current_config"] == "C1" and data["previous_config"] == "C9"
+    assert action == "move: C9 is no longer configured"
+
+
+def test_scale_up_happens_at_once():
+    to_update, data, action = stabilization.decide(state("C1"), "C3", {"C1": 0.2, "C3": 1.0}, RANKING, SETTINGS, NOW)
+
+    assert to_update and action == "scale up"
+    assert data["current_config"] == "C3" and data["previous_config"] == "C1" and data["changed_at"] == NOW
+
+
+def test_scale_down_waits_for_consecutive_cycles():
+    config_state = state("C3")
+    actions = []
+    for cycle in range(SETTINGS["scale_down_cycles"]):
+        to_update, config_state, action = stabilization.decide(config_state, "C1", {"C1": 1.0, "C3": 1.0}, RANKING, SETTINGS, NOW + cycle)
+        actions.append(action)
+
+    assert actions == ["wait: scale down 1/3", "wait: scale down 2/3", "scale down"]
+    assert to_update and config_state["current_config"] == "C1" and config_state["down_cycles"] == 0
+
+
+def test_a_cycle_that_wants_the_current_config_resets_the_scale_down():
+    _, config_state, _ = stabilization.decide(state("C3"), "C1", {"C1": 1.0}, RANKING, SETTINGS, NOW)
+    _, config_state, _ = stabilization.decide(config_state, "C1", {"C1": 1.0}, RANKING, SETTINGS, NOW)
+    _, config_state, action = stabilization.decide(config_state, "C3", {"C3": 1.0}, RANKING, SETTINGS, NOW)
+    to_update, _, action = stabilization.decide(config_state, "C1", {"C1": 1.0}, RANKING, SETTINGS, NOW)
+
+    assert not to_update and action == "wait: scale down 1/3"
+
+
+def test_no_change_within_the_dwell_time():
+    changed_at = NOW - SETTINGS["min_dwell_s"] + 1
+    to_update, data, action = stabilization.decide(state("C1", changed_at), "C3", {"C1": 0.2, "C3": 1.0}, RANKING, SETTINGS, NOW)
+    assert not to_update and action == "wait: dwell time" and data["current_config"] == "C1"
+
+    # Scale down counts its cycles during the dwell time, and moves once the dwell time is over
+    config_state = state("C3", changed_at, down_cycles=SETTINGS["scale_down_cycles"] - 1)
+    to_update, _, action = stabilization.decide(config_state, "C1", {"C1": 1.0}, RANKING, SETTINGS, NOW)
+    assert not to_update and action == "wait: dwell time"
+    to_update, _, action = stabilization.decide(config_state, "C1", {"C1": 1.0}, RANKING, SETTINGS, changed_at + SETTINGS["min_dwell_s"])
+    assert to_update and action == "scale down"
+
+
+def test_scale_up_needs_the_utility_margin():
+    margin = SETTINGS["utility_margin"]
+    to_update, data, action = stabilization.decide(state("C1"), "C2", {"C1": 0.9, "C2": 0.9 + margin / 2}, RANKING, SETTINGS, NOW)
+    assert not to_update and action.startswith("hold: utility gain") and data["current_config"] == "C1"
+
+    to_update, _, action = stabilization.decide(state("C1"), "C2", {"C1": 0.9, "C2": 0.9 + 2 * margin}, RANKING, SETTINGS, NOW)
+    assert to_update and action == "scale up"
+
+
+def test_history_is_bounded():
+    config_state = state("C1")
+    for cycle in range(SETTINGS["history_size"] + 5):
+        _, config_state, _ = stabilization.decide(config_state, "C1", {"C1": 1.0}, RANKING, SETTINGS, NOW + cycle)
+
+    assert len(config_state["history"]) == SETTINGS["history_size"]
+    assert config_state["history"][-1]["time"] == NOW + SETTINGS["history_size"] + 4
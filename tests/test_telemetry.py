@@ -0,0 +1,19 @@
+import telemetry
+
+
+def test_monitor_and_analyzer_keep_their_own_prometheus_file(tmp_path):
+    jsonl_path = str(tmp_path / "cycle_timings.jsonl")
+    prometheus_path = str(tmp_path / "cycle_timings.prom")
+
+    # The driver runs the two scripts one after the other in separate processes
+    for component, phase in [("monitor", "fetch"), ("analyzer", "utility")]:
+        telemetry.begin_cycle(component=component)
+        with telemetry.phase(phase):
+            pass
+        telemetry.end_cycle(jsonl_path, prometheus_path)
+
+    monitor_lines = (tmp_path / "cycle_timings_monitor.prom").read_text()
+    analyzer_lines = (tmp_path / "cycle_timings_analyzer.prom").read_text()
+    assert 'phase="fetch"' in monitor_lines and 'component="monitor"' in monitor_lines
+    assert 'phase="utility"' in analyzer_lines and 'phase="fetch"' not in analyzer_lines
+    assert not (tmp_path / "cycle_timings.prom").exists()
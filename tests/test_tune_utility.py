@@ -0,0 +1,54 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import analyzer
+import tune_utility
+from configuration_table import order_by_cost
+from replay import load_traces
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICE = "acmeair-authservice"
+
+
+def test_tuned_config_round_trips_through_the_analyzer_reload(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / SERVICE)
+    utility_path = str(tmp_path / SERVICE / "analyzer_utility.json")
+    shutil.copy2(os.path.join(ROOT, "configurations", SERVICE, "analyzer_utility.json"), utility_path)
+    monkeypatch.setattr(analyzer, "CONFIGURATIONS_FOLDER", str(tmp_path))
+    monkeypatch.setattr(analyzer, "CONFIGURATION_STATES_FILE", os.path.join(ROOT, "configurations", "configration_states.json"))
+
+    configurations = analyzer.load_configuration_states()
+    trace = load_traces([SERVICE], output_folder=os.path.join(ROOT, "output"))[SERVICE]
+    settings = dict(tune_utility.DEFAULT_TUNING_CONFIG, candidates=90, rounds=3)
+
+    def features(utility_config, trace_capacity_m):
+        return tune_utility.cycle_features(trace, utility_config, trace_capacity_m)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        tuned, report = tune_utility.tune_service(pool, 2, SERVICE, features, configurations, settings, np.random.default_rng(1), True)
+
+    # The current config is a candidate, so the tuned one never scores worse on the training cycles
+    assert report["tuned"]["train"]["objective"] <= report["current"]["train"]["objective"]
+
+    # Apply the tuned file like --apply does; the analyzer's hot reload picks it up and recompiles the model
+    service_config = {"utility_config": analyzer.load_utility_config(SERVICE)}
+    tune_utility.write_utility_config(utility_path, tuned)
+    updates = analyzer.reload_service_config(SERVICE, service_config, configurations)
+
+    assert updates["utility_config"] == tuned and tuned != service_config["utility_config"]
+    model = updates["utility_model"]
+    assert model.config_keys == order_by_cost(configurations)
+
+    # The reloaded model makes the same choices as the tuned parameters it was written from
+    values, demand = features(updates["utility_config"], tune_utility.cpu_capacity(configurations[settings["trace_config"]]))
+    split = max(2, int(len(values) * settings["train_fraction"]))
+    costs = tune_utility.request_costs(configurations, model.config_keys)
+    capacities = np.array([tune_utility.cpu_capacity(configurations[key]) for key in model.config_keys])
+    choices = tune_utility.choose(model.thresholds[None], model.weights[None], model.preferences[None], values[:split])
+    result = tune_utility.score(choices, demand[:split], costs, capacities, settings)
+
+    assert result["objective"][0] == pytest.approx(report["tuned"]["train"]["objective"])
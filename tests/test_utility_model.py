@@ -0,0 +1,103 @@
+import glob
+import json
+import math
+import os
+
+import numpy as np
+import pytest
+
+from utility_model import BANDS, compile_utility_model, evaluate, evaluate_services, stack_utility_models, value_vector
+
+CONFIGURATIONS_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "configurations")
+UTILITY_CONFIG_PATHS = sorted(glob.glob(os.path.join(CONFIGURATIONS_FOLDER, "*", "analyzer_utility.json")))
+
+
+# The if/elif calculate_utility of the analyzer before the utility model was compiled into arrays
+def legacy_calculate_utility(metric_values, utility_config):
+    config_keys = list(utility_config[0]["preferences"]["low"])
+    utility_dict = {key: 0 for key in config_keys}
+
+    for config in utility_config:
+        weight = config["weight"]
+        scaled_thresholds = config["scaled thresholds"]
+        preferences = config["preferences"]
+        metric_value = metric_values[config["name"]]
+
+        if metric_value > scaled_thresholds[2]:
+            band = "very high"
+        elif metric_value <= scaled_thresholds[2] and metric_value > scaled_thresholds[1]:
+            band = "high"
+        elif metric_value <= scaled_thresholds[1] and metric_value > scaled_thresholds[0]:
+            band = "medium"
+        else:
+            band = "low"
+
+        for key in config_keys:
+            utility_dict[key] = utility_dict[key] + weight * preferences[band][key]
+
+    return utility_dict
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Every threshold, a value just below and just above it, values far outside the bands and NaN
+def probe_values(thresholds):
+    values = [-1e9, 1e9, math.nan]
+    for threshold in thresholds:
+        values += [threshold, np.nextafter(threshold, -np.inf), np.nextafter(threshold, np.inf)]
+    return values
+
+
+def probe_samples(utility_config):
+    # One metric is probed at a time, the others take their own probe value in turn
+    per_metric = [probe_values(item["scaled thresholds"]) for item in utility_config]
+    samples = []
+    for m, values in enumerate(per_metric):
+        for i, value in enumerate(values):
+            sample = {item["name"]: per_metric[n][i % len(per_metric[n])] for n, item in enumerate(utility_config)}
+            sample[utility_config[m]["name"]] = value
+            samples.append(sample)
+    return samples
+
+
+def assert_same_utilities(actual, expected):
+    assert list(actual) == list(expected)
+    for key in expected:
+        assert actual[key] == pytest.approx(expected[key], abs=1e-12)
+
+
+@pytest.mark.parametrize("path", UTILITY_CONFIG_PATHS, ids=lambda path: os.path.basename(os.path.dirname(path)))
+def test_compiled_model_matches_the_former_calculate_utility(path):
+    utility_config = load(path)
+    model = compile_utility_model(utility_config)
+
+    for sample in probe_samples(utility_config):
+        utilities = evaluate(model, value_vector(model.metric_names, sample))
+        assert_same_utilities(dict(zip(model.config_keys, utilities.tolist())), legacy_calculate_utility(sample, utility_config))
+
+
+def test_stacked_models_match_the_former_calculate_utility():
+    utility_configs = {os.path.basename(os.path.dirname(path)): load(path) for path in UTILITY_CONFIG_PATHS}
+    stack = stack_utility_models({service: compile_utility_model(config) for service, config in utility_configs.items()})
+    samples = {service: probe_samples(config) for service, config in utility_configs.items()}
+
+    for i in range(max(len(service_samples) for service_samples in samples.values())):
+        metric_values = {service: service_samples[i % len(service_samples)] for service, service_samples in samples.items()}
+        utilities = evaluate_services(stack, metric_values)
+        for service, config in utility_configs.items():
+            assert_same_utilities(utilities[service], legacy_calculate_utility(metric_values[service], config))
+
+
+def test_values_on_a_threshold_stay_in_the_lower_band_and_nan_is_low():
+    utility_config = [{
+        "name": "cpu", "weight": 1.0, "scaled thresholds": [30, 60, 90],
+        "preferences": {band: {"C1": float(b)} for b, band in enumerate(BANDS)}
+    }]
+    model = compile_utility_model(utility_config)
+
+    utilities = [evaluate(model, [value])[0] for value in [30, 30.000001, 60, 90, 90.5, math.nan]]
+
+    assert utilities == [0.0, 1.0, 1.0, 2.0, 3.0, 0.0]
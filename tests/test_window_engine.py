@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from window_engine import WindowEngine
+
+TRACE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "output", "acmeair-authservice_output.csv")
+WINDOW_SIZE = 30
+EWMA_ALPHA = 0.2
+
+
+# The recorded trace with some samples missing, as when a metric is not reported for a while.
+# The engine ignores rows that are not newer than the last folded sample, so the trace has them dropped.
+def load_trace():
+    trace = pd.read_csv(TRACE_PATH)
+    trace = trace[trace["Timestamp"] > trace["Timestamp"].astype(float).cummax().shift(fill_value=-np.inf)].reset_index(drop=True)
+    rng = np.random.default_rng(0)
+    metrics = [column for column in trace.columns if column != "Timestamp"]
+    for metric in metrics:
+        trace.loc[rng.random(len(trace)) < 0.05, metric] = np.nan
+    # A gap longer than the window, so that every sample of the window is missing
+    trace.loc[400:400 + WINDOW_SIZE, metrics[0]] = np.nan
+    return trace, metrics
+
+
+def assert_matches_rolling(engine, trace, metrics, position):
+    window = trace.iloc[max(0, position - WINDOW_SIZE + 1):position + 1]
+    seen = trace.iloc[:position + 1]
+    for metric in metrics:
+        statistics = engine.statistics("auth", metric)
+        rolling = window[metric]
+        expected = {
+            "mean": rolling.mean(),
+            "min": rolling.min(),
+            "max": rolling.max(),
+            "count": rolling.count(),
+            "ewma": seen[metric].ewm(alpha=EWMA_ALPHA, adjust=False, ignore_na=True).mean().iloc[-1]
+        }
+        for statistic, value in expected.items():
+            if pd.isna(value):
+                assert np.isnan(statistics[statistic]), (metric, position, statistic)
+            else:
+                assert statistics[statistic] == pytest.approx(value, rel=1e-9, abs=1e-9), (metric, position, statistic)
+
+
+def test_statistics_match_pandas_rolling_over_a_recorded_trace(tmp_path):
+    trace, metrics = load_trace()
+    columns = list(trace.columns)
+    engine = WindowEngine(WINDOW_SIZE, EWMA_ALPHA, state_path=str(tmp_path / "windows.json"))
+
+    # Fold the trace in with batches of varying size, as the monitor delivers them
+    position = 0
+    for size in [1, 7, 30, 2, 45, 13, 300, 1, 999]:
+        batch = trace.iloc[position:position + size]
+        engine.update("auth", columns, batch.values.tolist())
+        position += len(batch)
+        assert_matches_rolling(engine, trace, metrics, position - 1)
+
+    # Rows that were already folded in are ignored
+    assert engine.update("auth", columns, trace.iloc[:position].values.tolist()) == 0
+
+    rest = trace.iloc[position:]
+    assert engine.update("auth", columns, rest.values.tolist()) == len(rest)
+    assert_matches_rolling(engine, trace, metrics, len(trace) - 1)
+
+
+def test_saved_windows_continue_like_pandas_rolling(tmp_path):
+    trace, metrics = load_trace()
+    columns = list(trace.columns)
+    state_path = str(tmp_path / "windows.json")
+
+    engine = WindowEngine(WINDOW_SIZE, EWMA_ALPHA, state_path=state_path)
+    engine.update("auth", columns, trace.iloc[:1000].values.tolist())
+    engine.save()
+
+    restored = WindowEngine(WINDOW_SIZE, EWMA_ALPHA, state_path=state_path)
+    assert restored.load()
+    restored.update("auth", columns, trace.iloc[1000:1100].values.tolist())
+
+    assert_matches_rolling(restored, trace, metrics, 1099)